@@ -0,0 +1,138 @@
+# backend/adaptive_batch.py
+"""Batched agent execution with an adaptive concurrency limit.
+
+Items run in a sliding window: as soon as one finishes, the next one starts, so a
+slow item never holds up the rest. The window size is adjusted AIMD-style each time
+that many items have finished: it grows by one while per-item latency stays near the
+best seen so far, shrinks by a quarter when latency climbs (upstream is queueing)
+and halves at once on rate-limit feedback (429 errors, or scheduler retries made
+for these items). Results keep input order; a failed item is returned as its
+exception.
+"""
+import asyncio
+import contextvars
+import os
+import statistics
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from scheduler import capture_retries, is_retryable
+
+MAX_BATCH_SIZE = int(os.getenv("AGENT_BATCH_MAX_SIZE", "32"))
+# A window whose median item latency exceeds the baseline by this factor counts as slow
+SLOWDOWN_FACTOR = float(os.getenv("AGENT_BATCH_SLOWDOWN", "1.5"))
+# Faster items (cache hits) say nothing about upstream load
+MIN_LATENCY = 0.01
+
+
+class AdaptiveBatchSize:
+    """Batch size controller; pass the same instance to keep what it learned across calls"""
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = MAX_BATCH_SIZE,
+                 slowdown: float = SLOWDOWN_FACTOR):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.size = max(minimum, min(initial, self.maximum))
+        self.slowdown = slowdown
+        self.baseline = None
+        self.windows = []
+
+    def update(self, latencies: list, rate_limited: bool) -> int:
+        latencies = [seconds for seconds in latencies if seconds >= MIN_LATENCY]
+        latency = statistics.median(latencies) if latencies else None
+        if rate_limited:
+            self.size = max(self.minimum, self.size // 2)
+        elif latency is not None and self.baseline is not None and latency > self.baseline * self.slowdown:
+            self.size = max(self.minimum, self.size - max(1, self.size // 4))
+        else:
+            self.size = min(self.maximum, self.size + 1)
+
+        if latency is not None:
+            # Falls to a new best at once, drifts up slowly so the baseline follows the provider
+            self.baseline = latency if self.baseline is None else min(latency, 0.9 * self.baseline + 0.1 * latency)
+        self.windows.append({"size": self.size, "median_latency": latency, "rate_limited": rate_limited})
+        return self.size
+
+
+class _Window:
+    """Outcomes of the items finished since the last adjustment of sizing"""
+
+    def __init__(self, items: list, sizing: AdaptiveBatchSize):
+        self.sizing = sizing
+        self.results = [None] * len(items)
+        self.latencies = []
+        self.finished = 0
+        self.rate_limited = False
+
+    def add(self, index: int, outcome):
+        # outcome is (result, seconds, retried) or the item's exception
+        if isinstance(outcome, Exception):
+            self.results[index] = outcome
+            self.rate_limited = self.rate_limited or is_retryable(outcome)
+        else:
+            self.results[index], seconds, retried = outcome
+            self.latencies.append(seconds)
+            self.rate_limited = self.rate_limited or retried
+        self.finished += 1
+
+    def adjust(self, last: bool = False):
+        if self.finished and (last or self.rate_limited or self.finished >= self.sizing.size):
+            self.sizing.update(self.latencies, self.rate_limited)
+            self.latencies, self.finished, self.rate_limited = [], 0, False
+
+
+def _timed(func):
+    def run(item):
+        start = time.perf_counter()
+        with capture_retries() as retries:
+            result = func(item)
+        return result, time.perf_counter() - start, bool(retries)
+    return run
+
+
+def _atimed(func):
+    async def run(item):
+        start = time.perf_counter()
+        with capture_retries() as retries:
+            result = await func(item)
+        return result, time.perf_counter() - start, bool(retries)
+    return run
+
+
+def run_batch(func, items: list, sizing: AdaptiveBatchSize) -> list:
+    """func(item) for every item, with up to sizing.size of them running at a time"""
+    run, window = _timed(func), _Window(items, sizing)
+    running, position = {}, 0
+    with ThreadPoolExecutor(max_workers=sizing.maximum) as pool:
+        while position < len(items) or running:
+            while position < len(items) and len(running) < sizing.size:
+                # Each item gets its own copy of the caller's context (priority, client id, capture)
+                running[pool.submit(contextvars.copy_context().run, run, items[position])] = position
+                position += 1
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                window.add(running.pop(future), error if isinstance(error, Exception) else future.result())
+            window.adjust()
+    window.adjust(last=True)
+    return window.results
+
+
+async def arun_batch(afunc, items: list, sizing: AdaptiveBatchSize) -> list:
+    run, window = _atimed(afunc), _Window(items, sizing)
+    running, position = {}, 0
+    try:
+        while position < len(items) or running:
+            while position < len(items) and len(running) < sizing.size:
+                running[asyncio.ensure_future(run(items[position]))] = position
+                position += 1
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                window.add(running.pop(task), error if isinstance(error, Exception) else task.result())
+            window.adjust()
+    finally:
+        for task in running:
+            task.cancel()
+    window.adjust(last=True)
+    return window.results
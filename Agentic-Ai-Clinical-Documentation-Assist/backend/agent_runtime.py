@@ -0,0 +1,497 @@
+# backend/agent_runtime.py
+"""Execution core for agent LLM calls.
+
+Every call runs the middleware hooks (metrics, exact and near-duplicate response
+cache by default), is coalesced with identical in-flight calls, goes through the
+request scheduler and, with a HedgePolicy, is retried or hedged when the upstream
+call fails or is slow.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import cached_property
+
+from metrics import AgentCall
+from near_duplicate import get_near_duplicate_index
+from response_cache import get_response_cache, make_cache_key
+from scheduler import get_scheduler, is_retryable
+from single_flight import SingleFlight
+from text_utils import count_tokens
+
+# Completion tokens assumed per call when reserving tokens-per-minute budget;
+# the reservation is corrected with the provider's reported usage afterwards.
+COMPLETION_TOKEN_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKEN_ESTIMATE", "800"))
+
+_in_flight = SingleFlight()
+
+
+class AgentTimeoutError(TimeoutError):
+    """An agent call did not finish within its timeout"""
+
+
+def extract_text(result) -> str:
+    """Unwrap the text content from a chain result (message, chunk, dict or string)"""
+    content = getattr(result, "content", None)
+    if type(content) is str:
+        return content
+    if content is not None:
+        # Content blocks: keep the text parts
+        return "".join(block if isinstance(block, str) else block.get("text", "") for block in content)
+    if isinstance(result, str):
+        return result
+    if isinstance(result, dict):
+        for key in ("content", "text", "response"):
+            if key in result:
+                return result[key]
+    return str(result)
+
+
+def _model_name(chain) -> str:
+    llm = chain.last
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+def _cache_key(chain, agent: str, inputs: dict) -> str:
+    template = getattr(chain.first, "template", "")
+    return make_cache_key(agent, template, _model_name(chain), inputs)
+
+
+def prompt_tokens(chain, inputs: dict) -> int:
+    """Tokens in the prompt of a chain, or of a bare prompt template"""
+    try:
+        prompt = getattr(chain, "first", chain).format(**inputs)
+    except (AttributeError, KeyError):
+        prompt = " ".join(str(value) for value in inputs.values())
+    return count_tokens(prompt)
+
+
+def reported_tokens(result):
+    usage = getattr(result, "usage_metadata", None)
+    return usage.get("total_tokens") if usage else None
+
+
+def _record_usage(call: AgentCall, usage, text: str):
+    # Provider-reported usage when available, otherwise keep the prompt estimate
+    if usage:
+        call.prompt_tokens = usage.get("input_tokens", call.prompt_tokens)
+        call.completion_tokens = usage.get("output_tokens", 0)
+    else:
+        call.completion_tokens = count_tokens(text)
+
+
+class AgentRequest:
+    """One agent LLM call, as seen by middleware"""
+
+    def __init__(self, chain, inputs: dict, agent: str, use_cache: bool):
+        self.chain = chain
+        self.inputs = inputs
+        self.agent = agent
+        self.use_cache = use_cache
+
+    @cached_property
+    def key(self) -> str:
+        # Identifies the response in the cache and identical calls in flight
+        return _cache_key(self.chain, self.agent, self.inputs)
+
+
+class Middleware:
+    """Hooks run around every agent LLM call.
+
+    lookup() may answer the call without going upstream, store() sees each fresh
+    upstream response and finish() runs once per call, with the error if it failed.
+    Async calls use alookup()/astore(), which a layer overrides to keep slow work off
+    the event loop.
+    """
+
+    def lookup(self, call: AgentCall, request: AgentRequest):
+        return None
+
+    def store(self, call: AgentCall, request: AgentRequest, text: str):
+        pass
+
+    async def alookup(self, call: AgentCall, request: AgentRequest):
+        return self.lookup(call, request)
+
+    async def astore(self, call: AgentCall, request: AgentRequest, text: str):
+        self.store(call, request, text)
+
+    def finish(self, call: AgentCall, request: AgentRequest, error: BaseException = None):
+        pass
+
+
+class ResponseCacheMiddleware(Middleware):
+    def lookup(self, call, request):
+        with call.stage("cache"):
+            cache = get_response_cache()
+            if cache is None:
+                return None
+            cached = cache.get(request.key) if request.use_cache else None
+        call.cache = "hit" if cached is not None else ("miss" if request.use_cache else "bypass")
+        return cached
+
+    def store(self, call, request, text):
+        cache = get_response_cache()
+        if cache is not None:
+            with call.stage("handling"):
+                cache.set(request.key, text)
+
+
+class NearDuplicateMiddleware(Middleware):
+    """Reuses the response to a near-identical earlier input; runs after an exact cache miss"""
+
+    def lookup(self, call, request):
+        index = get_near_duplicate_index()
+        if index is None or not request.use_cache or get_response_cache() is None:
+            return None
+        threshold = index.threshold(request.agent)
+        if not threshold:
+            return None
+        with call.stage("cache"):
+            match = index.find(*self._scope_and_text(request), threshold)
+        if match is None:
+            return None
+        call.cache = "near"
+        return match[0]
+
+    def store(self, call, request, text):
+        index = get_near_duplicate_index()
+        if index is not None and index.threshold(request.agent):
+            with call.stage("handling"):
+                index.add(*self._scope_and_text(request), text)
+
+    # MinHash over 128 permutations is pure Python: run it in a worker thread
+    async def alookup(self, call, request):
+        return await asyncio.to_thread(self.lookup, call, request)
+
+    async def astore(self, call, request, text):
+        await asyncio.to_thread(self.store, call, request, text)
+
+    @staticmethod
+    def _scope_and_text(request: AgentRequest):
+        # The longest input is the free text compared by similarity; the rest must match exactly
+        field = max(request.inputs, key=lambda name: len(str(request.inputs[name])))
+        others = {name: value for name, value in request.inputs.items() if name != field}
+        return _cache_key(request.chain, request.agent, others), str(request.inputs[field])
+
+
+class MetricsMiddleware(Middleware):
+    def finish(self, call, request, error=None):
+        call.finish(error)
+
+
+DEFAULT_MIDDLEWARE = (MetricsMiddleware(), ResponseCacheMiddleware(), NearDuplicateMiddleware())
+
+
+class HedgePolicy:
+    """Extra upstream attempts for one call; attempts counts the original call.
+
+    The next attempt starts when the previous one fails, or after `after` seconds
+    without a response (0 = only on failure). The first successful attempt wins and
+    the others are abandoned. Rate limits are already retried by the scheduler.
+    """
+
+    def __init__(self, attempts: int = 1, after: float = 0):
+        self.attempts = max(1, attempts)
+        self.after = after
+
+    @classmethod
+    def from_env(cls):
+        return cls(int(os.getenv("AGENT_ATTEMPTS", "1")), float(os.getenv("AGENT_HEDGE_AFTER", "0")))
+
+    @property
+    def enabled(self) -> bool:
+        return self.attempts > 1
+
+    def next_wait(self, started: int):
+        """Seconds to wait for a response before starting another attempt; None waits indefinitely"""
+        if started < self.attempts and self.after > 0:
+            return self.after
+        return None
+
+
+def _worth_retrying(error: BaseException) -> bool:
+    # Client errors (bad request, auth) fail the same way on every attempt
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return status is None or status >= 500 or is_retryable(error)
+
+
+def _hedged(func, policy: HedgePolicy):
+    if policy is None or not policy.enabled:
+        return func()
+    pending, started, error = set(), 0, None
+    while True:
+        if started < policy.attempts:
+            future = Future()
+            _start_thread(func, future)
+            pending.add(future)
+            started += 1
+        done, pending = wait(pending, timeout=policy.next_wait(started), return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+            if not _worth_retrying(error):
+                raise error
+        if not pending and started >= policy.attempts:
+            raise error
+
+
+async def _ahedged(func, policy: HedgePolicy):
+    if policy is None or not policy.enabled:
+        return await func()
+    pending, started, error = set(), 0, None
+    try:
+        while True:
+            if started < policy.attempts:
+                pending.add(asyncio.ensure_future(func()))
+                started += 1
+            done, pending = await asyncio.wait(pending, timeout=policy.next_wait(started),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            errors = {task: task.exception() for task in done}
+            for task, task_error in errors.items():
+                if task_error is None:
+                    return task.result()
+            for task_error in errors.values():
+                error = task_error
+                if not _worth_retrying(error):
+                    raise error
+            if not pending and started >= policy.attempts:
+                raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _start_thread(func, future: Future):
+    def run():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(func())
+            except BaseException as e:
+                future.set_exception(e)
+
+    # Copy the caller's scheduler priority and client id onto the thread
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), daemon=True).start()
+
+
+def call_with_timeout(func, timeout: float):
+    """func() on a helper thread, raising AgentTimeoutError after timeout seconds.
+
+    A timed-out call cannot be interrupted; it finishes in the background and its
+    response is still cached.
+    """
+    if not timeout:
+        return func()
+    future = Future()
+    _start_thread(func, future)
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        raise AgentTimeoutError(f"agent call timed out after {timeout}s") from None
+
+
+async def acall_with_timeout(awaitable, timeout: float):
+    if not timeout:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise AgentTimeoutError(f"agent call timed out after {timeout}s") from None
+
+
+async def astream_with_timeout(chunks, timeout: float):
+    """Re-yield chunks, cancelling the stream once timeout seconds have passed in total"""
+    if not timeout:
+        async for chunk in chunks:
+            yield chunk
+        return
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    iterator = chunks.__aiter__()
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), max(0.0, deadline - loop.time()))
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise AgentTimeoutError(f"agent stream timed out after {timeout}s") from None
+            yield chunk
+    finally:
+        await iterator.aclose()
+
+
+def _lookup(call: AgentCall, request: AgentRequest, middleware):
+    for layer in middleware:
+        text = layer.lookup(call, request)
+        if text is not None:
+            return text
+    return None
+
+
+async def _alookup(call: AgentCall, request: AgentRequest, middleware):
+    for layer in middleware:
+        text = await layer.alookup(call, request)
+        if text is not None:
+            return text
+    return None
+
+
+def _store(call: AgentCall, request: AgentRequest, middleware, text: str, usage):
+    with call.stage("handling"):
+        _record_usage(call, usage, text)
+    for layer in middleware:
+        layer.store(call, request, text)
+
+
+async def _astore(call: AgentCall, request: AgentRequest, middleware, text: str, usage):
+    with call.stage("handling"):
+        _record_usage(call, usage, text)
+    for layer in middleware:
+        await layer.astore(call, request, text)
+
+
+def _finish(call: AgentCall, request: AgentRequest, middleware, error: BaseException = None):
+    for layer in reversed(middleware):
+        layer.finish(call, request, error)
+
+
+def _reservation(call: AgentCall, chain, inputs: dict) -> int:
+    with call.stage("prompt"):
+        call.prompt_tokens = prompt_tokens(chain, inputs)
+    return call.prompt_tokens + COMPLETION_TOKEN_ESTIMATE
+
+
+def _joined(call: AgentCall, leader: bool):
+    # Followers share the leader's upstream call; its tokens are only counted once
+    if not leader:
+        call.cache = "coalesced"
+
+
+def invoke_chain(chain, inputs: dict, agent: str = "", use_cache: bool = True,
+                 middleware=DEFAULT_MIDDLEWARE, hedge: HedgePolicy = None) -> str:
+    """Run a chain synchronously through the request scheduler.
+
+    With use_cache=False the cached response is bypassed and replaced by a fresh one.
+    Identical concurrent calls share one upstream request.
+    """
+    call = AgentCall(agent, _model_name(chain))
+    request = AgentRequest(chain, inputs, agent, use_cache)
+
+    def upstream():
+        tokens = _reservation(call, chain, inputs)
+        result = _hedged(
+            lambda: get_scheduler().call(lambda: chain.invoke(inputs), tokens, reported_tokens, call.timings), hedge)
+        with call.stage("handling"):
+            text = extract_text(result)
+        _store(call, request, middleware, text, getattr(result, "usage_metadata", None))
+        return text
+
+    try:
+        text = _lookup(call, request, middleware)
+        if text is None:
+            text, leader = _in_flight.do(request.key, upstream)
+            _joined(call, leader)
+    except Exception as e:
+        _finish(call, request, middleware, e)
+        raise
+    _finish(call, request, middleware)
+    return text
+
+
+async def ainvoke_chain(chain, inputs: dict, agent: str = "", use_cache: bool = True,
+                        middleware=DEFAULT_MIDDLEWARE, hedge: HedgePolicy = None) -> str:
+    """Run a chain on the event loop through the request scheduler"""
+    call = AgentCall(agent, _model_name(chain))
+    request = AgentRequest(chain, inputs, agent, use_cache)
+
+    async def upstream():
+        tokens = _reservation(call, chain, inputs)
+        result = await _ahedged(
+            lambda: get_scheduler().acall(lambda: chain.ainvoke(inputs), tokens, reported_tokens, call.timings),
+            hedge)
+        with call.stage("handling"):
+            text = extract_text(result)
+        await _astore(call, request, middleware, text, getattr(result, "usage_metadata", None))
+        return text
+
+    try:
+        text = await _alookup(call, request, middleware)
+        if text is None:
+            text, leader = await _in_flight.ado(request.key, upstream)
+            _joined(call, leader)
+    except BaseException as e:  # includes CancelledError from a timeout
+        _finish(call, request, middleware, e)
+        raise
+    _finish(call, request, middleware)
+    return text
+
+
+def stream_chain(chain, inputs: dict, agent: str = "", use_cache: bool = True, middleware=DEFAULT_MIDDLEWARE):
+    """Yield text chunks as the model produces them; a cache hit is yielded whole.
+
+    Concurrent identical streams share one upstream stream; late joiners get a replay.
+    Streams are not hedged: the scheduler already retries them until the first chunk.
+    """
+    call = AgentCall(agent, _model_name(chain))
+    request = AgentRequest(chain, inputs, agent, use_cache)
+
+    def upstream():
+        tokens = _reservation(call, chain, inputs)
+        chunks, usage = [], None
+        for chunk in get_scheduler().stream(lambda: chain.stream(inputs), tokens, call.timings):
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            text = extract_text(chunk)
+            if text:
+                chunks.append(text)
+                yield text
+        _store(call, request, middleware, "".join(chunks), usage)
+
+    try:
+        cached = _lookup(call, request, middleware)
+        if cached is not None:
+            yield cached
+        else:
+            chunks, leader = _in_flight.stream(request.key, upstream)
+            _joined(call, leader)
+            yield from chunks
+    except BaseException as e:  # includes GeneratorExit when the client disconnects
+        _finish(call, request, middleware, e)
+        raise
+    _finish(call, request, middleware)
+
+
+async def astream_chain(chain, inputs: dict, agent: str = "", use_cache: bool = True,
+                        middleware=DEFAULT_MIDDLEWARE):
+    """Async variant of stream_chain"""
+    call = AgentCall(agent, _model_name(chain))
+    request = AgentRequest(chain, inputs, agent, use_cache)
+
+    async def upstream():
+        tokens = _reservation(call, chain, inputs)
+        chunks, usage = [], None
+        async for chunk in get_scheduler().astream(lambda: chain.astream(inputs), tokens, call.timings):
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            text = extract_text(chunk)
+            if text:
+                chunks.append(text)
+                yield text
+        await _astore(call, request, middleware, "".join(chunks), usage)
+
+    try:
+        cached = await _alookup(call, request, middleware)
+        if cached is not None:
+            yield cached
+        else:
+            chunks, leader = _in_flight.astream(request.key, upstream)
+            _joined(call, leader)
+            async for chunk in chunks:
+                yield chunk
+    except BaseException as e:  # includes GeneratorExit / CancelledError on disconnect
+        _finish(call, request, middleware, e)
+        raise
+    _finish(call, request, middleware)
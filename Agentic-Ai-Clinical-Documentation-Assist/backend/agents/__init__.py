@@ -0,0 +1,39 @@
+# backend/agents/__init__.py
+"""Process-wide agent instances, imported and built on first use.
+
+Agent modules pull in LangChain, so the API and the Streamlit app only pay for
+the agents a request or tab actually touches. Import and construction times are
+kept in construction_times for the startup report.
+"""
+import importlib
+import threading
+import time
+
+AGENT_CLASSES = {
+    "preparation": ("agents.preparation_agent", "PreparationAgent"),
+    "dialogue": ("agents.dialogue_agent", "DialogueAgent"),
+    "note_generator": ("agents.note_generator_agent", "NoteGeneratorAgent"),
+    "coder": ("agents.coder_agent", "CoderAgent"),
+}
+
+construction_times = {}
+_instances = {}
+_lock = threading.Lock()
+
+
+def get_agent(name: str, *args):
+    """Shared agent for name (and constructor args, e.g. the dialogue specialty)"""
+    key = (name,) + args
+    agent = _instances.get(key)
+    if agent is not None:
+        return agent
+
+    with _lock:
+        agent = _instances.get(key)
+        if agent is None:
+            module_name, class_name = AGENT_CLASSES[name]
+            start = time.perf_counter()
+            agent_cls = getattr(importlib.import_module(module_name), class_name)
+            agent = _instances[key] = agent_cls(*args)
+            construction_times[":".join(key)] = time.perf_counter() - start
+        return agent
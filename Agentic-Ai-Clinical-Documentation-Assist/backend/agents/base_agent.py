@@ -0,0 +1,263 @@
+# agents/base_agent.py
+"""Execution core shared by the four agents.
+
+A subclass sets its prompts and implements inputs(); it overrides the execute_*
+methods only when one call is more than one prompt (e.g. chunked dialogue analysis).
+Every LLM call goes through agent_runtime with the agent's middleware and hedge
+policy. Where the cascade router allows it, a non-streaming call is first answered
+by the small model and repeated on the large one if rejection() objects to the
+answer. The entry points (run, arun, *_structured, stream, astream, *run_batch) add
+the per-call timeout and the agent's error policy.
+"""
+import os
+from functools import cached_property
+
+from adaptive_batch import AdaptiveBatchSize, run_batch, arun_batch
+from cascade import CascadeRouter, rejection_reason
+from llm_setup import get_llm
+from metrics import agent_cascade
+from agent_runtime import (DEFAULT_MIDDLEWARE, HedgePolicy, acall_with_timeout, ainvoke_chain, astream_chain,
+                           astream_with_timeout, call_with_timeout, invoke_chain, prompt_tokens, stream_chain)
+from structured_output import invoke_structured, ainvoke_structured
+
+# Seconds allowed per agent call (0 = no limit)
+AGENT_TIMEOUT = float(os.getenv("AGENT_TIMEOUT", "0"))
+# Starting batch size (and concurrency) of run_batch/arun_batch
+BATCH_CONCURRENCY = int(os.getenv("AGENT_BATCH_CONCURRENCY", "4"))
+
+
+class BaseAgent:
+    name = ""  # label for metrics and response cache keys
+    template = None
+    structured_prompt = None
+    repair_prompt = None
+    output_model = None
+    # When set, run/arun/stream return "<error_prefix>: <error>" instead of raising
+    error_prefix = None
+
+    def __init__(self, timeout: float = None, hedge: HedgePolicy = None, middleware=None,
+                 cascade: CascadeRouter = None):
+        self.timeout = AGENT_TIMEOUT if timeout is None else timeout
+        self.hedge = hedge or HedgePolicy.from_env()
+        self.middleware = DEFAULT_MIDDLEWARE if middleware is None else tuple(middleware)
+        self.cascade = cascade or CascadeRouter.from_env()
+
+    @cached_property
+    def llm(self):
+        return get_llm()  # Uses Groq-hosted model via ChatGroq; created on first use
+
+    @cached_property
+    def chain(self):
+        return self.template | self.llm
+
+    @cached_property
+    def structured_chain(self):
+        return self.structured_prompt | self.llm
+
+    @cached_property
+    def repair_chain(self):
+        return self.repair_prompt | self.llm
+
+    @cached_property
+    def small_llm(self):
+        return get_llm(self.cascade.small_model)
+
+    @cached_property
+    def small_chain(self):
+        return self.template | self.small_llm
+
+    @cached_property
+    def small_structured_chain(self):
+        return self.structured_prompt | self.small_llm
+
+    def inputs(self, text: str) -> dict:
+        raise NotImplementedError
+
+    def postprocess(self, text: str) -> str:
+        return text
+
+    def postprocess_structured(self, result):
+        return result
+
+    def filter_stream(self, chunks):
+        return chunks
+
+    def afilter_stream(self, chunks):
+        return chunks
+
+    def rejection(self, text: str, inputs: dict):
+        """Why a small-model answer cannot stand in for the large model's, or None"""
+        source = "\n".join([self.template.template, *map(str, inputs.values())])
+        return rejection_reason(text, self.template.template, source)
+
+    # -- single LLM calls with this agent's middleware and hedging ---------------------
+
+    def invoke(self, chain, inputs: dict, use_cache: bool = True, agent: str = None) -> str:
+        return invoke_chain(chain, inputs, agent or self.name, use_cache, self.middleware, self.hedge)
+
+    async def ainvoke(self, chain, inputs: dict, use_cache: bool = True, agent: str = None) -> str:
+        return await ainvoke_chain(chain, inputs, agent or self.name, use_cache, self.middleware, self.hedge)
+
+    def stream_chain(self, chain, inputs: dict, use_cache: bool = True, agent: str = None):
+        return stream_chain(chain, inputs, agent or self.name, use_cache, self.middleware)
+
+    def astream_chain(self, chain, inputs: dict, use_cache: bool = True, agent: str = None):
+        return astream_chain(chain, inputs, agent or self.name, use_cache, self.middleware)
+
+    def invoke_structured(self, inputs: dict, use_cache: bool = True):
+        if self._starts_small(self.structured_prompt, inputs):
+            try:
+                result = invoke_structured(self.small_structured_chain, None, inputs, self.output_model, self.name,
+                                           use_cache, max_repairs=0, middleware=self.middleware, hedge=self.hedge)
+                return self._answered_small(result)
+            except Exception as e:
+                self._escalated(type(e).__name__)
+        return invoke_structured(self.structured_chain, self.repair_chain, inputs, self.output_model, self.name,
+                                 use_cache, middleware=self.middleware, hedge=self.hedge)
+
+    async def ainvoke_structured(self, inputs: dict, use_cache: bool = True):
+        if self._starts_small(self.structured_prompt, inputs):
+            try:
+                result = await ainvoke_structured(self.small_structured_chain, None, inputs, self.output_model,
+                                                  self.name, use_cache, max_repairs=0, middleware=self.middleware,
+                                                  hedge=self.hedge)
+                return self._answered_small(result)
+            except Exception as e:
+                self._escalated(type(e).__name__)
+        return await ainvoke_structured(self.structured_chain, self.repair_chain, inputs, self.output_model,
+                                        self.name, use_cache, middleware=self.middleware, hedge=self.hedge)
+
+    # -- model cascade -----------------------------------------------------------------
+
+    def generate(self, inputs: dict, use_cache: bool = True) -> str:
+        """Answer from the main template, small model first where the cascade allows"""
+        text = self._try_small(inputs, use_cache)
+        return text if text is not None else self.invoke(self.chain, inputs, use_cache)
+
+    async def agenerate(self, inputs: dict, use_cache: bool = True) -> str:
+        text = await self._atry_small(inputs, use_cache)
+        return text if text is not None else await self.ainvoke(self.chain, inputs, use_cache)
+
+    def _try_small(self, inputs: dict, use_cache: bool):
+        """The small model's answer if it was tried and accepted, otherwise None"""
+        if not self._starts_small(self.template, inputs):
+            return None
+        try:
+            text = self.invoke(self.small_chain, inputs, use_cache)
+        except Exception as e:
+            return self._escalated(type(e).__name__)
+        reason = self.rejection(text, inputs)
+        return self._answered_small(text) if reason is None else self._escalated(reason)
+
+    async def _atry_small(self, inputs: dict, use_cache: bool):
+        if not self._starts_small(self.template, inputs):
+            return None
+        try:
+            text = await self.ainvoke(self.small_chain, inputs, use_cache)
+        except Exception as e:
+            return self._escalated(type(e).__name__)
+        reason = self.rejection(text, inputs)
+        return self._answered_small(text) if reason is None else self._escalated(reason)
+
+    def _starts_small(self, prompt, inputs: dict) -> bool:
+        # Prompt tokens are only counted for agents the cascade covers
+        small = self.cascade.covers(self.name) and self.cascade.starts_small(self.name, prompt_tokens(prompt, inputs))
+        if not small:
+            agent_cascade.inc(agent=self.name, tier="large")
+        return small
+
+    def _answered_small(self, result):
+        agent_cascade.inc(agent=self.name, tier="small")
+        return result
+
+    def _escalated(self, reason: str):
+        """reason: the small model's exception type or the answer's rejection reason"""
+        agent_cascade.inc(agent=self.name, tier="escalated", reason=reason)
+        return None
+
+    # -- execution core ----------------------------------------------------------------
+
+    def execute(self, text: str, use_cache: bool = True) -> str:
+        return self.postprocess(self.generate(self.inputs(text), use_cache))
+
+    async def aexecute(self, text: str, use_cache: bool = True) -> str:
+        return self.postprocess(await self.agenerate(self.inputs(text), use_cache))
+
+    def execute_structured(self, text: str, use_cache: bool = True):
+        return self.postprocess_structured(self.invoke_structured(self.inputs(text), use_cache))
+
+    async def aexecute_structured(self, text: str, use_cache: bool = True):
+        return self.postprocess_structured(await self.ainvoke_structured(self.inputs(text), use_cache))
+
+    def execute_stream(self, text: str, use_cache: bool = True):
+        # No cascade: a small-model answer can only be checked once complete, which
+        # would hold back the first tokens until then
+        return self.filter_stream(self.stream_chain(self.chain, self.inputs(text), use_cache))
+
+    def aexecute_stream(self, text: str, use_cache: bool = True):
+        return self.afilter_stream(self.astream_chain(self.chain, self.inputs(text), use_cache))
+
+    # -- entry points ------------------------------------------------------------------
+
+    def run(self, text: str, use_cache: bool = True, raise_errors: bool = False) -> str:
+        try:
+            return call_with_timeout(lambda: self.execute(text, use_cache), self.timeout)
+        except Exception as e:
+            return self._failed(e, raise_errors)
+
+    async def arun(self, text: str, use_cache: bool = True, raise_errors: bool = False) -> str:
+        try:
+            return await acall_with_timeout(self.aexecute(text, use_cache), self.timeout)
+        except Exception as e:
+            return self._failed(e, raise_errors)
+
+    def run_structured(self, text: str, use_cache: bool = True):
+        # Failures always raise: there is no meaningful structured result for an error
+        return call_with_timeout(lambda: self.execute_structured(text, use_cache), self.timeout)
+
+    async def arun_structured(self, text: str, use_cache: bool = True):
+        return await acall_with_timeout(self.aexecute_structured(text, use_cache), self.timeout)
+
+    def stream(self, text: str, use_cache: bool = True):
+        """Text chunks as they are generated; the timeout is left to the HTTP client here"""
+        try:
+            yield from self.execute_stream(text, use_cache)
+        except Exception as e:
+            yield self._failed(e)
+
+    async def astream(self, text: str, use_cache: bool = True):
+        try:
+            async for chunk in astream_with_timeout(self.aexecute_stream(text, use_cache), self.timeout):
+                yield chunk
+        except Exception as e:
+            yield self._failed(e)
+
+    def run_batch(self, texts: list, use_cache: bool = True, max_concurrency: int = None,
+                  adaptive: bool = True, sizing: AdaptiveBatchSize = None) -> list:
+        """run() over texts with up to max_concurrency running at a time; results are in input order.
+
+        A failed item is returned as its exception. With adaptive=True the concurrency
+        starts at max_concurrency and follows observed latency and rate limits; pass
+        sizing to keep the learned size across calls.
+        """
+        return run_batch(lambda text: self.run(text, use_cache, raise_errors=True), texts,
+                         sizing or self._sizing(max_concurrency, adaptive))
+
+    async def arun_batch(self, texts: list, use_cache: bool = True, max_concurrency: int = None,
+                         adaptive: bool = True, sizing: AdaptiveBatchSize = None) -> list:
+        return await arun_batch(lambda text: self.arun(text, use_cache, raise_errors=True), texts,
+                                sizing or self._sizing(max_concurrency, adaptive))
+
+    def _sizing(self, max_concurrency: int, adaptive: bool) -> AdaptiveBatchSize:
+        size = max_concurrency or BATCH_CONCURRENCY
+        return AdaptiveBatchSize(size) if adaptive else AdaptiveBatchSize(size, minimum=size, maximum=size)
+
+    def failed(self, output) -> bool:
+        """Whether output is this agent's error text (see error_prefix) rather than a result"""
+        return self.error_prefix is not None and isinstance(output, str) and output.startswith(f"{self.error_prefix}: ")
+
+    def _failed(self, error: Exception, raise_errors: bool = False) -> str:
+        if raise_errors or self.error_prefix is None:
+            raise error
+        return f"{self.error_prefix}: {error}"
+
@@ -1,16 +1,27 @@
-from llm_setup import get_llm
-from langchain.prompts import PromptTemplate
-
-class CoderAgent:
-    def __init__(self):
-        self.llm = get_llm()  # Uses Groq-hosted model via ChatGroq
-        self.template = PromptTemplate(
-            input_variables=["structured_data"],
-            template="""
+from langchain_core.prompts import PromptTemplate
+from agents.base_agent import BaseAgent
+from code_index import empty_code_index, get_code_index, malformed_codes
+from schemas import BillingCodes
+from structured_output import structured_prompt, repair_prompt
+
+STRUCTURED_INSTRUCTIONS = """
+You are a medical billing expert. Assign ICD-11 codes, CPT codes and an E/M level for the
+following structured clinical data (plain text), with a short rationale for each:
+
+{structured_data}
+
+{candidate_codes}
+"""
+
+TEMPLATE = PromptTemplate(
+    input_variables=["structured_data", "candidate_codes"],
+    template="""
 You are a medical billing expert. Given the following structured clinical data (plain text):
 
 {structured_data}
 
+{candidate_codes}
+
 Your task:
 - DO NOT repeat the input verbatim.
 - Summarize and rephrase the information in your own words.
@@ -40,29 +51,42 @@ Respond in this structured format:
 
 Use professional medical language and ensure each section is clearly separated.
 """
-        )
-        self.chain = self.template | self.llm
-
-    def run(self, structured_data: str) -> str:
-        try:
-            result = self.chain.invoke({"structured_data": structured_data})
-            
-            # Handle AIMessage objects (from LangChain)
-            if hasattr(result, 'content'):
-                return result.content
-            # Handle dictionaries
-            elif isinstance(result, dict):
-                if 'content' in result:
-                    return result['content']
-                elif 'text' in result:
-                    return result['text']
-                elif 'response' in result:
-                    return result['response']
-                else:
-                    return str(result)
-            elif isinstance(result, str):
-                return result
-            else:
-                return str(result)
-        except Exception as e:
-            return f"Error generating codes: {str(e)}"
+)
+
+STRUCTURED_PROMPT = structured_prompt(STRUCTURED_INSTRUCTIONS, BillingCodes)
+REPAIR_PROMPT = repair_prompt(BillingCodes)
+
+
+class CoderAgent(BaseAgent):
+    name = "coder"
+    template = TEMPLATE
+    structured_prompt = STRUCTURED_PROMPT
+    repair_prompt = REPAIR_PROMPT
+    output_model = BillingCodes
+    error_prefix = "Error generating codes"
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        # Without a local code index nothing can be verified, so every code is withheld
+        # (fail closed) and the output says so; see code_index.py to build one
+        self.code_index = get_code_index() or empty_code_index()
+
+    def inputs(self, text: str) -> dict:
+        # Retrieved candidates turn code generation into picking from a short list
+        return {"structured_data": text, "candidate_codes": self.code_index.candidates_text(text)}
+
+    def rejection(self, text: str, inputs: dict):
+        return super().rejection(text, inputs) or ("malformed_code" if malformed_codes(text) else None)
+
+    def postprocess(self, text: str) -> str:
+        # Codes that are malformed or missing from the index never leave the service
+        return self.code_index.filter_markdown(text)
+
+    def postprocess_structured(self, result: BillingCodes) -> BillingCodes:
+        return self.code_index.filter_codes(result)
+
+    def filter_stream(self, chunks):
+        return self.code_index.filter_stream(chunks)
+
+    def afilter_stream(self, chunks):
+        return self.code_index.afilter_stream(chunks)
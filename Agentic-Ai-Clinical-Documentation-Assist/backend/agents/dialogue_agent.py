@@ -34,17 +34,36 @@
 #         })
 # agents/dialogue_agent.py
 
-from llm_setup import get_llm
-from langchain.prompts import PromptTemplate
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 
-class DialogueAgent:
-    def __init__(self, clinician_specialty: str = "general"):
-        self.clinician_specialty = clinician_specialty
-        self.llm = get_llm()  # Uses Groq-hosted model via ChatGroq
+from langchain_core.prompts import PromptTemplate
+from agents.base_agent import BaseAgent
+from agent_runtime import acall_with_timeout, call_with_timeout
+from schemas import DialogueAnalysis
+from structured_output import structured_prompt, repair_prompt
+from text_utils import count_tokens, split_turns, chunk_turns, parse_sections, merge_sections, render_sections
+
+# Transcripts longer than this (estimated tokens) are analyzed in overlapping chunks
+CHUNK_TOKENS = 2500
+CHUNK_OVERLAP_TOKENS = 150
+MAX_CHUNK_WORKERS = 8
 
-        self.template = PromptTemplate(
-            input_variables=["conversation_text", "specialty"],
-            template="""
+STRUCTURED_INSTRUCTIONS = """
+You are a {specialty} specialist. Analyze the following clinician-patient conversation (plain text):
+
+{conversation_text}
+
+List information that should have been collected but was not, clinical alerts (concerning
+symptoms, red flags, urgent issues), and the symptoms, medications, allergies and conditions
+discussed. Use your own words and do not repeat the input verbatim.
+"""
+
+TEMPLATE = PromptTemplate(
+    input_variables=["conversation_text", "specialty"],
+    template="""
 You are a {specialty} specialist. Analyze the following clinician-patient conversation (plain text):
 
 {conversation_text}
@@ -87,30 +106,176 @@ Respond in this structured format:
 
 Use professional medical language and ensure each section is clearly separated.
 """
-        )
-        self.chain = self.template | self.llm
+)
+
+UPDATE_TEMPLATE = PromptTemplate(
+    input_variables=["current_analysis", "context_turns", "new_turns", "specialty"],
+    template="""
+You are a {specialty} specialist keeping a running analysis of a live clinician-patient conversation.
+
+Current analysis (from earlier in the conversation):
+
+{current_analysis}
+
+Earlier turns, for context only:
+
+{context_turns}
+
+New turns since the current analysis:
+
+{new_turns}
+
+Your task:
+- Update the current analysis using the new turns.
+- Keep every item from the current analysis that is still valid.
+- Remove missing elements that the new turns have now covered.
+- Do not invent information. If a section has no information, state 'Not provided'.
+
+Respond with the complete updated analysis in this structured format:
 
-    def run(self, conversation_text: str) -> str:
-        result = self.chain.invoke({
-            "conversation_text": conversation_text,
+**Patient Information:**
+- Name: <name if available>
+- Age: <age if available>
+- Gender: <gender if available>
+- Date of Visit: <date if available>
+
+**Conversation Analysis:**
+
+**Missing Elements:**
+• <bullet points about information that should have been collected>
+
+**Clinical Alerts:**
+• <bullet points about concerning symptoms, red flags, urgent issues>
+
+**Structured Data:**
+
+**Symptoms:**
+• <bullet points about reported symptoms>
+
+**Medications:**
+• <bullet points about current medications>
+
+**Allergies:**
+• <bullet points about known allergies>
+
+**Conditions:**
+• <bullet points about medical conditions, diagnoses>
+
+Use professional medical language and ensure each section is clearly separated.
+"""
+)
+
+STRUCTURED_PROMPT = structured_prompt(STRUCTURED_INSTRUCTIONS, DialogueAnalysis)
+REPAIR_PROMPT = repair_prompt(DialogueAnalysis)
+
+
+class DialogueAgent(BaseAgent):
+    name = "dialogue"
+    template = TEMPLATE
+    structured_prompt = STRUCTURED_PROMPT
+    repair_prompt = REPAIR_PROMPT
+    output_model = DialogueAnalysis
+
+    def __init__(self, clinician_specialty: str = "general", chunk_tokens: int = CHUNK_TOKENS,
+                 overlap_tokens: int = CHUNK_OVERLAP_TOKENS, **options):
+        super().__init__(**options)
+        self.clinician_specialty = clinician_specialty
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.update_template = UPDATE_TEMPLATE
+
+    @cached_property
+    def update_chain(self):
+        return self.update_template | self.llm
+
+    def inputs(self, text: str) -> dict:
+        return {
+            "conversation_text": text,
             "specialty": self.clinician_specialty
-        })
-        
-        # Handle AIMessage objects (from LangChain)
-        if hasattr(result, 'content'):
-            return result.content
-        # Handle dictionaries
-        elif isinstance(result, dict):
-            if 'content' in result:
-                return result['content']
-            elif 'text' in result:
-                return result['text']
-            elif 'response' in result:
-                return result['response']
-            else:
-                return str(result)
-        elif isinstance(result, str):
-            return result
-        else:
-            return str(result)
+        }
+
+    def execute(self, conversation_text: str, use_cache: bool = True) -> str:
+        if self.needs_chunking(conversation_text):
+            return self.run_chunked(conversation_text, use_cache)
+        return super().execute(conversation_text, use_cache)
+
+    async def aexecute(self, conversation_text: str, use_cache: bool = True) -> str:
+        if self.needs_chunking(conversation_text):
+            return await self.arun_chunked(conversation_text, use_cache)
+        return await super().aexecute(conversation_text, use_cache)
+
+    def execute_structured(self, conversation_text: str, use_cache: bool = True) -> DialogueAnalysis:
+        chunks = self.split(conversation_text) if self.needs_chunking(conversation_text) else [conversation_text]
+        analyses = self._map_chunks(lambda chunk: self.invoke_structured(self.inputs(chunk), use_cache), chunks)
+        return analyses[0] if len(analyses) == 1 else DialogueAnalysis.merge(analyses)
+
+    async def aexecute_structured(self, conversation_text: str, use_cache: bool = True) -> DialogueAnalysis:
+        chunks = self.split(conversation_text) if self.needs_chunking(conversation_text) else [conversation_text]
+        analyses = await asyncio.gather(*(self.ainvoke_structured(self.inputs(chunk), use_cache) for chunk in chunks))
+        return analyses[0] if len(analyses) == 1 else DialogueAnalysis.merge(analyses)
+
+    def execute_stream(self, conversation_text: str, use_cache: bool = True):
+        if self.needs_chunking(conversation_text):
+            # Chunked analyses can only be merged once every chunk is done
+            yield self.run_chunked(conversation_text, use_cache)
+            return
+        yield from super().execute_stream(conversation_text, use_cache)
+
+    async def aexecute_stream(self, conversation_text: str, use_cache: bool = True):
+        if self.needs_chunking(conversation_text):
+            yield await self.arun_chunked(conversation_text, use_cache)
+            return
+        async for chunk in super().aexecute_stream(conversation_text, use_cache):
+            yield chunk
+
+    def update(self, current_analysis: str, new_turns: str, context_turns: str = "",
+               use_cache: bool = True) -> str:
+        """Fold new turns into an existing analysis without re-sending the whole transcript"""
+        inputs = self._update_inputs(current_analysis, new_turns, context_turns)
+        return call_with_timeout(lambda: self.invoke(self.update_chain, inputs, use_cache, "dialogue_update"),
+                                 self.timeout)
+
+    async def aupdate(self, current_analysis: str, new_turns: str, context_turns: str = "",
+                      use_cache: bool = True) -> str:
+        inputs = self._update_inputs(current_analysis, new_turns, context_turns)
+        return await acall_with_timeout(self.ainvoke(self.update_chain, inputs, use_cache, "dialogue_update"),
+                                        self.timeout)
+
+    def needs_chunking(self, conversation_text: str) -> bool:
+        return count_tokens(conversation_text) > self.chunk_tokens
+
+    def split(self, conversation_text: str) -> list:
+        """Token-bounded windows of whole speaker turns, overlapping by overlap_tokens"""
+        return chunk_turns(split_turns(conversation_text), self.chunk_tokens, self.overlap_tokens)
+
+    def run_chunked(self, conversation_text: str, use_cache: bool = True) -> str:
+        """Map-reduce analysis: analyze chunks in parallel, then merge their sections"""
+        chunks = self.split(conversation_text)
+        return merge_analyses(self._map_chunks(lambda chunk: self.generate(self.inputs(chunk), use_cache), chunks))
+
+    async def arun_chunked(self, conversation_text: str, use_cache: bool = True) -> str:
+        chunks = self.split(conversation_text)
+        analyses = await asyncio.gather(*(self.agenerate(self.inputs(chunk), use_cache) for chunk in chunks))
+        return merge_analyses(analyses)
+
+    def _map_chunks(self, func, chunks: list) -> list:
+        # Worker threads start with an empty context, so each chunk runs in a copy of the
+        # caller's: its scheduler priority and client id, and the metrics call capture
+        contexts = [contextvars.copy_context() for _ in chunks]
+        with ThreadPoolExecutor(max_workers=min(len(chunks), MAX_CHUNK_WORKERS)) as pool:
+            return list(pool.map(lambda context, chunk: context.run(func, chunk), contexts, chunks))
+
+    def _update_inputs(self, current_analysis: str, new_turns: str, context_turns: str) -> dict:
+        return {
+            "current_analysis": current_analysis or "None yet.",
+            "context_turns": context_turns or "None.",
+            "new_turns": new_turns,
+            "specialty": self.clinician_specialty
+        }
+
 
+def merge_analyses(analyses: list) -> str:
+    """Combine per-chunk analyses into one, deduplicating items within each section"""
+    if len(analyses) == 1:
+        return analyses[0]
+    return render_sections(merge_sections([parse_sections(analysis) for analysis in analyses]))
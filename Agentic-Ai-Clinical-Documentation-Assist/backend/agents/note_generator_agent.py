@@ -1,10 +1,21 @@
-from llm_setup import get_llm
-from langchain.prompts import PromptTemplate
+from functools import cached_property
 
-class NoteGeneratorAgent:
-    def __init__(self):
-        self.llm = get_llm()  # Uses Groq-hosted model via ChatGroq
-        self.template = PromptTemplate.from_template("""
+from langchain_core.prompts import PromptTemplate
+from agents.base_agent import BaseAgent
+from agent_runtime import acall_with_timeout, call_with_timeout
+from note_revision import NOTE_SECTIONS, affected_sections, note_sections, section_format, splice_sections
+from schemas import SoapNote
+from structured_output import structured_prompt, repair_prompt
+
+STRUCTURED_INSTRUCTIONS = """
+Generate a SOAP note from the following structured medical data (plain text):
+
+{structured_data}
+
+Summarize in your own words and do not repeat the input verbatim.
+"""
+
+TEMPLATE = PromptTemplate.from_template("""
         Generate a SOAP note from the following structured medical data (plain text):
 
         {structured_data}
@@ -39,25 +50,98 @@ class NoteGeneratorAgent:
 
         Use professional medical language and ensure each section is clearly separated.
         """)
-        self.chain = self.template | self.llm
-
-    def run(self, structured_data: str) -> str:
-        result = self.chain.invoke({"structured_data": structured_data})
-        
-        # Handle AIMessage objects (from LangChain)
-        if hasattr(result, 'content'):
-            return result.content
-        # Handle dictionaries
-        elif isinstance(result, dict):
-            if 'content' in result:
-                return result['content']
-            elif 'text' in result:
-                return result['text']
-            elif 'response' in result:
-                return result['response']
-            else:
-                return str(result)
-        elif isinstance(result, str):
-            return result
-        else:
-            return str(result)
+
+REVISION_TEMPLATE = PromptTemplate.from_template("""
+Update a SOAP note after a change to the structured medical data it was written from.
+
+Updated structured medical data (plain text):
+
+{structured_data}
+
+Current SOAP note:
+
+{current_note}
+
+Your task:
+- Rewrite ONLY these sections so they reflect the updated data: {sections}.
+- Keep what is still accurate in those sections; add or correct only what the data change requires.
+- DO NOT repeat the input verbatim.
+- If information is missing, state 'Not provided'.
+- Return only the sections listed above.
+
+Respond in this structured format:
+
+{section_format}
+""")
+
+STRUCTURED_PROMPT = structured_prompt(STRUCTURED_INSTRUCTIONS, SoapNote)
+REPAIR_PROMPT = repair_prompt(SoapNote)
+
+
+class NoteGeneratorAgent(BaseAgent):
+    name = "note_generator"
+    template = TEMPLATE
+    structured_prompt = STRUCTURED_PROMPT
+    repair_prompt = REPAIR_PROMPT
+    output_model = SoapNote
+
+    @cached_property
+    def revision_chain(self):
+        return REVISION_TEMPLATE | self.llm
+
+    def inputs(self, text: str) -> dict:
+        return {"structured_data": text}
+
+    def revise(self, previous_note: str, previous_data: str, structured_data: str, use_cache: bool = True) -> dict:
+        """Regenerate only the sections of previous_note affected by the data change.
+
+        Returns {"soap_note", "regenerated", "mode"}; mode is "unchanged", "sections"
+        or "full" (every section affected, or the note could not be spliced).
+        """
+        sections = self.sections_to_revise(previous_note, previous_data, structured_data)
+        if sections:
+            inputs = self._revision_inputs(previous_note, structured_data, sections)
+            text = call_with_timeout(lambda: self.invoke(self.revision_chain, inputs, use_cache, "note_revision"),
+                                     self.timeout)
+            return self._spliced(previous_note, text, sections) or self._full(self.run(structured_data, use_cache))
+        if sections is None:
+            return self._full(self.run(structured_data, use_cache))
+        return {"soap_note": previous_note, "regenerated": [], "mode": "unchanged"}
+
+    async def arevise(self, previous_note: str, previous_data: str, structured_data: str,
+                      use_cache: bool = True) -> dict:
+        sections = self.sections_to_revise(previous_note, previous_data, structured_data)
+        if sections:
+            inputs = self._revision_inputs(previous_note, structured_data, sections)
+            text = await acall_with_timeout(self.ainvoke(self.revision_chain, inputs, use_cache, "note_revision"),
+                                            self.timeout)
+            return (self._spliced(previous_note, text, sections)
+                    or self._full(await self.arun(structured_data, use_cache)))
+        if sections is None:
+            return self._full(await self.arun(structured_data, use_cache))
+        return {"soap_note": previous_note, "regenerated": [], "mode": "unchanged"}
+
+    def sections_to_revise(self, previous_note: str, previous_data: str, structured_data: str):
+        """Sections to regenerate; None when the whole note should be regenerated"""
+        sections = affected_sections(previous_data, structured_data)
+        if not sections:
+            return []
+        present = note_sections(previous_note)
+        if len(sections) == len(NOTE_SECTIONS) or any(section.lower() not in present for section in NOTE_SECTIONS):
+            return None
+        return sections
+
+    def _revision_inputs(self, previous_note: str, structured_data: str, sections: list) -> dict:
+        return {
+            "structured_data": structured_data,
+            "current_note": previous_note,
+            "sections": ", ".join(sections),
+            "section_format": section_format(self.template.template, sections),
+        }
+
+    def _spliced(self, previous_note: str, text: str, sections: list):
+        note = splice_sections(previous_note, text, sections)
+        return None if note is None else {"soap_note": note, "regenerated": sections, "mode": "sections"}
+
+    def _full(self, note: str) -> dict:
+        return {"soap_note": note, "regenerated": list(NOTE_SECTIONS), "mode": "full"}
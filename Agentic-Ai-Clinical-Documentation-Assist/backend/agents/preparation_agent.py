@@ -1,10 +1,17 @@
-from llm_setup import get_llm
-from langchain.prompts import PromptTemplate
+from langchain_core.prompts import PromptTemplate
+from agents.base_agent import BaseAgent
+from schemas import PreVisitSummary
+from structured_output import structured_prompt, repair_prompt
 
-class PreparationAgent:
-    def __init__(self):
-        self.llm = get_llm()  # Uses Groq-hosted model via ChatGroq
-        self.template = PromptTemplate.from_template("""
+STRUCTURED_INSTRUCTIONS = """
+Analyze the following patient EHR summary (plain text) and prepare a pre-visit summary:
+
+{input_text}
+
+Summarize in your own words and do not repeat the input verbatim.
+"""
+
+TEMPLATE = PromptTemplate.from_template("""
         Analyze the following patient EHR summary (plain text):
 
         {input_text}
@@ -39,25 +46,17 @@ class PreparationAgent:
 
         Use professional medical language and ensure each section is clearly separated.
         """)
-        self.chain = self.template | self.llm
-
-    def run(self, patient_info: str) -> str:
-        result = self.chain.invoke({"input_text": patient_info})
-        
-        # Handle AIMessage objects (from LangChain)
-        if hasattr(result, 'content'):
-            return result.content
-        # Handle dictionaries
-        elif isinstance(result, dict):
-            if 'content' in result:
-                return result['content']
-            elif 'text' in result:
-                return result['text']
-            elif 'response' in result:
-                return result['response']
-            else:
-                return str(result)
-        elif isinstance(result, str):
-            return result
-        else:
-            return str(result)
+
+STRUCTURED_PROMPT = structured_prompt(STRUCTURED_INSTRUCTIONS, PreVisitSummary)
+REPAIR_PROMPT = repair_prompt(PreVisitSummary)
+
+
+class PreparationAgent(BaseAgent):
+    name = "preparation"
+    template = TEMPLATE
+    structured_prompt = STRUCTURED_PROMPT
+    repair_prompt = REPAIR_PROMPT
+    output_model = PreVisitSummary
+
+    def inputs(self, text: str) -> dict:
+        return {"input_text": text}
@@ -2,6 +2,7 @@
 import streamlit as st
 import os
 import sys
+import time
 
 # Configure the page
 st.set_page_config(
@@ -15,21 +16,17 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Core imports
 from dotenv import load_dotenv
-from agents.preparation_agent import PreparationAgent
-from agents.dialogue_agent import DialogueAgent
-from agents.note_generator_agent import NoteGeneratorAgent
-from agents.coder_agent import CoderAgent
-
-def initialize_session_state():
-    """Initialize session state variables"""
-    if 'prep_agent' not in st.session_state:
-        st.session_state.prep_agent = PreparationAgent()
-    if 'dialogue_agent' not in st.session_state:
-        st.session_state.dialogue_agent = DialogueAgent()
-    if 'note_agent' not in st.session_state:
-        st.session_state.note_agent = NoteGeneratorAgent()
-    if 'coder_agent' not in st.session_state:
-        st.session_state.coder_agent = CoderAgent()
+# Agents are shared by all sessions and built the first time a tab uses one
+from agents import construction_times, get_agent
+from encounters import get_encounter_store, record_encounter
+from metrics import capture_calls
+
+OUTPUT_LABELS = {
+    "summary": "Pre-Visit Summary",
+    "analysis": "Conversation Analysis",
+    "soap_note": "SOAP Note",
+    "codes": "Billing Codes",
+}
 
 def setup_sidebar():
     """Setup the sidebar with information"""
@@ -41,16 +38,50 @@ def setup_sidebar():
         st.markdown("• Conversation Analysis")
         st.markdown("• SOAP Note Generation")
         st.markdown("• Billing Code Generation")
+        st.markdown("• Encounter History")
         st.markdown("---")
         st.markdown("**Instructions:**")
         st.markdown("1. Select the appropriate tab")
         st.markdown("2. Enter patient information as plain text")
         st.markdown("3. Click generate to get structured output")
         st.markdown("---")
+        st.session_state.use_cache = st.checkbox(
+            "Reuse cached results",
+            value=True,
+            help="Return a stored result for identical input instead of calling the LLM again"
+        )
+        st.session_state.patient_id = st.text_input(
+            "Patient ID (optional)",
+            help="Saved with generated documentation so it can be found in the History tab"
+        )
+        st.session_state.encounter_date = st.date_input(
+            "Visit date (optional)",
+            value=None,
+            help="Saved with generated documentation; defaults to today"
+        )
+        st.markdown("---")
         st.markdown("**Powered by:**")
         st.markdown("• Groq LLM API")
         st.markdown("• LangChain")
         st.markdown("• Streamlit")
+        if construction_times:
+            with st.expander("Agent load times"):
+                for name, seconds in construction_times.items():
+                    st.caption(f"{name}: {seconds * 1000:.0f} ms")
+
+def stream_and_record(kind, field, agent, text):
+    """Stream an agent's output into the page, then store it as an encounter.
+
+    Returns None, without recording, when the output is the agent's error text.
+    """
+    started = time.perf_counter()
+    with capture_calls() as calls:
+        output = st.write_stream(agent.stream(text, st.session_state.use_cache))
+    if agent.failed(output):
+        return None
+    record_encounter(kind, text, {field: output}, calls=calls, seconds=time.perf_counter() - started,
+                     patient_id=st.session_state.patient_id, encounter_date=st.session_state.encounter_date)
+    return output
 
 def setup_preparation_agent_tab():
     """Setup the Pre-Visit Summary tab"""
@@ -65,23 +96,18 @@ def setup_preparation_agent_tab():
     
     col1, col2 = st.columns([1, 4])
     with col1:
-        if st.button("🚀 Generate Summary", type="primary"):
-            if patient_info:
-                with st.spinner("Generating pre-visit summary..."):
-                    try:
-                        summary = st.session_state.prep_agent.run(patient_info)
-                        st.success("Summary generated successfully!")
-                    except Exception as e:
-                        st.error(f"Error generating summary: {str(e)}")
-                        return
-            else:
-                st.warning("Please enter patient information first.")
-                return
-    
-    # Display results
-    if 'summary' in locals():
-        st.subheader("📄 Pre-Visit Summary")
-        st.markdown(summary)
+        generate = st.button("🚀 Generate Summary", type="primary")
+
+    if generate:
+        if patient_info:
+            st.subheader("📄 Pre-Visit Summary")
+            try:
+                stream_and_record("summary", "summary", get_agent("preparation"), patient_info)
+                st.success("Summary generated successfully!")
+            except Exception as e:
+                st.error(f"Error generating summary: {str(e)}")
+        else:
+            st.warning("Please enter patient information first.")
 
 def setup_dialogue_agent_tab():
     """Setup the Conversation Analysis tab"""
@@ -101,24 +127,18 @@ def setup_dialogue_agent_tab():
     
     col1, col2 = st.columns([1, 4])
     with col1:
-        if st.button("🔍 Analyze Conversation", type="primary"):
-            if conversation_text:
-                with st.spinner("Analyzing conversation..."):
-                    try:
-                        st.session_state.dialogue_agent.clinician_specialty = specialty
-                        analysis = st.session_state.dialogue_agent.run(conversation_text)
-                        st.success("Analysis completed successfully!")
-                    except Exception as e:
-                        st.error(f"Error analyzing conversation: {str(e)}")
-                        return
-            else:
-                st.warning("Please enter conversation text first.")
-                return
-    
-    # Display results
-    if 'analysis' in locals():
-        st.subheader("📊 Conversation Analysis Result")
-        st.markdown(analysis)
+        analyze = st.button("🔍 Analyze Conversation", type="primary")
+
+    if analyze:
+        if conversation_text:
+            st.subheader("📊 Conversation Analysis Result")
+            try:
+                stream_and_record("analysis", "analysis", get_agent("dialogue", specialty), conversation_text)
+                st.success("Analysis completed successfully!")
+            except Exception as e:
+                st.error(f"Error analyzing conversation: {str(e)}")
+        else:
+            st.warning("Please enter conversation text first.")
 
 def setup_note_generator_tab():
     """Setup the SOAP Note Generator tab"""
@@ -133,23 +153,42 @@ def setup_note_generator_tab():
     
     col1, col2 = st.columns([1, 4])
     with col1:
-        if st.button("📋 Generate SOAP Note", type="primary"):
-            if structured_data:
-                with st.spinner("Generating SOAP note..."):
-                    try:
-                        soap_note = st.session_state.note_agent.run(structured_data)
-                        st.success("SOAP note generated successfully!")
-                    except Exception as e:
-                        st.error(f"Error generating SOAP note: {str(e)}")
-                        return
-            else:
-                st.warning("Please enter structured data first.")
-                return
-    
-    # Display results
-    if 'soap_note' in locals():
+        generate = st.button("📋 Generate SOAP Note", type="primary")
+    with col2:
+        # Only the sections affected by edits to the data are rewritten
+        revise = st.button("♻️ Update Changed Sections", disabled="soap_note" not in st.session_state)
+
+    if generate:
+        if structured_data:
+            st.subheader("📄 SOAP Note")
+            try:
+                note = stream_and_record("note", "soap_note", get_agent("note_generator"), structured_data)
+                st.session_state.soap_note = (structured_data, note)
+                st.success("SOAP note generated successfully!")
+            except Exception as e:
+                st.error(f"Error generating SOAP note: {str(e)}")
+        else:
+            st.warning("Please enter structured data first.")
+    elif revise:
+        previous_data, previous_note = st.session_state.soap_note
         st.subheader("📄 SOAP Note")
-        st.markdown(soap_note)
+        try:
+            started = time.perf_counter()
+            with st.spinner("Updating SOAP note..."), capture_calls() as calls:
+                result = get_agent("note_generator").revise(previous_note, previous_data, structured_data,
+                                                            st.session_state.use_cache)
+            if result["mode"] != "unchanged":
+                record_encounter("revision", structured_data, result, calls=calls,
+                                 seconds=time.perf_counter() - started, patient_id=st.session_state.patient_id,
+                                 encounter_date=st.session_state.encounter_date)
+            st.markdown(result["soap_note"])
+            st.session_state.soap_note = (structured_data, result["soap_note"])
+            if result["mode"] == "unchanged":
+                st.info("No changes in the data affect the note.")
+            else:
+                st.success(f"Regenerated: {', '.join(result['regenerated'])}")
+        except Exception as e:
+            st.error(f"Error updating SOAP note: {str(e)}")
 
 def setup_coder_agent_tab():
     """Setup the Billing Code Generator tab"""
@@ -164,42 +203,77 @@ def setup_coder_agent_tab():
     
     col1, col2 = st.columns([1, 4])
     with col1:
-        if st.button("💳 Generate Codes", type="primary"):
-            if structured_data:
-                with st.spinner("Generating billing codes..."):
-                    try:
-                        codes = st.session_state.coder_agent.run(structured_data)
-                        st.success("Billing codes generated successfully!")
-                    except Exception as e:
-                        st.error(f"Error generating billing codes: {str(e)}")
-                        return
-            else:
-                st.warning("Please enter structured data first.")
-                return
-    
-    # Display results
-    if 'codes' in locals():
-        st.subheader("💳 Billing Codes")
-        st.markdown(codes)
+        generate = st.button("💳 Generate Codes", type="primary")
+
+    if generate:
+        if structured_data:
+            st.subheader("💳 Billing Codes")
+            try:
+                if stream_and_record("codes", "codes", get_agent("coder"), structured_data) is not None:
+                    st.success("Billing codes generated successfully!")
+            except Exception as e:
+                st.error(f"Error generating billing codes: {str(e)}")
+        else:
+            st.warning("Please enter structured data first.")
+
+def setup_history_tab():
+    """Setup the Encounter History tab; stored results are shown without calling the LLM"""
+    st.header("📚 Encounter History")
+    st.markdown("Find previously generated documentation by patient, date, billing code or text.")
+
+    store = get_encounter_store()
+    if store is None:
+        st.info("The encounter store is disabled; set ENCOUNTER_DB_PATH to record encounters.")
+        return
+
+    query = st.text_input("Search generated documentation:", placeholder="e.g. metformin adherence")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        patient_id = st.text_input("Patient ID", key="history_patient_id")
+    with col2:
+        date_from = st.date_input("From", value=None)
+    with col3:
+        date_to = st.date_input("To", value=None)
+    with col4:
+        code = st.text_input("Billing code")
+
+    if query:
+        encounters = store.search(query, patient_id or None)
+    else:
+        encounters = store.find(patient_id or None, None, date_from.isoformat() if date_from else None,
+                                date_to.isoformat() if date_to else None, code or None)
+    if not encounters:
+        st.info("No stored encounters match.")
+        return
+
+    for encounter in encounters:
+        patient = encounter["patient_name"] or encounter["patient_id"] or "unknown patient"
+        with st.expander(f"{encounter['encounter_date']} · {encounter['kind']} · {patient}"):
+            if encounter.get("snippet"):
+                st.caption(encounter["snippet"])
+            for field, label in OUTPUT_LABELS.items():
+                if encounter[field]:
+                    st.markdown(f"**{label}**")
+                    st.markdown(encounter[field])
+            models = ", ".join(f"{agent}: {model}" for agent, model in (encounter["models"] or {}).items())
+            st.caption(f"Models: {models or 'n/a'} · Total: {encounter['timings'].get('total', 0):.2f}s")
 
 def main():
     # Load environment variables
     load_dotenv()
 
-    # Initialize session state
-    initialize_session_state()
-    
     st.title("🏥 Clinical Documentation Assistant")
     
     # Setup sidebar
     setup_sidebar()
     
     # Create tabs
-    tab1, tab2, tab3, tab4 = st.tabs([
+    tab1, tab2, tab3, tab4, tab5 = st.tabs([
         "📋 Pre-Visit Summary", 
         "💬 Conversation Analysis", 
         "📝 SOAP Note Generator", 
-        "💰 Billing Codes"
+        "💰 Billing Codes",
+        "📚 History"
     ])
     
     with tab1:
@@ -214,6 +288,9 @@ def main():
     with tab4:
         setup_coder_agent_tab()
 
+    with tab5:
+        setup_history_tab()
+
     # Custom CSS styling
     st.markdown("""
     <style>
@@ -0,0 +1,236 @@
+# backend/batch.py
+"""Bulk back-fill of summaries, analyses, notes and codes.
+
+Input is NDJSON, one encounter per line:
+
+    {"id": "enc-1", "patient_info": {...}, "conversation_text": "...", "specialty": "general"}
+    {"id": "enc-2", "conversation_file": "visits/enc-2.txt"}
+    {"resourceType": "Patient", "id": "example", ...}
+
+A bare FHIR-style resource is treated as patient_info. Plain-text files may also be
+passed on the command line; each is processed as one conversation. conversation_file
+is only read by the command line, relative to the input file's directory and never
+outside it; records from the API and job queue must carry conversation_text.
+
+Usage:
+    python batch.py encounters.ndjson -o results.ndjson --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from agents import get_agent
+from fhir_compact import compact_patient
+from scheduler import BATCH, current_client_id, request_context
+
+_DONE = object()
+# Upper bound on records processed at once from the API and job queue
+MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "64"))
+
+
+class BatchRunner:
+    """Pushes encounter records through the agents with a bounded worker pool"""
+
+    def __init__(self, concurrency: int = 4, use_cache: bool = True, base_dir: str = None,
+                 client_id: str = None):
+        self.concurrency = concurrency
+        self.client_id = client_id or current_client_id()
+        self.use_cache = use_cache
+        # Directory conversation_file may be read from; None rejects conversation_file
+        self.base_dir = os.path.realpath(base_dir) if base_dir else None
+        self.prep_agent = get_agent("preparation")
+        self.note_agent = get_agent("note_generator")
+        self.coder_agent = get_agent("coder")
+        self.processed = 0
+        self.failed = 0
+        self.started_at = None
+
+    def _dialogue_agent(self, specialty: str):
+        return get_agent("dialogue", specialty)
+
+    async def process(self, item_id: str, record) -> dict:
+        """Process one record; any failure is reported on that record only"""
+        start = time.perf_counter()
+        try:
+            if isinstance(record, str):
+                record = json.loads(record)
+            result = await self._process_record(record)
+            self.processed += 1
+            return {"id": item_id, "status": "ok", "result": result,
+                    "elapsed": round(time.perf_counter() - start, 4)}
+        except Exception as e:
+            self.failed += 1
+            return {"id": item_id, "status": "error",
+                    "error": {"type": type(e).__name__, "message": str(e)},
+                    "elapsed": round(time.perf_counter() - start, 4)}
+
+    async def _process_record(self, record: dict) -> dict:
+        patient_info = record.get("patient_info")
+        if patient_info is None and "resourceType" in record:
+            patient_info = record
+        conversation = record.get("conversation_text")
+        if conversation is None and record.get("conversation_file"):
+            with open(self._conversation_path(record["conversation_file"])) as f:
+                conversation = f.read()
+        if patient_info is None and conversation is None:
+            raise ValueError("record has neither patient_info nor a conversation")
+
+        result = {}
+        pending = []
+        if patient_info is not None:
+            pending.append(self._summary(patient_info, result))
+        if conversation is not None:
+            dialogue_agent = self._dialogue_agent(record.get("specialty", "general"))
+            pending.append(self._conversation(dialogue_agent, conversation, result))
+        await asyncio.gather(*pending)
+        return result
+
+    def _conversation_path(self, name: str) -> str:
+        if self.base_dir is None:
+            raise ValueError("conversation_file is not accepted here; send conversation_text")
+        path = os.path.realpath(os.path.join(self.base_dir, name))
+        if os.path.commonpath([self.base_dir, path]) != self.base_dir:
+            raise ValueError(f"conversation_file {name!r} is outside {self.base_dir}")
+        return path
+
+    async def _summary(self, patient_info, result: dict):
+        text = patient_info if isinstance(patient_info, str) else compact_patient(patient_info)
+        result["summary"] = await self.prep_agent.arun(text, self.use_cache)
+
+    async def _conversation(self, dialogue_agent, conversation: str, result: dict):
+        analysis = await dialogue_agent.arun(conversation, self.use_cache)
+        result["analysis"] = analysis
+        result["soap_note"], result["codes"] = await asyncio.gather(
+            self.note_agent.arun(analysis, self.use_cache),
+            self.coder_agent.arun(analysis, self.use_cache, raise_errors=True),
+        )
+
+    async def run(self, items, skip_ids=()):
+        """Yield one result per (id, record) item, in completion order"""
+        skip_ids = set(skip_ids)
+        self.started_at = time.perf_counter()
+        pending = asyncio.Queue(maxsize=self.concurrency * 2)
+        finished = asyncio.Queue()
+
+        async def feed():
+            for item_id, record in items:
+                if item_id not in skip_ids:
+                    await pending.put((item_id, record))
+            for _ in range(self.concurrency):
+                await pending.put(_DONE)
+
+        async def work():
+            # Batch back-fill queues behind interactive calls in the scheduler
+            with request_context(priority=BATCH, client_id=self.client_id):
+                while True:
+                    item = await pending.get()
+                    if item is _DONE:
+                        await finished.put(_DONE)
+                        return
+                    await finished.put(await self.process(*item))
+
+        tasks = [asyncio.create_task(feed())]
+        tasks += [asyncio.create_task(work()) for _ in range(self.concurrency)]
+        try:
+            remaining = self.concurrency
+            while remaining:
+                result = await finished.get()
+                if result is _DONE:
+                    remaining -= 1
+                else:
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        total = self.processed + self.failed
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "elapsed": round(elapsed, 3),
+            "records_per_sec": round(total / elapsed, 3) if elapsed else 0.0,
+        }
+
+
+def iter_ndjson_lines(lines, prefix: str = "line"):
+    """(id, raw record) pairs; ids come from the record or fall back to the line number"""
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        item_id = f"{prefix}-{number}"
+        try:
+            item_id = str(json.loads(line).get("id", item_id))
+        except (ValueError, AttributeError):
+            pass
+        yield item_id, line
+
+
+def iter_input_files(paths):
+    for path in paths:
+        if path.endswith((".ndjson", ".jsonl")):
+            with open(path) as f:
+                yield from iter_ndjson_lines(f, os.path.basename(path))
+        else:
+            with open(path) as f:
+                conversation = f.read()
+            yield os.path.splitext(os.path.basename(path))[0], {"conversation_text": conversation}
+
+
+def load_checkpoint(output_path: str) -> set:
+    """Ids already completed successfully in a previous run's output file"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # partially written last line
+            if result.get("status") == "ok":
+                done.add(result["id"])
+    return done
+
+
+async def run_cli(args):
+    runner = BatchRunner(args.concurrency, use_cache=not args.no_cache,
+                         base_dir=os.path.dirname(os.path.abspath(args.inputs[0])))
+    skip_ids = set() if args.restart else load_checkpoint(args.output)
+    if skip_ids:
+        print(f"Resuming: skipping {len(skip_ids)} completed records", file=sys.stderr)
+
+    with open(args.output, "w" if args.restart else "a") as out:
+        async for result in runner.run(iter_input_files(args.inputs), skip_ids):
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            stats = runner.stats()
+            if (stats["processed"] + stats["failed"]) % args.report_every == 0:
+                print(json.dumps(stats), file=sys.stderr)
+
+    print(json.dumps(runner.stats()), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-process encounters through the clinical agents")
+    parser.add_argument("inputs", nargs="+", help="NDJSON record files and/or conversation text files")
+    parser.add_argument("-o", "--output", default="batch_results.ndjson", help="NDJSON results file (also the checkpoint)")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Records processed at once")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the response cache")
+    parser.add_argument("--restart", action="store_true", help="Ignore previous results and start over")
+    parser.add_argument("--report-every", type=int, default=50, help="Print throughput every N records")
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.report_every < 1:
+        parser.error("--report-every must be at least 1")
+    asyncio.run(run_cli(args))
+
+
+if __name__ == "__main__":
+    main()
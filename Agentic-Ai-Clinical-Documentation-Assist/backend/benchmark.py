@@ -0,0 +1,294 @@
+# backend/benchmark.py
+"""Performance benchmarks for the agents, the API and the visit pipeline.
+
+Runs against the local fake LLM backend (fake_llm.py) unless LLM_BACKEND is set,
+with the response cache off unless --cache is given and the encounter store off. Suites:
+
+    overhead  per-agent time spent outside the LLM (prompt formatting, extraction, parsing)
+    api       endpoint throughput and p50/p95/p99 latency at a given concurrency
+    pipeline  end-to-end VisitPipeline time for inputs scaled up from sample_data
+
+Usage:
+    python benchmark.py                                  # all suites
+    python benchmark.py api --concurrency 32 --requests 500
+    python benchmark.py -o results/today.json --compare results/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("FAKE_LLM_LATENCY_MS", "50")
+os.environ.setdefault("FAKE_LLM_LATENCY_JITTER_MS", "10")
+# Synthetic benchmark traffic is never recorded as encounters
+os.environ["ENCOUNTER_DB_PATH"] = ""
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_data")
+SIZES = (1, 4, 16, 64)
+SUITES = ("overhead", "api", "pipeline")
+
+
+def load_samples():
+    with open(os.path.join(SAMPLE_DIR, "sample_patient.json")) as f:
+        patient = json.load(f)
+    with open(os.path.join(SAMPLE_DIR, "sample_conversation.txt")) as f:
+        conversation = f.read()
+    return patient, conversation
+
+
+def scale_samples(patient: dict, conversation: str, factor: int):
+    """Patient record with factor times the observation history and a factor-times-longer visit"""
+    scaled = json.loads(json.dumps(patient))
+    observations = []
+    for i in range(factor):
+        for observation in patient.get("observations", []):
+            observation = dict(observation)
+            observation["date"] = f"{2023 - i // 12}-{12 - i % 12:02d}-10"
+            observations.append(observation)
+    scaled["observations"] = observations
+    return scaled, "\n".join([conversation.strip()] * factor)
+
+
+def percentiles(samples: list) -> dict:
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "mean_ms": round(statistics.mean(ordered) * 1000, 3),
+        "p50_ms": round(pick(0.50) * 1000, 3),
+        "p95_ms": round(pick(0.95) * 1000, 3),
+        "p99_ms": round(pick(0.99) * 1000, 3),
+    }
+
+
+def _time_per_call(func, iterations: int) -> float:
+    func()  # warm-up: regex compilation, lazy imports
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+# -- overhead ------------------------------------------------------------------------
+
+def bench_overhead(iterations: int) -> dict:
+    from langchain_core.messages import AIMessage
+
+    from agent_runtime import extract_text, _cache_key
+    from agents.preparation_agent import PreparationAgent
+    from agents.dialogue_agent import DialogueAgent
+    from agents.note_generator_agent import NoteGeneratorAgent
+    from agents.coder_agent import CoderAgent
+    from fake_llm import fake_response
+    from fhir_compact import compact_patient
+    from structured_output import parse_structured
+    from text_utils import parse_sections
+
+    patient, conversation = load_samples()
+    patient_text = compact_patient(patient)
+    agents = {
+        "preparation": (PreparationAgent(), patient_text),
+        "dialogue": (DialogueAgent(), conversation),
+        "note_generator": (NoteGeneratorAgent(), patient_text),
+        "coder": (CoderAgent(), patient_text),
+    }
+
+    results = {"compact_patient_us": round(_time_per_call(lambda: compact_patient(patient), iterations), 2)}
+    for name, (agent, text) in agents.items():
+        inputs, model_cls = agent.inputs(text), agent.output_model
+        prompt = agent.chain.first.format(**inputs)
+        message = AIMessage(content=fake_response(prompt))
+        structured = agent.structured_chain.first.format(**inputs)
+        structured_text = fake_response(structured)
+        results[name] = {
+            "format_prompt_us": _time_per_call(lambda: agent.chain.first.format(**inputs), iterations),
+            "cache_key_us": _time_per_call(lambda: _cache_key(agent.chain, name, inputs), iterations),
+            "extract_text_us": _time_per_call(lambda: extract_text(message), iterations),
+            "parse_sections_us": _time_per_call(lambda: parse_sections(message.content), iterations),
+            "parse_structured_us": _time_per_call(lambda: parse_structured(structured_text, model_cls), iterations),
+        }
+        results[name] = {key: round(value, 2) for key, value in results[name].items()}
+    return results
+
+
+# -- api -----------------------------------------------------------------------------
+
+def _api_requests(patient: dict, conversation: str) -> dict:
+    return {
+        "/generate-summary": {"patient_info": patient},
+        "/analyze-conversation": {"conversation_text": conversation},
+        "/generate-note": {"patient_info": patient},
+        "/generate-codes": {"patient_info": patient},
+        "/process-visit": {"patient_info": patient, "conversation_text": conversation},
+    }
+
+
+def _numbered(body: dict, i: int, use_cache: bool) -> dict:
+    # A distinct patient and transcript per request: identical concurrent bodies would be
+    # coalesced into one upstream call and overstate throughput
+    body = dict(body, use_cache=use_cache)
+    if "patient_info" in body:
+        body["patient_info"] = dict(body["patient_info"], id=f"bench-{i}", name=[{"text": f"Patient {i}"}])
+    if "conversation_text" in body:
+        body["conversation_text"] = f"Visit {i}.\n{body['conversation_text']}"
+    return body
+
+
+async def bench_api(concurrency: int, requests: int, use_cache: bool) -> dict:
+    import httpx
+    import main
+
+    patient, conversation = load_samples()
+    transport = httpx.ASGITransport(app=main.app)
+    results = {"concurrency": concurrency, "requests": requests}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for path, body in _api_requests(patient, conversation).items():
+            latencies, errors = [], 0
+            remaining = iter(range(requests))
+
+            async def worker():
+                nonlocal errors
+                for i in remaining:
+                    start = time.perf_counter()
+                    response = await client.post(path, json=_numbered(body, i, use_cache))
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        errors += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+            results[path] = {
+                "throughput_rps": round(requests / elapsed, 2),
+                "errors": errors,
+                **percentiles(latencies),
+            }
+    return results
+
+
+# -- pipeline ------------------------------------------------------------------------
+
+async def bench_pipeline(sizes, repeats: int, use_cache: bool) -> dict:
+    from fhir_compact import compact_patient
+    from pipeline import VisitPipeline
+    from text_utils import count_tokens
+
+    pipeline = VisitPipeline()
+    patient, conversation = load_samples()
+    results = {}
+    for factor in sizes:
+        scaled_patient, scaled_conversation = scale_samples(patient, conversation, factor)
+        patient_text = compact_patient(scaled_patient)
+        runs = [await pipeline.arun(patient_text, scaled_conversation, use_cache) for _ in range(repeats)]
+        stages = {}
+        for stage in runs[0]["timings"]:
+            stages[stage] = round(statistics.median(run["timings"][stage] for run in runs), 4)
+        results[f"x{factor}"] = {
+            "patient_raw_tokens": count_tokens(json.dumps(scaled_patient)),
+            "patient_tokens": count_tokens(patient_text),
+            "conversation_tokens": count_tokens(scaled_conversation),
+            "timings_s": stages,
+        }
+    return results
+
+
+# -- reporting -----------------------------------------------------------------------
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _flatten(data, prefix=""):
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, path + ".")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Metrics that moved by more than threshold (fraction) between two result files"""
+    before = dict(_flatten(baseline.get("results", {})))
+    changes = []
+    for path, value in _flatten(current.get("results", {})):
+        old = before.get(path)
+        if old and abs(value - old) / abs(old) > threshold:
+            changes.append((path, old, value, (value - old) / abs(old)))
+    return changes
+
+
+async def run_cli(args):
+    suites = args.suites or list(SUITES)
+    if not args.cache:
+        os.environ["RESPONSE_CACHE_BACKEND"] = "off"
+
+    results = {}
+    if "overhead" in suites:
+        results["overhead"] = bench_overhead(args.iterations)
+    if "api" in suites:
+        results["api"] = await bench_api(args.concurrency, args.requests, args.cache)
+    if "pipeline" in suites:
+        results["pipeline"] = await bench_pipeline(args.sizes, args.repeats, args.cache)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "llm_backend": os.environ["LLM_BACKEND"],
+            "fake_latency_ms": os.environ.get("FAKE_LLM_LATENCY_MS"),
+            "cache": args.cache,
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Saved {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        changes = compare(report, baseline, args.threshold)
+        for path, old, new, change in changes:
+            print(f"{path}: {old} -> {new} ({change:+.1%})", file=sys.stderr)
+        if not changes:
+            print(f"No metric moved more than {args.threshold:.0%} from {args.compare}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark agents, API and visit pipeline")
+    parser.add_argument("suites", nargs="*", help=f"Suites to run: {', '.join(SUITES)} (default: all)")
+    parser.add_argument("-o", "--output", default=f"benchmark_results/{time.strftime('%Y%m%d-%H%M%S')}.json",
+                        help="JSON results file")
+    parser.add_argument("--compare", help="Earlier results file to diff against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change reported by --compare")
+    parser.add_argument("--iterations", type=int, default=200, help="Loop count for overhead timings")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="Concurrent API clients")
+    parser.add_argument("-n", "--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="Input scale factors")
+    parser.add_argument("--repeats", type=int, default=3, help="Pipeline runs per size")
+    parser.add_argument("--cache", action="store_true", help="Keep the response cache enabled")
+    args = parser.parse_args()
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+    asyncio.run(run_cli(args))
+
+
+if __name__ == "__main__":
+    main()
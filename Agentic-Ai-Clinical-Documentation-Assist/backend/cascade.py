@@ -0,0 +1,109 @@
+# backend/cascade.py
+"""Model cascade: answer with a small, fast model first and escalate when needed.
+
+The cascade is opt-in per agent (CASCADE_AGENTS). A non-streaming call starts on
+the small model when its agent is configured and its prompt is short enough; streams
+always go to the large model so their first tokens are not held back. The small
+model's answer is used only if rejection_reason() finds nothing wrong with it: every
+section of the agent's template is present and filled in, it is not a refusal, and
+every number in it (vitals, doses, dates, codes) appears in the prompt. The coder also
+requires well-formed code bullets (see CoderAgent.rejection). Otherwise, or if the
+small model fails, the call is repeated on the large model.
+"""
+import os
+import re
+from functools import lru_cache
+
+from llm_setup import DEFAULT_MODEL
+from text_utils import section_blocks
+
+SMALL_MODEL = os.getenv("LLM_SMALL_MODEL", "llama3-8b-8192")
+# Off unless configured, e.g. "preparation,dialogue,note_generator"
+CASCADE_AGENTS = os.getenv("CASCADE_AGENTS", "")
+# Longer prompts go straight to the large model
+CASCADE_MAX_PROMPT_TOKENS = int(os.getenv("CASCADE_MAX_PROMPT_TOKENS", "2000"))
+
+_HEADING = re.compile(r"\*\*(?P<title>[^*\n]+?):?\*\*")
+_WORD = re.compile(r"\w")
+_LIST_NUMBER = re.compile(r"^\s*\d+[.)]\s", re.MULTILINE)
+_NUMBER = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?!\w)")
+REFUSALS = ("i'm sorry", "i am sorry", "i cannot", "i can't", "as an ai", "unable to assist")
+
+
+class CascadeRouter:
+    """Decides per call whether the small model gets the first attempt"""
+
+    def __init__(self, small_model: str = SMALL_MODEL, agents=(), max_prompt_tokens: int = CASCADE_MAX_PROMPT_TOKENS):
+        self.small_model = small_model
+        self.agents = frozenset(agents)
+        self.max_prompt_tokens = max_prompt_tokens
+
+    @classmethod
+    def from_env(cls):
+        agents = [agent.strip() for agent in CASCADE_AGENTS.split(",") if agent.strip()]
+        return cls(SMALL_MODEL, agents, CASCADE_MAX_PROMPT_TOKENS)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.agents) and bool(self.small_model) and self.small_model != DEFAULT_MODEL
+
+    def covers(self, agent: str) -> bool:
+        return self.enabled and agent in self.agents
+
+    def starts_small(self, agent: str, prompt_tokens: int) -> bool:
+        return self.covers(agent) and prompt_tokens <= self.max_prompt_tokens
+
+
+def headings(text: str) -> set:
+    return {match.group("title").strip().lower() for match in _HEADING.finditer(text)}
+
+
+@lru_cache(maxsize=None)
+def required_sections(template_text: str) -> frozenset:
+    """Section headings an answer to this prompt template must contain"""
+    return frozenset(headings(template_text))
+
+
+def missing_sections(text: str, template_text: str) -> set:
+    return required_sections(template_text) - headings(text)
+
+
+@lru_cache(maxsize=None)
+def filled_sections(template_text: str) -> frozenset:
+    """Headings under which the template asks for content (umbrella headings are left out)"""
+    return frozenset(title.lower() for title, block in section_blocks(template_text)
+                     if title is not None and _WORD.search(_HEADING.sub("", block, count=1)))
+
+
+def empty_sections(text: str, template_text: str) -> set:
+    blocks = {title.lower(): block for title, block in section_blocks(text) if title is not None}
+    return {title for title in filled_sections(template_text)
+            if title in blocks and not _WORD.search(_HEADING.sub("", blocks[title], count=1))}
+
+
+def _number(token: str) -> str:
+    whole, _, fraction = token.partition(".")
+    whole, fraction = whole.lstrip("0") or "0", fraction.rstrip("0")
+    return f"{whole}.{fraction}" if fraction else whole
+
+
+def numbers(text: str) -> set:
+    return {_number(token) for token in _NUMBER.findall(_LIST_NUMBER.sub("", text))}
+
+
+def ungrounded_numbers(text: str, source: str) -> set:
+    """Numbers in text that appear nowhere in source"""
+    return numbers(text) - numbers(source)
+
+
+def rejection_reason(text: str, template_text: str, source: str):
+    """Why a small-model answer to template_text cannot stand in for the large model's, or None"""
+    if missing_sections(text, template_text):
+        return "missing_section"
+    if empty_sections(text, template_text):
+        return "empty_section"
+    if any(phrase in text.lower() for phrase in REFUSALS):
+        return "refusal"
+    if ungrounded_numbers(text, source):
+        return "ungrounded_number"
+    return None
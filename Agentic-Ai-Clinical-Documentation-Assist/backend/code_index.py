@@ -0,0 +1,296 @@
+# backend/code_index.py
+"""Local ICD-11 / CPT code index used to ground and validate CoderAgent output.
+
+Code tables are loaded offline into a SQLite database with an FTS5 keyword index:
+
+    python code_index.py load icd11 sample_data/sample_icd11_codes.tsv
+    python code_index.py load cpt cpt_codes.csv
+    python code_index.py search "type 2 diabetes"
+
+Tables are CSV or TSV files with a code column and a title/description column.
+"""
+import argparse
+import csv
+import os
+import re
+import sqlite3
+import threading
+
+DEFAULT_PATH = os.getenv("CODE_INDEX_PATH", "codes.sqlite3")
+CANDIDATES_PER_SYSTEM = 15
+
+SYSTEM_LABELS = {"icd11": "ICD-11", "cpt": "CPT"}
+_CODE_FORMATS = {
+    "icd11": re.compile(r"^[0-9A-Z]{4}(\.[0-9A-Z]{1,2})?(&[0-9A-Z.]+)?$"),
+    "cpt": re.compile(r"^\d{4}[0-9FTU]$"),
+}
+_SECTION_SYSTEMS = {"ICD-11 Codes": "icd11", "CPT Codes": "cpt"}
+# Leading code of a list item: "• 5A11: ...", "1. **5A11** - ...", "- Code: 99213 ...", "• 5A11 (...)"
+_CODE_ITEM = re.compile(r"^\s*(?:[•\-*]|\d+[.)])?\s*\**\s*(?:code\s*[:\-–]\s*)?\**(?P<code>[0-9A-Z][0-9A-Z.&]*)\**\s*"
+                        r"(?:[:\-–]|(?=\()|$)", re.IGNORECASE)
+# Code-shaped tokens anywhere else in a line under a code heading
+_CODE_TOKENS = {
+    "icd11": re.compile(r"(?<![\w.&])[0-9A-Z][A-Z]\d[0-9A-Z](?:\.[0-9A-Z]{1,2})?(?![\w])"),
+    "cpt": re.compile(r"(?<![\w.])\d{4}[0-9FTU](?![\w.])"),
+}
+_HEADING = re.compile(r"^\s*\*\*(?P<title>[^*]+?):?\*\*")
+_WORD = re.compile(r"[a-z][a-z0-9]{2,}")
+_STOPWORDS = {
+    "the", "and", "for", "with", "not", "patient", "provided", "reports", "has", "was", "are",
+    "his", "her", "she", "him", "this", "that", "from", "but", "any", "none", "name", "age",
+    "gender", "date", "visit", "information", "data", "bullet", "points", "about", "since",
+    "last", "been", "have", "sometimes", "try", "level", "codes", "code",
+}
+
+
+class CodeIndex:
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA mmap_size=268435456")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS codes (
+                system TEXT NOT NULL, code TEXT NOT NULL, title TEXT NOT NULL,
+                PRIMARY KEY (system, code));
+            CREATE VIRTUAL TABLE IF NOT EXISTS codes_fts USING fts5(
+                title, content='codes', content_rowid='rowid', tokenize='porter unicode61');
+        """)
+        self._systems = None
+
+    def load(self, system: str, rows) -> int:
+        """Replace one system's codes with (code, title) rows and rebuild the keyword index"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM codes WHERE system = ?", (system,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO codes (system, code, title) VALUES (?, ?, ?)",
+                ((system, code.strip().upper(), title.strip()) for code, title in rows if code.strip()),
+            )
+            self._conn.execute("INSERT INTO codes_fts(codes_fts) VALUES ('rebuild')")
+            self._systems = None
+            return self._conn.execute("SELECT COUNT(*) FROM codes WHERE system = ?", (system,)).fetchone()[0]
+
+    def systems(self) -> set:
+        """Systems with at least one loaded code; codes of any other system cannot be verified"""
+        if self._systems is None:
+            with self._lock:
+                self._systems = {row[0] for row in self._conn.execute("SELECT DISTINCT system FROM codes")}
+        return self._systems
+
+    def lookup(self, system: str, code: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT title FROM codes WHERE system = ? AND code = ?", (system, code.upper())
+            ).fetchone()
+        return row[0] if row else None
+
+    def prefix(self, system: str, prefix: str, limit: int = 20) -> list:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT code, title FROM codes WHERE system = ? AND code >= ? AND code < ? ORDER BY code LIMIT ?",
+                (system, prefix.upper(), prefix.upper() + "\uffff", limit),
+            ).fetchall()
+
+    def search(self, text: str, system: str = None, limit: int = CANDIDATES_PER_SYSTEM) -> list:
+        """(code, title) pairs ranked by keyword relevance to free text"""
+        words = [word for word in dict.fromkeys(_WORD.findall(text.lower())) if word not in _STOPWORDS]
+        if not words:
+            return []
+        query = " OR ".join(f'"{word}"' for word in words)
+        sql = ("SELECT codes.code, codes.title FROM codes_fts JOIN codes ON codes.rowid = codes_fts.rowid"
+               " WHERE codes_fts MATCH ?")
+        params = [query]
+        if system:
+            sql += " AND codes.system = ?"
+            params.append(system)
+        sql += " ORDER BY bm25(codes_fts) LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def is_valid(self, system: str, code: str) -> bool:
+        """Well-formed and present in the index; False for a system with no loaded codes"""
+        code = code.upper()
+        if not _CODE_FORMATS[system].match(code):
+            return False
+        return system in self.systems() and self.lookup(system, code) is not None
+
+    def unverified_systems(self) -> list:
+        """Code systems whose codes are all withheld because no table for them is loaded"""
+        return [system for system in _CODE_FORMATS if system not in self.systems()]
+
+    def candidates_text(self, clinical_text: str) -> str:
+        """Short candidate list for the prompt, grouped by system"""
+        blocks = []
+        for system in sorted(self.systems()):
+            matches = self.search(clinical_text, system)
+            if matches:
+                label = SYSTEM_LABELS.get(system, system)
+                blocks.append(f"{label} candidates:\n" + "\n".join(f"- {code}: {title}" for code, title in matches))
+        if not blocks:
+            return ""
+        return "Choose codes ONLY from these candidates:\n\n" + "\n\n".join(blocks)
+
+    def _check_line(self, line: str, system):
+        """(lines to emit, system) for one output line, given the code section it appears in.
+
+        Fails closed: under an ICD-11/CPT heading a line is dropped if any code in it,
+        leading or inline, is malformed or not in the index. The heading of a system
+        with no loaded codes is followed by a note that its codes were withheld.
+        """
+        heading = _HEADING.match(line)
+        if heading:
+            system = _SECTION_SYSTEMS.get(heading.group("title").strip())
+            if system is not None and system not in self.systems():
+                return [line, unverified_note(system)], system
+            return [line], system
+        if system is not None and not all(self.is_valid(code_system, code)
+                                          for code_system, code in _line_codes(line, system)):
+            return [], system
+        return [line], system
+
+    def filter_lines(self, lines):
+        """Drop lines under code headings that carry a malformed or unknown code"""
+        system = None
+        for line in lines:
+            emit, system = self._check_line(line, system)
+            yield from emit
+
+    def filter_markdown(self, markdown: str) -> str:
+        return "\n".join(self.filter_lines(markdown.split("\n")))
+
+    def filter_stream(self, chunks):
+        """Streaming variant of filter_markdown; emits whole lines once they are validated"""
+        buffer, system = "", None
+        for chunk in chunks:
+            buffer += chunk
+            *complete, buffer = buffer.split("\n")
+            for line in complete:
+                emit, system = self._check_line(line, system)
+                for kept in emit:
+                    yield kept + "\n"
+        if buffer:
+            yield "\n".join(self._check_line(buffer, system)[0])
+
+    async def afilter_stream(self, chunks):
+        buffer, system = "", None
+        async for chunk in chunks:
+            buffer += chunk
+            *complete, buffer = buffer.split("\n")
+            for line in complete:
+                emit, system = self._check_line(line, system)
+                for kept in emit:
+                    yield kept + "\n"
+        if buffer:
+            yield "\n".join(self._check_line(buffer, system)[0])
+
+    def filter_codes(self, billing_codes):
+        """Remove unknown codes from a schemas.BillingCodes result and name the unverifiable systems"""
+        billing_codes.icd11_codes = [c for c in billing_codes.icd11_codes if self.is_valid("icd11", c.code)]
+        billing_codes.cpt_codes = [c for c in billing_codes.cpt_codes if self.is_valid("cpt", c.code)]
+        billing_codes.unverified_systems = self.unverified_systems()
+        return billing_codes
+
+
+def read_code_table(path: str):
+    """(code, title) rows from a CSV/TSV file with a header row"""
+    with open(path, newline="", encoding="utf-8") as f:
+        dialect = "excel-tab" if path.endswith((".tsv", ".txt")) else "excel"
+        reader = csv.DictReader(f, dialect=dialect)
+        columns = {name.lower(): name for name in reader.fieldnames}
+        code_column = columns.get("code")
+        title_column = columns.get("title") or columns.get("description")
+        if code_column is None or title_column is None:
+            raise ValueError(f"{path}: expected 'code' and 'title' (or 'description') columns")
+        for row in reader:
+            yield row[code_column], row[title_column]
+
+
+def unverified_note(system: str) -> str:
+    label = SYSTEM_LABELS[system]
+    return f"- Not verified: no {label} code table is loaded, so {label} codes are withheld."
+
+
+def _line_codes(line: str, system: str) -> list:
+    """(system, code) for the item's leading code and every code-shaped token after it"""
+    codes, rest = [], line
+    item = _CODE_ITEM.match(line)
+    if item:
+        codes.append((system, item.group("code").upper()))
+        rest = line[item.end():]
+    for token_system, pattern in _CODE_TOKENS.items():
+        codes.extend((token_system, token) for token in pattern.findall(rest))
+    return codes
+
+
+def _code_bullets(markdown: str):
+    """(system, item match, line) for each code item under an ICD-11/CPT heading"""
+    system = None
+    for line in markdown.split("\n"):
+        heading = _HEADING.match(line)
+        if heading:
+            system = _SECTION_SYSTEMS.get(heading.group("title").strip())
+            continue
+        bullet = _CODE_ITEM.match(line) if system else None
+        if bullet:
+            yield system, bullet, line
+
+
+def malformed_codes(markdown: str) -> list:
+    """Code bullets in markdown that do not match their system's code format (no index needed)"""
+    return [bullet.group("code") for system, bullet, _ in _code_bullets(markdown)
+            if not _CODE_FORMATS[system].match(bullet.group("code").upper())]
+
+
+def extract_codes(markdown: str) -> list:
+    """(system, code, description) for each well-formed code bullet in coder output"""
+    codes = []
+    for system, bullet, line in _code_bullets(markdown):
+        code = bullet.group("code").upper()
+        if _CODE_FORMATS[system].match(code):
+            codes.append((system, code, line[bullet.end():].strip()))
+    return codes
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_code_index():
+    """Shared index at CODE_INDEX_PATH, or None if no index has been built (see empty_code_index)"""
+    global _index
+    if _index is None and os.path.exists(DEFAULT_PATH):
+        with _index_lock:
+            if _index is None:
+                _index = CodeIndex(DEFAULT_PATH)
+    return _index
+
+
+def empty_code_index() -> CodeIndex:
+    """In-memory index with no codes: validating against it withholds every code"""
+    return CodeIndex(":memory:")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the local billing code index")
+    parser.add_argument("--db", default=DEFAULT_PATH, help="Index database path")
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("load", help="Load a code table")
+    load.add_argument("system", choices=sorted(SYSTEM_LABELS))
+    load.add_argument("table", help="CSV/TSV with code and title columns")
+    search = commands.add_parser("search", help="Keyword search")
+    search.add_argument("text")
+    search.add_argument("--system", choices=sorted(SYSTEM_LABELS))
+    args = parser.parse_args()
+
+    index = CodeIndex(args.db)
+    if args.command == "load":
+        count = index.load(args.system, read_code_table(args.table))
+        print(f"Loaded {count} {SYSTEM_LABELS[args.system]} codes into {args.db}")
+    else:
+        for code, title in index.search(args.text, args.system):
+            print(f"{code}\t{title}")
+
+
+if __name__ == "__main__":
+    main()
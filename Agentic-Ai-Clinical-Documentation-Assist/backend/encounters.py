@@ -0,0 +1,290 @@
+# backend/encounters.py
+"""Persistent store of generated documentation, served again without calling the LLM.
+
+When ENCOUNTER_DB_PATH is set, each documentation request handled by the API, the job
+workers or the Streamlit app is recorded there as an encounter in SQLite: the input
+(which includes patient data), each agent's output, the model that answered each
+agent and the timings. Error outputs are never recorded. Encounters are indexed by patient, date and
+billing code, and the generated text has an FTS5 index:
+
+    python encounters.py search "metformin adherence"
+    python encounters.py list --patient example --code 5A11
+
+Without ENCOUNTER_DB_PATH nothing is stored.
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import date
+
+from code_index import extract_codes
+
+OUTPUT_FIELDS = ("summary", "analysis", "soap_note", "codes")
+KINDS = ("summary", "analysis", "note", "codes", "visit", "revision")
+_JSON_FIELDS = ("request", "models", "timings")
+_WORD = re.compile(r"\w+")
+
+
+def _text(output) -> str:
+    if output is None or isinstance(output, str):
+        return output
+    return json.dumps(output.model_dump() if hasattr(output, "model_dump") else output)
+
+
+def _codes(output) -> list:
+    """(system, code, description) from coder output, markdown or structured"""
+    if output is None:
+        return []
+    if isinstance(output, str):
+        return extract_codes(output)
+    if hasattr(output, "model_dump"):
+        output = output.model_dump()
+    return [(system, code["code"].upper(), code.get("description") or "")
+            for system, key in (("icd11", "icd11_codes"), ("cpt", "cpt_codes"))
+            for code in output.get(key) or []]
+
+
+def call_details(calls: list) -> tuple:
+    """({agent: model}, {agent: seconds}) from metrics.capture_calls()"""
+    models, timings = {}, {}
+    for call in calls:
+        models[call.agent] = call.model
+        timings[call.agent] = round(timings.get(call.agent, 0.0) + call.timings.get("total", 0.0), 4)
+    return models, timings
+
+
+class EncounterStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS encounters (
+                seq INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                kind TEXT NOT NULL,
+                patient_id TEXT,
+                patient_name TEXT,
+                encounter_date TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                input_text TEXT NOT NULL,
+                request TEXT,
+                summary TEXT,
+                analysis TEXT,
+                soap_note TEXT,
+                codes TEXT,
+                models TEXT,
+                timings TEXT);
+            CREATE INDEX IF NOT EXISTS encounters_patient ON encounters (patient_id, encounter_date);
+            CREATE INDEX IF NOT EXISTS encounters_date ON encounters (encounter_date);
+            CREATE TABLE IF NOT EXISTS encounter_codes (
+                encounter_id TEXT NOT NULL,
+                system TEXT NOT NULL,
+                code TEXT NOT NULL,
+                description TEXT,
+                PRIMARY KEY (encounter_id, system, code));
+            CREATE INDEX IF NOT EXISTS encounter_codes_code ON encounter_codes (code, system);
+            CREATE VIRTUAL TABLE IF NOT EXISTS encounters_fts USING fts5(
+                summary, analysis, soap_note, codes, content='encounters', content_rowid='seq',
+                tokenize='porter unicode61');
+            CREATE TRIGGER IF NOT EXISTS encounters_fts_insert AFTER INSERT ON encounters BEGIN
+                INSERT INTO encounters_fts (rowid, summary, analysis, soap_note, codes)
+                VALUES (new.seq, new.summary, new.analysis, new.soap_note, new.codes);
+            END;
+            CREATE TRIGGER IF NOT EXISTS encounters_fts_delete AFTER DELETE ON encounters BEGIN
+                INSERT INTO encounters_fts (encounters_fts, rowid, summary, analysis, soap_note, codes)
+                VALUES ('delete', old.seq, old.summary, old.analysis, old.soap_note, old.codes);
+            END;
+        """)
+
+    def record(self, kind: str, input_text: str, outputs: dict, patient_id: str = "", patient_name: str = "",
+               request: dict = None, models: dict = None, timings: dict = None, encounter_date: str = None) -> str:
+        """Store one encounter; outputs maps OUTPUT_FIELDS to text or structured results"""
+        encounter_id = uuid.uuid4().hex
+        codes = _codes(outputs.get("codes"))
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO encounters (id, kind, patient_id, patient_name, encounter_date, created_at, input_text,"
+                " request, summary, analysis, soap_note, codes, models, timings)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (encounter_id, kind, patient_id or None, patient_name or None,
+                 str(encounter_date or date.today()), time.time(), input_text,
+                 json.dumps(request) if request is not None else None,
+                 *(_text(outputs.get(field)) for field in OUTPUT_FIELDS),
+                 json.dumps(models or {}), json.dumps(timings or {})),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO encounter_codes (encounter_id, system, code, description) VALUES (?, ?, ?, ?)",
+                ((encounter_id, system, code, description) for system, code, description in codes),
+            )
+        return encounter_id
+
+    def get(self, encounter_id: str):
+        """Encounter as a dict with its codes, or None if unknown"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM encounters WHERE id = ?", (encounter_id,)).fetchone()
+            codes = self._conn.execute(
+                "SELECT system, code, description FROM encounter_codes WHERE encounter_id = ? ORDER BY system, code",
+                (encounter_id,),
+            ).fetchall()
+        if row is None:
+            return None
+        encounter = self._encounter(row)
+        encounter["code_list"] = [dict(code) for code in codes]
+        return encounter
+
+    def find(self, patient_id: str = None, patient_name: str = None, date_from: str = None, date_to: str = None,
+             code: str = None, kind: str = None, limit: int = 50) -> list:
+        """Encounters matching every given filter, newest first; dates are inclusive YYYY-MM-DD"""
+        clauses, params = [], []
+        if patient_id:
+            clauses.append("patient_id = ?")
+            params.append(patient_id)
+        if patient_name:
+            clauses.append("patient_name LIKE ?")
+            params.append(f"%{patient_name}%")
+        if date_from:
+            clauses.append("encounter_date >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("encounter_date <= ?")
+            params.append(date_to)
+        if code:
+            clauses.append("id IN (SELECT encounter_id FROM encounter_codes WHERE code = ?)")
+            params.append(code.upper())
+        if kind:
+            clauses.append("kind = ?")
+            params.append(kind)
+        sql = "SELECT * FROM encounters"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY encounter_date DESC, created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._encounter(row) for row in rows]
+
+    def search(self, text: str, patient_id: str = None, limit: int = 20) -> list:
+        """Encounters whose generated text contains every word of text, best match first"""
+        words = _WORD.findall(text.lower())
+        if not words:
+            return []
+        sql = ("SELECT encounters.*, snippet(encounters_fts, -1, '[', ']', '…', 16) AS snippet"
+               " FROM encounters_fts JOIN encounters ON encounters.seq = encounters_fts.rowid"
+               " WHERE encounters_fts MATCH ?")
+        params = [" ".join(f'"{word}"' for word in words)]
+        if patient_id:
+            sql += " AND encounters.patient_id = ?"
+            params.append(patient_id)
+        sql += " ORDER BY bm25(encounters_fts) LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._encounter(row) for row in rows]
+
+    def delete(self, encounter_id: str) -> bool:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM encounter_codes WHERE encounter_id = ?", (encounter_id,))
+            return self._conn.execute("DELETE FROM encounters WHERE id = ?", (encounter_id,)).rowcount > 0
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT kind, COUNT(*) FROM encounters GROUP BY kind").fetchall()
+        return {kind: count for kind, count in rows}
+
+    def _encounter(self, row) -> dict:
+        encounter = dict(row)
+        del encounter["seq"]
+        for field in _JSON_FIELDS:
+            encounter[field] = json.loads(encounter[field]) if encounter[field] is not None else None
+        return encounter
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_encounter_store():
+    """Shared store at ENCOUNTER_DB_PATH, or None when it is not set"""
+    global _store
+    path = os.getenv("ENCOUNTER_DB_PATH")
+    if not path:
+        return None
+    if _store is None or _store.path != path:
+        with _store_lock:
+            if _store is None or _store.path != path:
+                _store = EncounterStore(path)
+    return _store
+
+
+def record_encounter(kind: str, input_text: str, outputs: dict, patient=None, calls=(), seconds: float = None,
+                     failed=(), **fields):
+    """Record with the shared store, taking patient, visit date, models and timings from the resource and calls.
+
+    failed names outputs that are an agent's error text; they are left out, and
+    nothing is recorded if no output is left. Returns the encounter id, or None when
+    nothing was recorded or the write failed: a storage problem never fails the
+    request that produced the documentation.
+    """
+    from fhir_compact import patient_identity, visit_date
+
+    store = get_encounter_store()
+    outputs = {field: output for field, output in outputs.items() if field not in failed}
+    if store is None or not any(outputs.get(field) is not None for field in OUTPUT_FIELDS):
+        return None
+    if patient is not None:
+        fields["patient_id"], fields["patient_name"] = patient_identity(patient)
+        fields["encounter_date"] = fields.get("encounter_date") or visit_date(patient)
+    models, timings = call_details(calls)
+    if seconds is not None:
+        timings["total"] = round(seconds, 4)
+    try:
+        return store.record(kind, input_text, outputs, models=models, timings=timings, **fields)
+    except sqlite3.Error:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stored encounters")
+    parser.add_argument("--db", default=os.getenv("ENCOUNTER_DB_PATH"), help="Encounter database path")
+    commands = parser.add_subparsers(dest="command", required=True)
+    search = commands.add_parser("search", help="Full-text search over generated documentation")
+    search.add_argument("text")
+    search.add_argument("--patient")
+    listing = commands.add_parser("list", help="Encounters by patient, date and code")
+    listing.add_argument("--patient")
+    listing.add_argument("--date-from")
+    listing.add_argument("--date-to")
+    listing.add_argument("--code")
+    listing.add_argument("--kind", choices=KINDS)
+    listing.add_argument("--limit", type=int, default=50)
+    commands.add_parser("stats", help="Encounter counts by kind")
+    args = parser.parse_args()
+    if not args.db:
+        parser.error("--db or ENCOUNTER_DB_PATH is required")
+
+    store = EncounterStore(args.db)
+    if args.command == "search":
+        for encounter in store.search(args.text, args.patient):
+            print(f"{encounter['id']}\t{encounter['encounter_date']}\t{encounter['kind']}\t{encounter['snippet']}")
+    elif args.command == "list":
+        for encounter in store.find(args.patient, None, args.date_from, args.date_to, args.code, args.kind,
+                                    args.limit):
+            print(f"{encounter['id']}\t{encounter['encounter_date']}\t{encounter['kind']}\t"
+                  f"{encounter['patient_id'] or ''}\t{encounter['patient_name'] or ''}")
+    else:
+        print(json.dumps(store.counts()))
+
+
+if __name__ == "__main__":
+    main()
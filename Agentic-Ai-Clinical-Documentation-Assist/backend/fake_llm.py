@@ -0,0 +1,266 @@
+# backend/fake_llm.py
+"""Deterministic local stand-in for the Groq chat model.
+
+Selected with LLM_BACKEND=fake (see llm_setup.py). It needs no network or API key,
+answers in the shape the prompt asks for (markdown sections or the JSON skeleton
+of the structured modes), and can simulate latency, errors and rate limits:
+
+| Variable | Default | Purpose |
+|---|---|---|
+| FAKE_LLM_LATENCY_MS | 200 | Mean time to first token |
+| FAKE_LLM_LATENCY_JITTER_MS | 50 | Spread of the latency distribution |
+| FAKE_LLM_LATENCY_DIST | normal | fixed, uniform, normal or lognormal |
+| FAKE_LLM_TOKENS_PER_SEC | 400 | Generation speed after the first token (0 = instant) |
+| FAKE_LLM_ERROR_RATE | 0 | Fraction of calls failing with a 500 |
+| FAKE_LLM_RATE_LIMIT_RATE | 0 | Fraction of calls failing with a 429 |
+| FAKE_LLM_RETRY_AFTER | 1 | Retry-After seconds sent with simulated 429s |
+| FAKE_LLM_SEED | 0 | Seed for latency and error sampling |
+
+Response text depends only on the prompt, so identical prompts get identical answers.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, Iterator, List, Optional
+
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from text_utils import count_tokens
+
+_HEADING = re.compile(r"^\s*(?:#+\s*)?\*\*[^*]+\*\*:?\s*$")
+_PLACEHOLDER_LINE = re.compile(r"^\s*(?:[•\-*]|\d+[.)])\s+.*<[^>]+>")
+_PLACEHOLDER = re.compile(r"<([^>]+)>")
+_CANDIDATE = re.compile(r"^- (?P<code>[0-9A-Z][0-9A-Z.&]*): (?P<title>.+)$")
+_DEFAULT_CODES = {"icd": ("5A11", "Type 2 diabetes mellitus"), "cpt": ("99213", "Office visit, established patient")}
+_WORD = re.compile(r"[A-Za-z][a-z]{3,}")
+_SHAPE_MARKER = "in exactly this shape"
+_FORMAT_MARKER = "Respond in this structured format:"
+_STREAM_PIECE = re.compile(r"\S+\s*|\s+")
+
+
+class FakeProviderError(Exception):
+    """Simulated upstream failure, shaped like the provider SDK's status errors"""
+
+    def __init__(self, status_code: int, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.status_code = status_code
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+        self.response = httpx.Response(status_code, headers=headers)
+
+
+class FakeRateLimitError(FakeProviderError):
+    def __init__(self, retry_after: float):
+        super().__init__(429, "Rate limit reached (simulated)", retry_after)
+
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(name) or default
+
+
+class FakeChatModel(BaseChatModel):
+    model_name: str = "fake-llm"
+    latency_ms: float = 200.0
+    latency_jitter_ms: float = 50.0
+    latency_distribution: str = "normal"
+    tokens_per_second: float = 400.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    seed: int = 0
+
+    _rng: random.Random = PrivateAttr()
+    _rng_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._rng = random.Random(self.seed)
+
+    @classmethod
+    def from_env(cls, model_name: str = "fake-llm") -> "FakeChatModel":
+        return cls(
+            model_name=model_name,
+            latency_ms=float(_env("FAKE_LLM_LATENCY_MS", "200")),
+            latency_jitter_ms=float(_env("FAKE_LLM_LATENCY_JITTER_MS", "50")),
+            latency_distribution=_env("FAKE_LLM_LATENCY_DIST", "normal"),
+            tokens_per_second=float(_env("FAKE_LLM_TOKENS_PER_SEC", "400")),
+            error_rate=float(_env("FAKE_LLM_ERROR_RATE", "0")),
+            rate_limit_rate=float(_env("FAKE_LLM_RATE_LIMIT_RATE", "0")),
+            retry_after=float(_env("FAKE_LLM_RETRY_AFTER", "1")),
+            seed=int(_env("FAKE_LLM_SEED", "0")),
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-clinical"
+
+    # -- simulation ---------------------------------------------------------------
+
+    def _sample(self):
+        """(first-token latency in seconds, simulated error or None) for one call"""
+        with self._rng_lock:
+            mean, jitter = self.latency_ms, self.latency_jitter_ms
+            if self.latency_distribution == "uniform":
+                latency = self._rng.uniform(mean - jitter, mean + jitter)
+            elif self.latency_distribution == "normal":
+                latency = self._rng.gauss(mean, jitter)
+            elif self.latency_distribution == "lognormal" and mean > 0:
+                sigma = math.sqrt(math.log(1 + (jitter / mean) ** 2))
+                latency = self._rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+            else:
+                latency = mean
+            roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            error = FakeRateLimitError(self.retry_after)
+        elif roll < self.rate_limit_rate + self.error_rate:
+            error = FakeProviderError(500, "Internal server error (simulated)")
+        else:
+            error = None
+        return max(0.0, latency) / 1000.0, error
+
+    def _piece_delay(self, piece: str) -> float:
+        return count_tokens(piece) / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _message(self, messages: List[BaseMessage], text: str) -> AIMessage:
+        input_tokens = sum(count_tokens(str(m.content)) for m in messages)
+        output_tokens = count_tokens(text)
+        return AIMessage(content=text, usage_metadata={
+            "input_tokens": input_tokens, "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        })
+
+    # -- LangChain interface --------------------------------------------------------
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        latency, error = self._sample()
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        text = fake_response(_prompt_text(messages))
+        time.sleep(self._piece_delay(text))
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, text))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        latency, error = self._sample()
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        text = fake_response(_prompt_text(messages))
+        await asyncio.sleep(self._piece_delay(text))
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, text))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        latency, error = self._sample()
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        for piece in _STREAM_PIECE.findall(fake_response(_prompt_text(messages))):
+            time.sleep(self._piece_delay(piece))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any):
+        latency, error = self._sample()
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        for piece in _STREAM_PIECE.findall(fake_response(_prompt_text(messages))):
+            await asyncio.sleep(self._piece_delay(piece))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+
+def _prompt_text(messages: List[BaseMessage]) -> str:
+    return "\n".join(str(message.content) for message in messages)
+
+
+def fake_response(prompt: str) -> str:
+    """Deterministic answer shaped like the output format the prompt asks for"""
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+    words = list(dict.fromkeys(word.lower() for word in _WORD.findall(prompt))) or ["finding"]
+    candidates = _candidates(prompt)
+
+    if _SHAPE_MARKER in prompt:
+        skeleton = prompt[prompt.rindex(_SHAPE_MARKER):]
+        start, end = skeleton.find("{"), skeleton.rfind("}")
+        if start != -1 and end > start:
+            try:
+                shape = json.loads(skeleton[start:end + 1])
+            except ValueError:
+                shape = None
+            if shape is not None:
+                return json.dumps(_fill_json(shape, rng, words, candidates), indent=1)
+
+    format_text = prompt[prompt.index(_FORMAT_MARKER):] if _FORMAT_MARKER in prompt else prompt
+    lines, system = [], "icd"
+    for line in format_text.splitlines():
+        if _HEADING.match(line):
+            if lines:
+                lines.append("")
+            lines.append(line.strip())
+            system = _system(line)
+        elif _PLACEHOLDER_LINE.match(line):
+            lines.append(_fill_line(line.strip(), rng, words, candidates[system]))
+    return "\n".join(lines) if lines else _phrase(rng, words, 12) + "."
+
+
+def _system(label: str) -> str:
+    return "cpt" if "cpt" in label.lower() else "icd"
+
+
+def _candidates(prompt: str) -> dict:
+    """Candidate (code, title) pairs offered in the prompt, by code system"""
+    found, system = {"icd": [], "cpt": []}, "icd"
+    for line in prompt.splitlines():
+        if line.rstrip().endswith("candidates:"):
+            system = _system(line)
+        match = _CANDIDATE.match(line.strip())
+        if match:
+            found[system].append((match.group("code"), match.group("title")))
+    return {key: codes or [_DEFAULT_CODES[key]] for key, codes in found.items()}
+
+
+def _phrase(rng: random.Random, words: list, size: int = 6) -> str:
+    return " ".join(rng.choice(words) for _ in range(size)).capitalize()
+
+
+def _fill_line(line: str, rng: random.Random, words: list, candidates: list) -> str:
+    code, title = rng.choice(candidates)
+
+    def fill(match):
+        name = match.group(1).lower()
+        if name == "code":
+            return code
+        if name == "description":
+            return title
+        if name == "level":
+            return str(rng.randint(2, 5))
+        if "if available" in name:
+            return "Not provided"
+        return _phrase(rng, words)
+
+    return _PLACEHOLDER.sub(fill, line)
+
+
+def _fill_json(shape, rng: random.Random, words: list, candidates: dict, field: str = ""):
+    if isinstance(shape, dict):
+        if set(shape) >= {"code", "description"}:
+            code, title = rng.choice(candidates[_system(field)])
+            return {"code": code, "description": title,
+                    **{key: _phrase(rng, words) for key in shape if key not in ("code", "description")}}
+        return {key: _fill_json(value, rng, words, candidates, key) for key, value in shape.items()}
+    if isinstance(shape, list):
+        return [_fill_json(shape[0], rng, words, candidates, field) for _ in range(rng.randint(1, 3))] if shape else []
+    if field == "level":
+        return str(rng.randint(2, 5))
+    return _phrase(rng, words)
@@ -0,0 +1,333 @@
+# backend/fhir_compact.py
+"""Flatten FHIR-style patient data into compact clinical text for prompts.
+
+Accepts either the flat shape used in sample_data/sample_patient.json (a Patient with
+conditions/observations/medications lists) or a FHIR Bundle of Patient, Condition,
+Observation, MedicationStatement/MedicationRequest and AllergyIntolerance resources.
+Ids, metadata, narrative and other structural fields are dropped, as are entries
+entered in error and refuted conditions and allergies. Any other top-level field of
+the flat shape is kept under "Other:"; data with no recognised clinical field at all
+is passed on as compact JSON rather than lost.
+"""
+import json
+
+from text_utils import count_tokens
+
+_MEDICATION_TYPES = ("MedicationStatement", "MedicationRequest")
+_RECOGNISED_KEYS = {"name", "gender", "birthDate", "conditions", "observations", "medications", "allergies"}
+# Ids, metadata and administrative fields that do not belong in a clinical prompt
+_STRUCTURAL_KEYS = {
+    "resourceType", "id", "meta", "text", "implicitRules", "language", "contained", "extension",
+    "modifierExtension", "identifier", "active", "telecom", "address", "photo", "contact", "communication",
+    "generalPractitioner", "managingOrganization", "link", "maritalStatus", "multipleBirthBoolean",
+    "multipleBirthInteger",
+}
+_EXCLUDED_STATUSES = {"entered-in-error", "refuted"}
+
+
+def _concept_text(concept) -> str:
+    if concept is None:
+        return ""
+    if isinstance(concept, str):
+        return concept
+    if concept.get("text"):
+        return concept["text"]
+    for coding in concept.get("coding", []):
+        if coding.get("display") or coding.get("code"):
+            return coding.get("display") or coding["code"]
+    return ""
+
+
+def _status_code(status) -> str:
+    """Lower-cased code of a status given as a string or CodeableConcept"""
+    if isinstance(status, dict):
+        for coding in status.get("coding", []):
+            if coding.get("code"):
+                return coding["code"].lower()
+        status = status.get("text")
+    return (status or "").lower()
+
+
+def _excluded(item: dict) -> bool:
+    """Entered in error, or a refuted condition or allergy"""
+    return any(_status_code(item.get(key)) in _EXCLUDED_STATUSES
+               for key in ("status", "clinicalStatus", "verificationStatus"))
+
+
+def _dosage_text(dosages) -> str:
+    """Dosage.text, or dose, frequency and route, of each dosage; a plain string as is"""
+    if isinstance(dosages, str):
+        return dosages
+    if isinstance(dosages, dict):
+        dosages = [dosages]
+    texts = []
+    for dosage in dosages or []:
+        if isinstance(dosage, str):
+            texts.append(dosage)
+            continue
+        if dosage.get("text"):
+            texts.append(dosage["text"])
+            continue
+        parts = [_quantity_text(rate["doseQuantity"]) for rate in dosage.get("doseAndRate", [])
+                 if rate.get("doseQuantity")]
+        repeat = dosage.get("timing", {}).get("repeat", {})
+        if repeat.get("frequency") and repeat.get("period"):
+            parts.append(f"{repeat['frequency']}x per {repeat['period']} {repeat.get('periodUnit', '')}".strip())
+        for key in ("route", "asNeededCodeableConcept"):
+            if dosage.get(key):
+                parts.append(_concept_text(dosage[key]))
+        if dosage.get("asNeededBoolean"):
+            parts.append("as needed")
+        if parts:
+            texts.append(" ".join(parts))
+    return "; ".join(texts)
+
+
+def _items(value) -> list:
+    """A list field as a list: a single entry (string or object) becomes a one-item list"""
+    if isinstance(value, (str, dict)):
+        return [value]
+    return value if isinstance(value, list) else []
+
+
+def _entry(item, key: str) -> dict:
+    """An entry as a resource-like dict; a plain string such as "Type 2 diabetes" names it under key"""
+    return item if isinstance(item, dict) else {key: str(item)}
+
+
+def _reaction_text(reactions) -> str:
+    texts = []
+    for reaction in _items(reactions):
+        if isinstance(reaction, str):
+            texts.append(reaction)
+            continue
+        manifestations = [_concept_text(item) for item in _items(reaction.get("manifestation"))]
+        text = ", ".join(item for item in manifestations if item)
+        if text and reaction.get("severity"):
+            text += f" ({reaction['severity']})"
+        if text:
+            texts.append(text)
+    return "; ".join(texts)
+
+
+def _name_text(names) -> str:
+    if isinstance(names, str):
+        return names
+    for name in _items(names):
+        if isinstance(name, str):
+            return name
+        if name.get("text"):
+            return name["text"]
+        parts = _items(name.get("given")) + ([name["family"]] if name.get("family") else [])
+        if parts:
+            return " ".join(parts)
+    return ""
+
+
+def _value_text(observation: dict) -> str:
+    if "value" in observation:
+        value = observation["value"]
+        return str(value) if not isinstance(value, dict) else _quantity_text(value)
+    if "valueQuantity" in observation:
+        return _quantity_text(observation["valueQuantity"])
+    if "valueCodeableConcept" in observation:
+        return _concept_text(observation["valueCodeableConcept"])
+    for key in ("valueString", "valueBoolean", "valueInteger"):
+        if key in observation:
+            return str(observation[key])
+    return ""
+
+
+def _quantity_text(quantity: dict) -> str:
+    unit = quantity.get("unit") or quantity.get("code") or ""
+    return f"{quantity.get('value', '')} {unit}".strip()
+
+
+def _observation_date(observation: dict) -> str:
+    return observation.get("date") or observation.get("effectiveDateTime") or observation.get("issued") or ""
+
+
+def _split_bundle(resource: dict):
+    """Return (patient, conditions, observations, medications, allergies)"""
+    if resource.get("resourceType") != "Bundle":
+        return (
+            resource,
+            [_entry(item, "code") for item in _items(resource.get("conditions"))],
+            _items(resource.get("observations")),
+            [_entry(item, "medication") for item in _items(resource.get("medications"))],
+            [_entry(item, "code") for item in _items(resource.get("allergies"))],
+        )
+
+    patient = {}
+    grouped = {"Condition": [], "Observation": [], "Medication": [], "AllergyIntolerance": []}
+    for entry in resource.get("entry", []):
+        item = entry.get("resource", entry)
+        kind = item.get("resourceType")
+        if kind == "Patient":
+            patient = item
+        elif kind in _MEDICATION_TYPES:
+            grouped["Medication"].append(item)
+        elif kind in grouped:
+            grouped[kind].append(item)
+    return (patient, grouped["Condition"], grouped["Observation"],
+            grouped["Medication"], grouped["AllergyIntolerance"])
+
+
+def _latest_observations(observations, max_values: int) -> dict:
+    """Deduplicated observations grouped by code, newest first, capped at max_values"""
+    by_code = {}
+    for observation in observations:
+        if not isinstance(observation, dict) or _excluded(observation):
+            continue
+        name = _concept_text(observation.get("code"))
+        value = _value_text(observation)
+        if not name or not value:
+            continue
+        entry = (_observation_date(observation), value, observation.get("trend", ""))
+        values = by_code.setdefault(name, [])
+        if entry not in values:
+            values.append(entry)
+    for values in by_code.values():
+        values.sort(key=lambda entry: entry[0], reverse=True)
+        del values[max_values:]
+    return by_code
+
+
+def patient_identity(resource) -> tuple:
+    """(patient id, display name) of a patient resource or bundle; empty strings if absent"""
+    if isinstance(resource, str):
+        resource = json.loads(resource)
+    patient = _split_bundle(resource)[0]
+    return str(patient.get("id") or ""), _name_text(patient.get("name"))
+
+
+def visit_date(resource) -> str:
+    """Start date (YYYY-MM-DD) of the first Encounter in a bundle; empty if there is none"""
+    if isinstance(resource, str):
+        resource = json.loads(resource)
+    for entry in resource.get("entry", []) if resource.get("resourceType") == "Bundle" else []:
+        item = entry.get("resource", entry)
+        if item.get("resourceType") == "Encounter":
+            start = (item.get("period") or {}).get("start") or ""
+            if start:
+                return start[:10]
+    return ""
+
+
+def compact_patient(resource, max_values: int = 3) -> str:
+    """Canonical clinical text for a patient resource or bundle; unrecognised data as compact JSON"""
+    if isinstance(resource, str):
+        try:
+            resource = json.loads(resource)
+        except ValueError:
+            return resource  # already text
+    if not isinstance(resource, dict):
+        return json.dumps(resource, separators=(",", ":"), ensure_ascii=False)
+    patient, conditions, observations, medications, allergies = _split_bundle(resource)
+    lines = []
+
+    header = [_name_text(patient.get("name")), patient.get("gender", "")]
+    if patient.get("birthDate"):
+        header.append(f"born {patient['birthDate']}")
+    header = [part for part in header if part]
+    if header:
+        lines.append("Patient: " + ", ".join(header))
+
+    condition_lines = []
+    for condition in conditions:
+        name = _concept_text(condition.get("code"))
+        if not name or _excluded(condition):
+            continue
+        details = []
+        onset = condition.get("onsetDate") or condition.get("onsetDateTime")
+        if onset:
+            details.append(f"onset {onset}")
+        status = _concept_text(condition.get("clinicalStatus"))
+        if status:
+            details.append(status)
+        # Only worth stating when not confirmed (provisional, differential, unconfirmed)
+        verification = _concept_text(condition.get("verificationStatus"))
+        if verification and _status_code(condition.get("verificationStatus")) != "confirmed":
+            details.append(verification)
+        line = f"- {name}" + (f" ({', '.join(details)})" if details else "")
+        if line not in condition_lines:
+            condition_lines.append(line)
+    if condition_lines:
+        lines.append("Conditions:")
+        lines.extend(condition_lines)
+
+    latest = _latest_observations(observations, max_values)
+    if latest:
+        lines.append("Observations:")
+        for name, values in latest.items():
+            rendered = []
+            for date, value, trend in values:
+                extra = "; ".join(part for part in (date, trend) if part)
+                rendered.append(f"{value} ({extra})" if extra else value)
+            lines.append(f"- {name}: " + ", ".join(rendered))
+    # Observations given as plain text, e.g. "BP 140/90", are kept as written
+    noted = [f"- {observation}" for observation in observations
+             if not isinstance(observation, dict) and observation not in (None, "")]
+    if noted:
+        if not latest:
+            lines.append("Observations:")
+        lines.extend(dict.fromkeys(noted))
+
+    medication_lines = []
+    for medication in medications:
+        name = _concept_text(medication.get("medication") or medication.get("medicationCodeableConcept"))
+        if not name or _excluded(medication):
+            continue
+        details = [_dosage_text(medication.get("dosageInstruction") or medication.get("dosage"))]
+        details += [medication[key] if key == "status" else f"{key} {medication[key]}"
+                    for key in ("status", "adherence") if medication.get(key)]
+        details = [detail for detail in details if detail]
+        line = f"- {name}" + (f" ({', '.join(details)})" if details else "")
+        if line not in medication_lines:
+            medication_lines.append(line)
+    if medication_lines:
+        lines.append("Medications:")
+        lines.extend(medication_lines)
+
+    allergy_lines = []
+    for allergy in allergies:
+        name = _concept_text(allergy.get("code") or allergy.get("substance"))
+        if not name or _excluded(allergy):
+            continue
+        details = [_reaction_text(allergy.get("reaction"))]
+        if allergy.get("criticality"):
+            details.append(f"criticality {allergy['criticality']}")
+        if _status_code(allergy.get("verificationStatus")) not in ("", "confirmed"):
+            details.append(_concept_text(allergy["verificationStatus"]))
+        details = [detail for detail in details if detail]
+        line = f"- {name}" + (f" ({', '.join(details)})" if details else "")
+        if line not in allergy_lines:
+            allergy_lines.append(line)
+    if allergy_lines:
+        lines.append("Allergies:")
+        lines.extend(allergy_lines)
+
+    if not lines:
+        return json.dumps(resource, separators=(",", ":"), ensure_ascii=False)
+    if resource.get("resourceType") != "Bundle":
+        other = {key: value for key, value in resource.items()
+                 if key not in _RECOGNISED_KEYS and key not in _STRUCTURAL_KEYS and value not in (None, "", [], {})}
+        if other:
+            lines.append("Other:")
+            lines.extend(f"- {key}: {value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)}"
+                         for key, value in other.items())
+    return "\n".join(lines)
+
+
+def compact_patient_with_stats(resource, max_values: int = 3):
+    """compact_patient plus token counts against the pretty-printed JSON it replaces"""
+    if isinstance(resource, str):
+        resource = json.loads(resource)
+    text = compact_patient(resource, max_values)
+    tokens_before = count_tokens(json.dumps(resource, indent=2))
+    tokens_after = count_tokens(text)
+    return text, {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "reduction": round(1 - tokens_after / tokens_before, 3) if tokens_before else 0.0,
+    }
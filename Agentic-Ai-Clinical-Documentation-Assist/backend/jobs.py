@@ -0,0 +1,399 @@
+# backend/jobs.py
+"""Persistent job queue for long-running documentation work.
+
+Jobs are stored in SQLite (JOB_DB_PATH) and executed by a pool of async workers.
+Workers run inside the API process (JOB_WORKERS, default 2), or in separate
+processes sharing the same database:
+
+    python jobs.py worker --concurrency 8
+
+A worker holds a lease on each running job and renews it while the job runs. If a
+worker dies, its jobs are picked up again once the lease expires. Failed jobs are
+retried with exponential backoff up to max_attempts; a job whose payload is
+malformed fails at once. Finished results are kept for JOB_RESULT_TTL seconds.
+
+Job kinds and payloads mirror the HTTP endpoints:
+    visit     {"patient_info": {...}, "conversation_text": "...", "specialty": "general"}
+    summary   {"patient_info": {...}}
+    analysis  {"conversation_text": "...", "specialty": "general"}
+    note      {"patient_info": {...}}
+    codes     {"patient_info": {...}}
+    batch     {"records": [{...}, ...], "concurrency": 4}
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from agents import get_agent
+from encounters import KINDS as ENCOUNTER_KINDS, record_encounter
+from metrics import capture_calls
+from scheduler import BATCH, INTERACTIVE, request_context
+
+DEFAULT_PATH = os.getenv("JOB_DB_PATH", "jobs.sqlite3")
+RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "86400"))
+LEASE_SECONDS = 60.0
+CHECK_INTERVAL = 1.0  # how often a running job renews its lease and looks for cancellation
+RETRY_BASE_SECONDS = 5.0
+FINISHED = ("succeeded", "failed", "cancelled")
+
+logger = logging.getLogger(__name__)
+
+
+class JobStore:
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                client_id TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                result TEXT,
+                error TEXT,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_until REAL,
+                not_before REAL NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                expires_at REAL);
+            CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority, not_before);
+        """)
+
+    def submit(self, kind: str, payload: dict, max_attempts: int = 3, priority: int = INTERACTIVE,
+               client_id: str = None) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, payload, priority, client_id, status, max_attempts, not_before, created_at)"
+                " VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), priority, client_id, max_attempts, now, now),
+            )
+        return job_id
+
+    def get(self, job_id: str):
+        """Job row as a dict, or None if unknown or expired"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (row["expires_at"] and row["expires_at"] < time.time()):
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def claim(self, worker: str, lease: float = LEASE_SECONDS):
+        """Atomically take the next ready job: queued, or running under an expired lease"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', finished_at = ?, expires_at = ?"
+                    " WHERE status = 'running' AND cancel_requested = 1 AND lease_until < ?",
+                    (now, now + RESULT_TTL, now),
+                )
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE ((status = 'queued' AND not_before <= ?)"
+                    " OR (status = 'running' AND lease_until < ?)) AND cancel_requested = 0"
+                    " ORDER BY priority, created_at LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?,"
+                        " lease_until = ?, started_at = ? WHERE id = ?",
+                        (worker, now + lease, now, row["id"]),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"]) if row is not None else None
+
+    def renew(self, job_id: str, worker: str, lease: float = LEASE_SECONDS) -> bool:
+        """Extend the lease; False if cancellation was requested or the job was taken over"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + lease, job_id, worker),
+            )
+            row = self._conn.execute("SELECT cancel_requested, worker FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is not None and not row["cancel_requested"] and row["worker"] == worker
+
+    def complete(self, job_id: str, result, ttl: float = RESULT_TTL):
+        self._finish(job_id, "succeeded", result=json.dumps(result), ttl=ttl)
+
+    def fail(self, job_id: str, error: str, ttl: float = RESULT_TTL, retry: bool = True) -> str:
+        """Record a failed attempt; requeues with backoff while attempts remain, unless retry is False.
+
+        Returns the new status.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if retry and row is not None and row["attempts"] < row["max_attempts"]:
+                delay = RETRY_BASE_SECONDS * 2 ** (row["attempts"] - 1)
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'queued', error = ?, worker = NULL, lease_until = NULL,"
+                    " not_before = ? WHERE id = ?",
+                    (error, time.time() + delay, job_id),
+                )
+                return "queued"
+        self._finish(job_id, "failed", error=error, ttl=ttl)
+        return "failed"
+
+    def cancel(self, job_id: str):
+        """Cancel a queued job now, or flag a running one for its worker; None if unknown"""
+        job = self.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            return job
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+        if job["status"] == "queued":
+            self._finish(job_id, "cancelled")
+        return self.get(job_id)
+
+    def mark_cancelled(self, job_id: str):
+        self._finish(job_id, "cancelled")
+
+    def _finish(self, job_id: str, status: str, result: str = None, error: str = None, ttl: float = RESULT_TTL):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = COALESCE(?, error), finished_at = ?,"
+                " expires_at = ?, lease_until = NULL WHERE id = ?",
+                (status, result, error, now, now + ttl, job_id),
+            )
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM jobs WHERE expires_at < ?", (time.time(),)).rowcount
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+# Required payload fields of each job kind and their types
+PAYLOAD_FIELDS = {
+    "visit": {"patient_info": dict, "conversation_text": str},
+    "summary": {"patient_info": dict},
+    "analysis": {"conversation_text": str},
+    "note": {"patient_info": dict},
+    "codes": {"patient_info": dict},
+    "batch": {"records": list},
+}
+
+
+def payload_error(kind: str, payload) -> str:
+    """Why a job can never succeed with this kind and payload, or None if it is well-formed"""
+    if kind not in PAYLOAD_FIELDS:
+        return f"unknown job kind {kind!r}"
+    if not isinstance(payload, dict):
+        return "payload must be an object"
+    for field, expected in PAYLOAD_FIELDS[kind].items():
+        if not isinstance(payload.get(field), expected):
+            return f"{kind} payload needs {field!r} ({expected.__name__})"
+    if kind == "batch":
+        from batch import MAX_CONCURRENCY
+
+        concurrency = payload.get("concurrency", 4)
+        if not isinstance(concurrency, int) or not 1 <= concurrency <= MAX_CONCURRENCY:
+            return f"batch concurrency must be between 1 and {MAX_CONCURRENCY}"
+        for i, record in enumerate(payload["records"]):
+            if not isinstance(record, dict):
+                return f"batch record {i} must be an object"
+    return None
+
+
+class JobHandlers:
+    """Runs one job payload through the agents"""
+
+    def __init__(self):
+        self.prep_agent = get_agent("preparation")
+        self.note_agent = get_agent("note_generator")
+        self.coder_agent = get_agent("coder")
+
+    def _dialogue_agent(self, specialty: str):
+        return get_agent("dialogue", specialty)
+
+    async def run(self, kind: str, payload: dict):
+        from fhir_compact import compact_patient
+
+        use_cache = payload.get("use_cache", True)
+        if kind == "visit":
+            from pipeline import VisitPipeline
+
+            pipeline = VisitPipeline(self.prep_agent, self._dialogue_agent(payload.get("specialty", "general")),
+                                     self.note_agent, self.coder_agent)
+            return await pipeline.arun(compact_patient(payload["patient_info"]), payload["conversation_text"],
+                                       use_cache)
+        if kind == "summary":
+            return {"summary": await self.prep_agent.arun(compact_patient(payload["patient_info"]), use_cache)}
+        if kind == "analysis":
+            agent = self._dialogue_agent(payload.get("specialty", "general"))
+            return {"analysis": await agent.arun(payload["conversation_text"], use_cache)}
+        if kind == "note":
+            return {"soap_note": await self.note_agent.arun(compact_patient(payload["patient_info"]), use_cache)}
+        if kind == "codes":
+            return {"codes": await self.coder_agent.arun(compact_patient(payload["patient_info"]), use_cache,
+                                                         raise_errors=True)}
+        if kind == "batch":
+            from batch import BatchRunner
+
+            runner = BatchRunner(payload.get("concurrency", 4), use_cache)
+            items = ((record.get("id", str(i)), record) for i, record in enumerate(payload["records"]))
+            results = [result async for result in runner.run(items)]
+            return {"results": results, "stats": runner.stats()}
+        raise ValueError(f"unknown job kind {kind!r}")
+
+    def record(self, kind: str, payload: dict, result: dict, calls: list, seconds: float):
+        """Store a finished job's documentation as an encounter; batch jobs and error outputs are not recorded"""
+        if kind not in ENCOUNTER_KINDS:
+            return
+        from fhir_compact import compact_patient
+
+        patient = payload.get("patient_info")
+        parts = [compact_patient(patient)] if patient else []
+        if payload.get("conversation_text"):
+            parts.append(payload["conversation_text"])
+        failed = {"codes"} if self.coder_agent.failed(result.get("codes")) else set()
+        record_encounter(kind, "\n\n".join(parts), result, patient, calls, seconds, failed, request=payload,
+                         encounter_date=payload.get("encounter_date"))
+
+
+JOB_KINDS = ("visit", "summary", "analysis", "note", "codes", "batch")
+
+
+class JobWorkerPool:
+    def __init__(self, store: JobStore, concurrency: int = 2, poll_interval: float = 0.5):
+        self.store = store
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.handlers = None
+        self._tasks = []
+
+    def start(self):
+        self.handlers = self.handlers or JobHandlers()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._purger()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        # SQLite calls run in threads so a busy database never blocks the event loop
+        while True:
+            job = await asyncio.to_thread(self.store.claim, self.worker_id)
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            await self._execute(job)
+
+    async def _execute(self, job: dict):
+        error = payload_error(job["kind"], job["payload"])
+        if error is not None:
+            # Retrying cannot fix a malformed payload
+            await asyncio.to_thread(self.store.fail, job["id"], f"InvalidPayload: {error}", retry=False)
+            return
+        priority = BATCH if job["kind"] == "batch" else job["priority"]
+        with request_context(priority=priority, client_id=job["client_id"] or "jobs"), capture_calls() as calls:
+            task = asyncio.create_task(self.handlers.run(job["kind"], job["payload"]))
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=CHECK_INTERVAL)
+                if done:
+                    break
+                if not await asyncio.to_thread(self.store.renew, job["id"], self.worker_id):
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    # The job may have expired and been purged meanwhile
+                    current = await asyncio.to_thread(self.store.get, job["id"])
+                    if current is not None and current["cancel_requested"]:
+                        await asyncio.to_thread(self.store.mark_cancelled, job["id"])
+                    return
+            await asyncio.to_thread(self.store.complete, job["id"], task.result())
+        except asyncio.CancelledError:
+            # Pool shutdown: abandon the job; it is re-claimed when the lease expires
+            task.cancel()
+            raise
+        except Exception as e:
+            await asyncio.to_thread(self.store.fail, job["id"], f"{type(e).__name__}: {e}")
+            return
+        try:
+            await asyncio.to_thread(self.handlers.record, job["kind"], job["payload"], task.result(), calls,
+                                    time.time() - job["started_at"])
+        except Exception:
+            # The job has succeeded; a failed encounter write must not fail or re-run it
+            logger.exception("Could not record job %s as an encounter", job["id"])
+
+    async def _purger(self):
+        while True:
+            await asyncio.to_thread(self.store.purge_expired)
+            await asyncio.sleep(600)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = JobStore(DEFAULT_PATH)
+    return _store
+
+
+async def run_worker(args):
+    pool = JobWorkerPool(JobStore(args.db), args.concurrency, args.poll_interval)
+    pool.start()
+    print(f"Job worker {pool.worker_id} running {args.concurrency} tasks on {args.db}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await pool.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Documentation job queue")
+    parser.add_argument("--db", default=DEFAULT_PATH, help="Job database path")
+    commands = parser.add_subparsers(dest="command", required=True)
+    worker = commands.add_parser("worker", help="Run a worker process")
+    worker.add_argument("-c", "--concurrency", type=int, default=int(os.getenv("JOB_WORKERS", "4")))
+    worker.add_argument("--poll-interval", type=float, default=0.5)
+    commands.add_parser("stats", help="Job counts by status")
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        asyncio.run(run_worker(args))
+    else:
+        print(json.dumps(JobStore(args.db).counts()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# backend/live_analysis.py
+"""Incremental conversation analysis for live visits.
+
+Each update sends only the turns added since the last update, a couple of earlier
+turns for context and the current analysis, so the cost of an update stays flat as
+the visit goes on instead of re-analyzing the whole transcript.
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+from typing import TYPE_CHECKING
+
+from agents import get_agent
+from text_utils import count_tokens, parse_sections, render_sections, split_turns
+
+if TYPE_CHECKING:
+    from agents.dialogue_agent import DialogueAgent
+
+CONTEXT_TURNS = 2
+SESSION_TTL = 4 * 60 * 60
+MAX_SESSIONS = int(os.getenv("LIVE_MAX_SESSIONS", "1000"))
+
+
+class LiveAnalysisSession:
+    def __init__(self, specialty: str = "general", agent: "DialogueAgent" = None,
+                 context_turns: int = CONTEXT_TURNS):
+        self.session_id = uuid.uuid4().hex
+        self.agent = agent or get_agent("dialogue", specialty)
+        self.context_turns = context_turns
+        self.turns = []
+        self.processed = 0
+        self.analysis = ""
+        self.updates = 0
+        self.last_prompt_tokens = 0
+        self.updated_at = time.time()
+        self._sync_lock = threading.Lock()
+        self._async_lock = None
+
+    def append(self, turns) -> int:
+        """Add turns (a list, or raw transcript text split on speaker labels); returns pending count"""
+        if isinstance(turns, str):
+            turns = split_turns(turns)
+        self.turns.extend(turn.strip() for turn in turns if turn.strip())
+        self.updated_at = time.time()
+        return len(self.turns) - self.processed
+
+    def update(self, use_cache: bool = True) -> str:
+        with self._sync_lock:
+            end, inputs = self._pending()
+            if inputs is None:
+                return self.analysis
+            result = self.agent.update(*inputs, use_cache=use_cache)
+            return self._apply(end, result)
+
+    async def aupdate(self, use_cache: bool = True) -> str:
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            end, inputs = self._pending()
+            if inputs is None:
+                return self.analysis
+            result = await self.agent.aupdate(*inputs, use_cache=use_cache)
+            return self._apply(end, result)
+
+    def _pending(self):
+        end = len(self.turns)
+        if end == self.processed:
+            return end, None
+        context = self.turns[max(0, self.processed - self.context_turns):self.processed]
+        inputs = (self.analysis, "\n".join(self.turns[self.processed:end]), "\n".join(context))
+        self.last_prompt_tokens = sum(count_tokens(part) for part in inputs)
+        return end, inputs
+
+    def _apply(self, end: int, result: str) -> str:
+        # Re-render to the canonical section layout so the carried state stays compact
+        sections = parse_sections(result)
+        self.analysis = render_sections(sections) if sections else result.strip()
+        self.processed = end
+        self.updates += 1
+        self.updated_at = time.time()
+        return self.analysis
+
+    def status(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "specialty": self.agent.clinician_specialty,
+            "turns_total": len(self.turns),
+            "turns_processed": self.processed,
+            "updates": self.updates,
+            "last_prompt_tokens": self.last_prompt_tokens,
+            "analysis": self.analysis,
+        }
+
+
+class LiveSessionStore:
+    """In-process registry of live sessions.
+
+    Idle sessions expire after ttl seconds; beyond max_sessions the least recently
+    active session is evicted to make room for a new one.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, max_sessions: int = MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max(1, max_sessions)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, specialty: str = "general") -> LiveAnalysisSession:
+        session = LiveAnalysisSession(specialty)
+        with self._lock:
+            self._evict_expired()
+            while len(self._sessions) >= self.max_sessions:
+                del self._sessions[min(self._sessions, key=lambda sid: self._sessions[sid].updated_at)]
+            self._sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id: str) -> LiveAnalysisSession:
+        """Raises KeyError for unknown or expired sessions"""
+        with self._lock:
+            self._evict_expired()
+            return self._sessions[session_id]
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.ttl
+        for session_id in [sid for sid, s in self._sessions.items() if s.updated_at < cutoff]:
+            del self._sessions[session_id]
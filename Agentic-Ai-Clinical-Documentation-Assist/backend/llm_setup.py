@@ -1,15 +1,188 @@
-from langchain_groq import ChatGroq
 from dotenv import load_dotenv
 import os
+import threading
 
 load_dotenv()
 
-def get_llm():
+# Using 'llama3-70b-8192' as the recommended Groq model
+DEFAULT_MODEL = "llama3-70b-8192"
+
+# Process-wide registry: one client (and one keep-alive connection pool) per
+# model, shared by every agent instance and every Streamlit session.
+_llm_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def get_pool_settings() -> dict:
+    """Connection pool and timeout settings, overridable via environment variables"""
+    return {
+        "max_connections": _env_int("LLM_POOL_MAX_CONNECTIONS", 20),
+        "max_keepalive_connections": _env_int("LLM_POOL_MAX_KEEPALIVE", 10),
+        "keepalive_expiry": _env_float("LLM_POOL_KEEPALIVE_EXPIRY", 30.0),
+        "timeout": _env_float("LLM_TIMEOUT", 60.0),
+        "connect_timeout": _env_float("LLM_CONNECT_TIMEOUT", 10.0),
+        "max_retries": _env_int("LLM_MAX_RETRIES", 2),
+    }
+
+
+def _build_http_clients(settings: dict):
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=settings["max_connections"],
+        max_keepalive_connections=settings["max_keepalive_connections"],
+        keepalive_expiry=settings["keepalive_expiry"],
+    )
+    timeout = httpx.Timeout(settings["timeout"], connect=settings["connect_timeout"])
+    return (
+        httpx.Client(limits=limits, timeout=timeout),
+        httpx.AsyncClient(limits=limits, timeout=timeout),
+    )
+
+
+def _build_groq(model_name: str):
     api_key = os.getenv("groq_api_key")
     if not api_key:
         raise ValueError("groq_api_key not found in environment variables.")
-    # Using 'llama3-70b-8192' as the recommended Groq model
+
+    # Imported on first use: langchain_groq dominates startup time otherwise
+    from langchain_groq import ChatGroq
+
+    settings = get_pool_settings()
+    http_client, http_async_client = _build_http_clients(settings)
     return ChatGroq(
-        model_name="llama3-70b-8192",
-        groq_api_key=api_key
+        model_name=model_name,
+        groq_api_key=api_key,
+        request_timeout=settings["timeout"],
+        max_retries=settings["max_retries"],
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+
+
+def gemini_model(model_name: str) -> str:
+    """Gemini model for the tier model_name names: Gemini names as is, Groq names by tier"""
+    if model_name.startswith("gemini"):
+        return model_name
+    if model_name == DEFAULT_MODEL:
+        return os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
+    # Any other Groq model is a smaller tier, e.g. the cascade's LLM_SMALL_MODEL
+    return os.getenv("GEMINI_SMALL_MODEL", "gemini-1.5-flash")
+
+
+def _build_gemini(model_name: str):
+    api_key = os.getenv("gemini_api_key")
+    if not api_key:
+        raise ValueError("gemini_api_key not found in environment variables.")
+
+    # Optional dependency, only needed when gemini is configured
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    settings = get_pool_settings()
+    return ChatGoogleGenerativeAI(
+        model=gemini_model(model_name),
+        google_api_key=api_key,
+        timeout=settings["timeout"],
+        max_retries=settings["max_retries"],
     )
+
+
+def _build_fake(model_name: str):
+    # Local stand-in for offline load tests and profiling; see fake_llm.py
+    from fake_llm import FakeChatModel
+    return FakeChatModel.from_env(model_name)
+
+
+# LLM_BACKEND selects how clients are built
+BACKENDS = {
+    "groq": _build_groq,
+    "gemini": _build_gemini,
+    "fake": _build_fake,
+}
+
+
+def get_backend_name() -> str:
+    name = os.getenv("LLM_BACKEND", "groq").lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND {name!r}; expected one of {', '.join(BACKENDS)}")
+    return name
+
+
+def get_provider_names() -> list:
+    """Backends in failover order: LLM_PROVIDERS (e.g. "groq,gemini"), else LLM_BACKEND alone"""
+    names = []
+    for name in os.getenv("LLM_PROVIDERS", "").lower().split(","):
+        name = name.strip()
+        if name and name not in names:
+            if name not in BACKENDS:
+                raise ValueError(f"Unknown provider {name!r} in LLM_PROVIDERS; expected one of {', '.join(BACKENDS)}")
+            names.append(name)
+    return names or [get_backend_name()]
+
+
+def _build(model_name: str):
+    names = get_provider_names()
+    if len(names) == 1:
+        return BACKENDS[names[0]](model_name)
+
+    from providers import ProviderPool
+    return ProviderPool.create([(name, BACKENDS[name](model_name)) for name in names])
+
+
+def get_llm(model_name: str = DEFAULT_MODEL):
+    """Return the shared chat model client for model_name, creating it on first use"""
+    llm = _llm_registry.get(model_name)
+    if llm is not None:
+        return llm
+
+    with _registry_lock:
+        llm = _llm_registry.get(model_name)
+        if llm is not None:
+            return llm
+
+        llm = _build(model_name)
+        _llm_registry[model_name] = llm
+        return llm
+
+
+def _release_clients() -> list:
+    # Clears the registry and returns every underlying chat model, including each provider's in a pool
+    with _registry_lock:
+        llms = list(_llm_registry.values())
+        _llm_registry.clear()
+    return [client for llm in llms for client in getattr(llm, "clients", None) or [llm]]
+
+
+def close_llms():
+    """Close pooled sync connections and clear the registry; async code should use aclose_llms"""
+    for client in _release_clients():
+        if getattr(client, "http_client", None) is not None:
+            client.http_client.close()
+
+
+async def aclose_llms():
+    """Close pooled sync and async connections and clear the registry (e.g. on application shutdown)"""
+    for client in _release_clients():
+        if getattr(client, "http_client", None) is not None:
+            client.http_client.close()
+        if getattr(client, "http_async_client", None) is not None:
+            await client.http_async_client.aclose()
+
+
+def provider_stats() -> dict:
+    """Health of each provider per model, for clients built with several LLM_PROVIDERS"""
+    from providers import ProviderPool
+
+    with _registry_lock:
+        llms = dict(_llm_registry)
+    return {model: llm.stats() for model, llm in llms.items() if isinstance(llm, ProviderPool)}
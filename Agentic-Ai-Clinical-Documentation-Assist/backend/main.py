@@ -1,40 +1,430 @@
 # backend/main.py
-from fastapi import FastAPI
+import time
+_import_started = time.perf_counter()
+
+import asyncio
+import json
+import logging
+import os
+from datetime import date
+from typing import Optional
+import metrics
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from agents.preparation_agent import PreparationAgent
-from agents.dialogue_agent import DialogueAgent
-from agents.note_generator_agent import NoteGeneratorAgent
-from agents.coder_agent import CoderAgent
+from agents import construction_times, get_agent
+from batch import MAX_CONCURRENCY as BATCH_MAX_CONCURRENCY, BatchRunner, iter_ndjson_lines
+from encounters import KINDS as ENCOUNTER_KINDS, get_encounter_store, record_encounter
+from fhir_compact import compact_patient, compact_patient_with_stats
+from jobs import JOB_KINDS, JobWorkerPool, get_job_store, payload_error
+from live_analysis import LiveSessionStore
+from llm_setup import aclose_llms, get_provider_names, provider_stats
+from near_duplicate import get_near_duplicate_index
+from pipeline import VisitPipeline
+from schemas import PreVisitSummary, DialogueAnalysis, SoapNote, BillingCodes
+from structured_output import StructuredOutputError
+from response_cache import get_response_cache
+from scheduler import BATCH, INTERACTIVE, current_client_id, get_scheduler, is_retryable, request_context, retry_after_seconds
+
+# Agents (and LangChain with them) are imported and built on the first request that needs them
+startup_report = {"import_seconds": time.perf_counter() - _import_started, "startup_seconds": None}
 
 app = FastAPI()
+logger = logging.getLogger(__name__)
+
+live_sessions = LiveSessionStore()
+
+@app.middleware("http")
+async def client_context(request: Request, call_next):
+    # Scheduler fair-queues upstream calls per client
+    client_id = request.headers.get("x-client-id") or (request.client.host if request.client else "anonymous")
+    with request_context(client_id=client_id):
+        return await call_next(request)
 
-prep_agent = PreparationAgent()
-dialogue_agent = DialogueAgent()
-note_agent = NoteGeneratorAgent()
-coder_agent = CoderAgent()
+@app.exception_handler(Exception)
+async def provider_error(request: Request, exc: Exception):
+    if is_retryable(exc):
+        retry_after = retry_after_seconds(exc) or 1
+        return JSONResponse(status_code=429, content={"detail": "LLM provider is rate limiting, retry later"},
+                            headers={"Retry-After": str(int(retry_after + 0.999))})
+    return JSONResponse(status_code=500, content={"detail": "Internal Server Error"})
 
 class EHRRequest(BaseModel):
     patient_info: dict
+    use_cache: bool = True
+    encounter_date: Optional[date] = None
 
 class ConversationRequest(BaseModel):
     conversation_text: str
+    use_cache: bool = True
+    encounter_date: Optional[date] = None
+
+class VisitRequest(BaseModel):
+    patient_info: dict
+    conversation_text: str
+    specialty: str = "general"
+    use_cache: bool = True
+    encounter_date: Optional[date] = None
+
+class NoteRevisionRequest(BaseModel):
+    patient_info: dict
+    previous_patient_info: dict
+    previous_note: str
+    use_cache: bool = True
+    encounter_date: Optional[date] = None
+
+class JobRequest(BaseModel):
+    kind: str
+    payload: dict
+    priority: str = "interactive"
+    max_attempts: int = 3
+
+class LiveSessionRequest(BaseModel):
+    specialty: str = "general"
+
+class LiveTurnsRequest(BaseModel):
+    turns: list[str] = []
+    text: str = ""
+    analyze: bool = True
+
+async def _record(kind: str, request: BaseModel, input_text: str, outputs: dict, patient: dict, calls,
+                  started: float, failed=()):
+    # SQLite insert and FTS update run in a thread so they never block the event loop
+    return await asyncio.to_thread(record_encounter, kind, input_text, outputs, patient, calls,
+                                   time.perf_counter() - started, failed, request=request.model_dump(mode="json"),
+                                   encounter_date=request.encounter_date)
+
+def _failed_fields(agent, outputs: dict) -> set:
+    # Outputs that are the agent's error text are left out of the encounter
+    return {field for field, output in outputs.items() if agent is not None and agent.failed(output)}
+
+async def _recorded(kind: str, request: BaseModel, input_text: str, patient: dict = None, agent=None,
+                    **work) -> dict:
+    """{field: await result} for the single field in work, stored as an encounter unless it is agent's error text"""
+    (field, result), = work.items()
+    started = time.perf_counter()
+    with metrics.capture_calls() as calls:
+        outputs = {field: await result}
+    encounter_id = await _record(kind, request, input_text, outputs, patient, calls, started,
+                           _failed_fields(agent, outputs))
+    return {**outputs, "encounter_id": encounter_id}
 
 @app.post("/generate-summary")
-def generate_summary(request: EHRRequest):
-    return {"summary": prep_agent.run(str(request.patient_info))}
+async def generate_summary(request: EHRRequest):
+    text = compact_patient(request.patient_info)
+    agent = get_agent("preparation")
+    return await _recorded("summary", request, text, request.patient_info, agent,
+                           summary=agent.arun(text, request.use_cache))
 
 @app.post("/analyze-conversation")
-def analyze_conversation(request: ConversationRequest):
-    result = dialogue_agent.run(request.conversation_text)
-    return {"analysis": result}
+async def analyze_conversation(request: ConversationRequest):
+    agent = get_agent("dialogue")
+    return await _recorded("analysis", request, request.conversation_text, agent=agent,
+                           analysis=agent.arun(request.conversation_text, request.use_cache))
 
 @app.post("/generate-note")
-def generate_note(request: EHRRequest):
-    return {"soap_note": note_agent.run(request.patient_info)}
+async def generate_note(request: EHRRequest):
+    text = compact_patient(request.patient_info)
+    agent = get_agent("note_generator")
+    return await _recorded("note", request, text, request.patient_info, agent,
+                           soap_note=agent.arun(text, request.use_cache))
+
+@app.post("/generate-note/revise")
+async def revise_note(request: NoteRevisionRequest):
+    # Regenerates only the SOAP sections affected by the change to patient_info
+    text = compact_patient(request.patient_info)
+    started = time.perf_counter()
+    with metrics.capture_calls() as calls:
+        result = await get_agent("note_generator").arevise(request.previous_note,
+                                                           compact_patient(request.previous_patient_info), text,
+                                                           request.use_cache)
+    if result["mode"] != "unchanged":
+        result["encounter_id"] = await _record("revision", request, text, result, request.patient_info, calls,
+                                               started)
+    return result
 
 @app.post("/generate-codes")
-def generate_codes(request: EHRRequest):
-    return {"codes": coder_agent.run(request.patient_info)}
+async def generate_codes(request: EHRRequest):
+    text = compact_patient(request.patient_info)
+    agent = get_agent("coder")
+    return await _recorded("codes", request, text, request.patient_info, agent,
+                           codes=agent.arun(text, request.use_cache))
+
+async def _structured(result):
+    try:
+        return await result
+    except StructuredOutputError as e:
+        raise HTTPException(status_code=502, detail={"error": str(e), "output": e.output})
+
+@app.post("/generate-summary/structured", response_model=PreVisitSummary)
+async def generate_summary_structured(request: EHRRequest):
+    text = compact_patient(request.patient_info)
+    result = _structured(get_agent("preparation").arun_structured(text, request.use_cache))
+    return (await _recorded("summary", request, text, request.patient_info, summary=result))["summary"]
+
+@app.post("/analyze-conversation/structured", response_model=DialogueAnalysis)
+async def analyze_conversation_structured(request: ConversationRequest):
+    result = _structured(get_agent("dialogue").arun_structured(request.conversation_text, request.use_cache))
+    return (await _recorded("analysis", request, request.conversation_text, analysis=result))["analysis"]
+
+@app.post("/generate-note/structured", response_model=SoapNote)
+async def generate_note_structured(request: EHRRequest):
+    text = compact_patient(request.patient_info)
+    result = _structured(get_agent("note_generator").arun_structured(text, request.use_cache))
+    return (await _recorded("note", request, text, request.patient_info, soap_note=result))["soap_note"]
+
+@app.post("/generate-codes/structured", response_model=BillingCodes)
+async def generate_codes_structured(request: EHRRequest):
+    text = compact_patient(request.patient_info)
+    result = _structured(get_agent("coder").arun_structured(text, request.use_cache))
+    return (await _recorded("codes", request, text, request.patient_info, codes=result))["codes"]
+
+async def _sse_events(chunks):
+    # Server-Sent Events: one "data" frame per chunk, then a terminal "done" event
+    try:
+        async for chunk in chunks:
+            yield f"data: {json.dumps({'delta': chunk})}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        return
+    yield "event: done\ndata: {}\n\n"
+
+async def _recorded_stream(kind: str, request: BaseModel, input_text: str, field: str, agent, chunks,
+                           patient: dict = None):
+    """Pass chunks through, then store the complete text as an encounter unless it is agent's error text"""
+    started, parts = time.perf_counter(), []
+    with metrics.capture_calls() as calls:
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+    outputs = {field: "".join(parts)}
+    await _record(kind, request, input_text, outputs, patient, calls, started, _failed_fields(agent, outputs))
+
+def _sse_response(chunks):
+    return StreamingResponse(
+        _sse_events(chunks),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/generate-summary/stream")
+async def generate_summary_stream(request: EHRRequest):
+    text = compact_patient(request.patient_info)
+    agent = get_agent("preparation")
+    chunks = agent.astream(text, request.use_cache)
+    return _sse_response(_recorded_stream("summary", request, text, "summary", agent, chunks, request.patient_info))
+
+@app.post("/analyze-conversation/stream")
+async def analyze_conversation_stream(request: ConversationRequest):
+    agent = get_agent("dialogue")
+    chunks = agent.astream(request.conversation_text, request.use_cache)
+    return _sse_response(_recorded_stream("analysis", request, request.conversation_text, "analysis", agent, chunks))
+
+@app.post("/generate-note/stream")
+async def generate_note_stream(request: EHRRequest):
+    text = compact_patient(request.patient_info)
+    agent = get_agent("note_generator")
+    chunks = agent.astream(text, request.use_cache)
+    return _sse_response(_recorded_stream("note", request, text, "soap_note", agent, chunks, request.patient_info))
+
+@app.post("/generate-codes/stream")
+async def generate_codes_stream(request: EHRRequest):
+    text = compact_patient(request.patient_info)
+    agent = get_agent("coder")
+    chunks = agent.astream(text, request.use_cache)
+    return _sse_response(_recorded_stream("codes", request, text, "codes", agent, chunks, request.patient_info))
+
+@app.post("/process-visit")
+async def process_visit(request: VisitRequest):
+    pipeline = VisitPipeline(dialogue_agent=get_agent("dialogue", request.specialty))
+    text = compact_patient(request.patient_info)
+    started = time.perf_counter()
+    with metrics.capture_calls() as calls:
+        result = await pipeline.arun(text, request.conversation_text, request.use_cache)
+    result["encounter_id"] = await _record("visit", request, f"{text}\n\n{request.conversation_text}", result,
+                                           request.patient_info, calls, started,
+                                           _failed_fields(pipeline.coder_agent, result))
+    return result
+
+def _live_session(session_id: str):
+    try:
+        return live_sessions.get(session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Live session not found")
+
+@app.post("/live/sessions")
+def create_live_session(request: LiveSessionRequest):
+    return live_sessions.create(request.specialty).status()
+
+@app.post("/live/sessions/{session_id}/turns")
+async def append_live_turns(session_id: str, request: LiveTurnsRequest):
+    session = _live_session(session_id)
+    session.append(request.turns)
+    if request.text:
+        session.append(request.text)
+    if request.analyze:
+        await session.aupdate()
+    return session.status()
+
+@app.get("/live/sessions/{session_id}")
+def get_live_session(session_id: str):
+    return _live_session(session_id).status()
+
+@app.delete("/live/sessions/{session_id}")
+def delete_live_session(session_id: str):
+    if not live_sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Live session not found")
+    return {"deleted": session_id}
+
+@app.post("/compact-patient")
+def compact_patient_preview(request: EHRRequest):
+    text, stats = compact_patient_with_stats(request.patient_info)
+    return {"compact_text": text, **stats}
+
+@app.post("/batch")
+async def batch(request: Request, concurrency: int = Query(4, ge=1, le=BATCH_MAX_CONCURRENCY),
+                use_cache: bool = True):
+    """NDJSON encounter records in, NDJSON results out as each record completes"""
+    lines = (await request.body()).decode("utf-8").splitlines()
+    runner = BatchRunner(concurrency, use_cache)
+
+    async def results():
+        async for result in runner.run(iter_ndjson_lines(lines)):
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"stats": runner.stats()}) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+def _job(job_id: str) -> dict:
+    job = get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job
+
+def _job_status(job: dict) -> dict:
+    fields = ("id", "kind", "status", "attempts", "max_attempts", "error", "created_at", "started_at", "finished_at")
+    return {field: job[field] for field in fields}
+
+@app.post("/jobs", status_code=202)
+def submit_job(request: JobRequest):
+    if request.kind not in JOB_KINDS:
+        raise HTTPException(status_code=422, detail=f"kind must be one of {', '.join(JOB_KINDS)}")
+    error = payload_error(request.kind, request.payload)
+    if error is not None:
+        raise HTTPException(status_code=422, detail=error)
+    priority = BATCH if request.priority == "batch" else INTERACTIVE
+    job_id = get_job_store().submit(request.kind, request.payload, request.max_attempts, priority,
+                                    current_client_id())
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return _job_status(_job(job_id))
+
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str):
+    job = _job(job_id)
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail=_job_status(job))
+    return job["result"]
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = get_job_store().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return _job_status(job)
+
+def _encounter_store():
+    store = get_encounter_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="Encounter store is disabled")
+    return store
+
+@app.get("/encounters")
+def list_encounters(patient_id: str = None, patient_name: str = None, date_from: str = None, date_to: str = None,
+                    code: str = None, kind: str = None, limit: int = 50):
+    """Stored encounters by patient, date (YYYY-MM-DD, inclusive) and billing code; no LLM calls"""
+    if kind is not None and kind not in ENCOUNTER_KINDS:
+        raise HTTPException(status_code=422, detail=f"kind must be one of {', '.join(ENCOUNTER_KINDS)}")
+    return {"encounters": _encounter_store().find(patient_id, patient_name, date_from, date_to, code, kind, limit)}
+
+@app.get("/encounters/search")
+def search_encounters(q: str, patient_id: str = None, limit: int = 20):
+    """Full-text search over stored summaries, analyses, notes and codes"""
+    return {"encounters": _encounter_store().search(q, patient_id, limit)}
+
+@app.get("/encounters/{encounter_id}")
+def get_encounter(encounter_id: str):
+    encounter = _encounter_store().get(encounter_id)
+    if encounter is None:
+        raise HTTPException(status_code=404, detail="Encounter not found")
+    return encounter
+
+@app.delete("/encounters/{encounter_id}")
+def delete_encounter(encounter_id: str):
+    if not _encounter_store().delete(encounter_id):
+        raise HTTPException(status_code=404, detail="Encounter not found")
+    return {"deleted": encounter_id}
+
+@app.get("/cache/stats")
+def cache_stats():
+    cache = get_response_cache()
+    stats = cache.stats() if cache is not None else {"backend": None}
+    near_duplicates = get_near_duplicate_index()
+    if near_duplicates is not None:
+        stats["near_duplicate"] = near_duplicates.stats()
+    return stats
+
+@app.post("/cache/clear")
+def cache_clear():
+    cache = get_response_cache()
+    if cache is not None:
+        cache.clear()
+    near_duplicates = get_near_duplicate_index()
+    if near_duplicates is not None:
+        near_duplicates.clear()
+    return {"cleared": cache is not None}
+
+@app.get("/scheduler/stats")
+def scheduler_stats():
+    return get_scheduler().stats()
+
+@app.get("/providers/stats")
+def providers_stats():
+    """Circuit state and hedge deadlines of each LLM provider, per model"""
+    return {"providers": get_provider_names(), "models": provider_stats()}
+
+@app.get("/startup")
+def startup_times():
+    """Import and startup time of this process, plus when each agent was first built"""
+    return {**startup_report, "agents": construction_times}
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# In-process job workers, built at startup so importing this module opens no database;
+# set JOB_WORKERS=0 and run `python jobs.py worker` to scale them separately
+job_workers = None
+
+@app.on_event("startup")
+async def startup():
+    global job_workers
+    start = time.perf_counter()
+    concurrency = int(os.getenv("JOB_WORKERS", "2"))
+    if concurrency > 0:
+        job_workers = JobWorkerPool(await asyncio.to_thread(get_job_store), concurrency)
+        job_workers.start()
+    startup_report["startup_seconds"] = time.perf_counter() - start
+    logger.info("Startup: imports %.3fs, startup hooks %.3fs",
+                startup_report["import_seconds"], startup_report["startup_seconds"])
+
+@app.on_event("shutdown")
+async def shutdown():
+    if job_workers is not None:
+        await job_workers.stop()
+    await aclose_llms()
 
 @app.get("/")
 def root():
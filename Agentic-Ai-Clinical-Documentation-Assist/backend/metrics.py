@@ -0,0 +1,176 @@
+# backend/metrics.py
+"""Per-call agent instrumentation exported in the Prometheus text format.
+
+Every agent LLM call is recorded with its stage timings (prompt, cache, queue,
+upstream, handling, total), prompt/completion tokens, cache status and error
+class. GET /metrics on the API serves render(). With AGENT_TRACING=1 and
+opentelemetry installed, each call is also emitted as a trace span.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from opentelemetry import trace as _otel_trace
+except ImportError:  # tracing is optional
+    _otel_trace = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TRACING_ENABLED = os.getenv("AGENT_TRACING", "0") == "1" and _otel_trace is not None
+
+_captured_calls = contextvars.ContextVar("captured_calls", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, count, total) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_label_text(labels + (('le', bound),))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_label_text(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_count{_label_text(labels)} {count}")
+                lines.append(f"{self.name}_sum{_label_text(labels)} {total}")
+        return lines
+
+
+agent_calls = Counter("agent_calls_total", "Agent LLM calls by cache status and outcome")
+agent_stage_seconds = Histogram("agent_stage_seconds", "Time spent per stage of an agent call")
+agent_tokens = Counter("agent_tokens_total", "Prompt and completion tokens per agent and model")
+agent_cascade = Counter("agent_cascade_total", "Model tier that answered each agent call (small, escalated, large)")
+provider_calls = Counter("llm_provider_calls_total", "Calls to each LLM provider by outcome (ok, error, abandoned)")
+provider_hedges = Counter("llm_provider_hedges_total", "Calls sent to a provider as a hedge or failover")
+provider_circuit_opens = Counter("llm_provider_circuit_open_total", "Times a provider's circuit breaker opened")
+REGISTRY = [agent_calls, agent_stage_seconds, agent_tokens, agent_cascade, provider_calls, provider_hedges,
+            provider_circuit_opens]
+
+
+def _sample(name: str, documentation: str, value, kind: str = "gauge") -> list:
+    return [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+
+def render() -> str:
+    from scheduler import get_scheduler
+
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    stats = get_scheduler().stats()
+    lines += _sample("scheduler_in_flight", "LLM calls currently upstream", stats["in_flight"])
+    lines += _sample("scheduler_queued_interactive", "Interactive calls waiting for a slot", stats["queued_interactive"])
+    lines += _sample("scheduler_queued_batch", "Batch calls waiting for a slot", stats["queued_batch"])
+    lines += _sample("scheduler_retries_total", "Calls retried after a rate-limit response", stats["retries"],
+                     "counter")
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def capture_calls():
+    """List of the AgentCalls finished inside the block, including in tasks and threads it starts"""
+    calls = []
+    token = _captured_calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _captured_calls.reset(token)
+
+
+class AgentCall:
+    """Measurements for one agent LLM call; finish() records them"""
+
+    def __init__(self, agent: str, model: str):
+        self.agent = agent or "unknown"
+        self.model = model
+        self.cache = "off"
+        self.timings = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.started = time.perf_counter()
+        self._span = None
+        if TRACING_ENABLED:
+            self._span = _otel_trace.get_tracer("clinical-agents").start_span(f"agent.{self.agent}")
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self, error: BaseException = None):
+        self.timings["total"] = time.perf_counter() - self.started
+        outcome = "ok" if error is None else "error"
+        error_class = type(error).__name__ if error is not None else ""
+        agent_calls.inc(agent=self.agent, model=self.model, cache=self.cache, outcome=outcome, error=error_class)
+        captured = _captured_calls.get()
+        if captured is not None and error is None:
+            captured.append(self)
+        for stage, seconds in self.timings.items():
+            agent_stage_seconds.observe(seconds, agent=self.agent, stage=stage)
+        if self.prompt_tokens:
+            agent_tokens.inc(self.prompt_tokens, agent=self.agent, model=self.model, kind="prompt")
+        if self.completion_tokens:
+            agent_tokens.inc(self.completion_tokens, agent=self.agent, model=self.model, kind="completion")
+
+        if self._span is not None:
+            self._span.set_attributes({
+                "agent.name": self.agent, "llm.model": self.model, "cache.status": self.cache,
+                "llm.prompt_tokens": self.prompt_tokens, "llm.completion_tokens": self.completion_tokens,
+                **{f"stage.{stage}_ms": round(seconds * 1000, 3) for stage, seconds in self.timings.items()},
+            })
+            if error is not None:
+                self._span.record_exception(error)
+                self._span.set_status(_otel_trace.Status(_otel_trace.StatusCode.ERROR, error_class))
+            self._span.end()
@@ -0,0 +1,194 @@
+# backend/near_duplicate.py
+"""Near-duplicate response reuse for inputs re-submitted with trivial edits.
+
+An input is normalized (case, punctuation, whitespace), cut into word shingles that
+stay within one line or list item (so re-ordered lists match) and summarized as a
+MinHash signature. A local LSH index over signature bands finds earlier inputs for
+the same agent, prompt and other inputs (e.g. specialty) that are likely similar.
+A candidate is used only when its estimated Jaccard similarity reaches the agent's
+threshold and its numbers, negations and capitalised words are identical, so a changed
+vital sign, "no chest pain" -> "chest pain" or another patient's name is never a near
+match.
+
+Thresholds are set per agent with NEAR_DUPLICATE_THRESHOLDS, e.g.
+"preparation=0.95,dialogue=0.95"; agents without one only use exact matches.
+"""
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+NUM_PERM = 128
+BANDS = 32  # 4 rows per band: pairs above ~0.5 similarity almost always share a band
+SHINGLE_WORDS = 3
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240611)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_ROWS = NUM_PERM // BANDS
+
+_WORD = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+_CAPITALISED = re.compile(r"\b[A-Z][A-Za-z'-]*")
+_SEGMENT_BREAK = re.compile(r"[\n;,]+")
+NEGATIONS = frozenset({"no", "not", "denies", "denied", "without", "negative", "never", "none"})
+
+
+def parse_thresholds(spec: str) -> dict:
+    """"agent=0.95,other=0.9" -> {"agent": 0.95, "other": 0.9}"""
+    thresholds = {}
+    for part in filter(None, (item.strip() for item in spec.split(","))):
+        agent, _, value = part.partition("=")
+        thresholds[agent.strip()] = float(value)
+    return thresholds
+
+
+def _shingles(segments: list) -> set:
+    shingles = set()
+    for words in segments:
+        if len(words) <= SHINGLE_WORDS:
+            shingles.add(" ".join(words))
+        else:
+            shingles.update(" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1))
+    return shingles
+
+
+def _minhash(shingles: set) -> tuple:
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingles]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def fingerprint(text: str):
+    """(signature, guard) for text, or None when it has no words.
+
+    The guard must match exactly: numbers, negations and capitalised words, which
+    include patient names and identifiers, so one patient never gets another's response.
+    """
+    segments = [words for words in map(_WORD.findall, _SEGMENT_BREAK.split(text.lower())) if words]
+    if not segments:
+        return None
+    guard = tuple(sorted(word for words in segments for word in words if word[0].isdigit() or word in NEGATIONS))
+    return _minhash(_shingles(segments)), (guard, tuple(sorted(set(_CAPITALISED.findall(text)))))
+
+
+def similarity(signature_a: tuple, signature_b: tuple) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures"""
+    return sum(a == b for a, b in zip(signature_a, signature_b)) / NUM_PERM
+
+
+def _bands(signature: tuple):
+    return [(band, hash(signature[band * _ROWS:(band + 1) * _ROWS])) for band in range(BANDS)]
+
+
+class NearDuplicateIndex:
+    """Bounded in-process LSH index of (scope, input text) -> response"""
+
+    def __init__(self, thresholds: dict, max_entries: int = 1024, ttl: float = 3600):
+        self.thresholds = thresholds
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._similarity_total = 0.0
+        self._entries = OrderedDict()  # id -> (scope, signature, guard, value, expires_at)
+        self._buckets = defaultdict(set)  # (scope, band, band hash) -> ids
+        self._lock = threading.Lock()
+
+    def threshold(self, agent: str) -> float:
+        return self.thresholds.get(agent, 0.0)
+
+    def find(self, scope: str, text: str, threshold: float):
+        """(value, similarity) of the most similar entry at or above threshold, or None"""
+        fp = fingerprint(text)
+        if fp is None:
+            return None
+        signature, guard = fp
+        now = time.time()
+        best, best_similarity = None, threshold
+        with self._lock:
+            candidates = set()
+            for band, band_hash in _bands(signature):
+                candidates |= self._buckets.get((scope, band, band_hash), set())
+            for entry_id in candidates:
+                _, other, other_guard, value, expires_at = self._entries[entry_id]
+                if expires_at is not None and expires_at < now:
+                    self._remove(entry_id)
+                    continue
+                score = similarity(signature, other)
+                if other_guard == guard and score >= best_similarity:
+                    best, best_similarity = entry_id, score
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            self._similarity_total += best_similarity
+            return self._entries[best][3], best_similarity
+
+    def add(self, scope: str, text: str, value: str):
+        fp = fingerprint(text)
+        if fp is None:
+            return
+        signature, guard = fp
+        entry_id = hashlib.sha256(f"{scope}\n{text}".encode("utf-8")).hexdigest()
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            if entry_id in self._entries:
+                self._remove(entry_id)
+            self._entries[entry_id] = (scope, signature, guard, value, expires_at)
+            for band, band_hash in _bands(signature):
+                self._buckets[(scope, band, band_hash)].add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: str):
+        scope, signature, *_ = self._entries.pop(entry_id)
+        for band, band_hash in _bands(signature):
+            bucket = self._buckets.get((scope, band, band_hash))
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[(scope, band, band_hash)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self.hits = 0
+            self.misses = 0
+            self._similarity_total = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "thresholds": self.thresholds,
+            "near_hits": self.hits,
+            "near_misses": self.misses,
+            "mean_hit_similarity": round(self._similarity_total / self.hits, 4) if self.hits else None,
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_near_duplicate_index():
+    """Process-wide index; None when no agent has a threshold configured"""
+    global _index
+    if _index is not None:
+        return _index
+
+    thresholds = parse_thresholds(os.getenv("NEAR_DUPLICATE_THRESHOLDS", ""))
+    if not any(thresholds.values()):
+        return None
+
+    with _index_lock:
+        if _index is None:
+            _index = NearDuplicateIndex(
+                thresholds,
+                max_entries=int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "1024")),
+                ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+            )
+    return _index
@@ -0,0 +1,104 @@
+# backend/note_revision.py
+"""Section-level revision of a SOAP note after its input data changes.
+
+The structured data behind a note is split into labelled blocks ("Observations:",
+"**Symptoms:**", "Labs: ...") and compared with the data behind the previous note.
+Each changed block maps to the note sections it feeds, so a new lab result reaches
+Objective and Assessment but not Subjective or Plan. NoteGeneratorAgent.revise
+regenerates only those sections and splices them into the previous note, leaving the
+text of every other section exactly as it was.
+"""
+import re
+
+from text_utils import section_blocks
+
+NOTE_SECTIONS = ("Patient Information", "Subjective", "Objective", "Assessment", "Plan")
+
+# Word prefixes in an input block's label -> note sections the block feeds; the first match wins
+SECTION_TRIGGERS = (
+    (("symptom", "complaint", "history", "concern", "subjective", "reported"), ("Subjective", "Assessment")),
+    (("observation", "vital", "lab", "exam", "finding", "metric", "result", "objective", "imaging"),
+     ("Objective", "Assessment")),
+    (("medication", "dos", "prescription", "adherence", "allerg"), ("Subjective", "Plan")),
+    (("condition", "diagnos", "problem", "assessment", "impression"), ("Assessment", "Plan")),
+    (("plan", "alert", "missing", "follow", "referral", "screening", "treatment"), ("Plan",)),
+    (("patient", "demographic", "name", "age", "gender", "visit"), ("Patient Information",)),
+)
+
+_MARKDOWN_HEADING = re.compile(r"^\s*(?:#+\s*)?\*\*(?P<label>[^*]+?):?\*\*:?\s*(?P<rest>.*)$")
+_BULLET = re.compile(r"^\s*(?:[•\-*]|\d+[.)])\s+(?P<item>.+)$")
+_WORD = re.compile(r"[a-z0-9]+")
+_LABEL = re.compile(r"^\s*(?P<label>[A-Za-z][A-Za-z0-9 /&()'-]{0,40}):\s*(?P<rest>.*)$")
+
+
+def input_blocks(text: str) -> dict:
+    """Label -> set of normalized items; unlabelled leading text is under ""."""
+    blocks, label = {}, ""
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        match = _MARKDOWN_HEADING.match(line)
+        if match is None and not _BULLET.match(line):
+            match = _LABEL.match(line)
+        if match is not None:
+            label, item = match.group("label").strip(), match.group("rest")
+        else:
+            bullet = _BULLET.match(line)
+            item = bullet.group("item") if bullet else line
+        items = blocks.setdefault(label, set())
+        item = " ".join(item.lower().split())
+        if item:
+            items.add(item)
+    return blocks
+
+
+def sections_for(label: str) -> tuple:
+    """Note sections fed by an input block; all of them when the label is not recognized"""
+    words = _WORD.findall(label.lower())
+    for keywords, sections in SECTION_TRIGGERS:
+        if any(word.startswith(keyword) for word in words for keyword in keywords):
+            return sections
+    return NOTE_SECTIONS
+
+
+def affected_sections(previous_data: str, structured_data: str) -> list:
+    """Note sections whose input changed between two versions of the structured data"""
+    before, after = input_blocks(previous_data), input_blocks(structured_data)
+    affected = set()
+    for label in before.keys() | after.keys():
+        if before.get(label) != after.get(label):
+            affected.update(sections_for(label))
+    return [section for section in NOTE_SECTIONS if section in affected]
+
+
+def note_sections(note: str) -> dict:
+    """Lower-cased title -> text block of each section of a note"""
+    return {title.lower(): text for title, text in section_blocks(note) if title is not None}
+
+
+def section_format(template_text: str, sections: list) -> str:
+    """The blocks of a note template's response format for the given sections"""
+    blocks = note_sections("\n".join(line.strip() for line in template_text.splitlines()))
+    formats = []
+    for section in sections:
+        lines = blocks[section.lower()].splitlines()
+        formats.append("\n".join([lines[0]] + [line for line in lines[1:] if _BULLET.match(line)]))
+    return "\n\n".join(formats)
+
+
+def splice_sections(note: str, regenerated: str, sections: list):
+    """note with the given sections replaced by their text in regenerated.
+
+    None when regenerated lacks one of the sections or the note does not have it.
+    """
+    replacements = note_sections(regenerated)
+    wanted = {section.lower() for section in sections}
+    if not wanted <= replacements.keys() or not wanted <= note_sections(note).keys():
+        return None
+    texts = []
+    for title, text in section_blocks(note):
+        if title is not None and title.lower() in wanted:
+            # Keep the note's own spacing between sections
+            text = replacements[title.lower()].strip() + text[len(text.rstrip()):]
+        texts.append(text)
+    return "\n".join(texts)
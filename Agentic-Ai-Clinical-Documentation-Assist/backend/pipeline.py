@@ -0,0 +1,92 @@
+# backend/pipeline.py
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from agents import get_agent
+
+
+class VisitPipeline:
+    """Full visit workflow run as a two-stage dependency graph.
+
+    Stage 1: pre-visit summary and dialogue analysis (independent, run in parallel).
+    Stage 2: SOAP note and billing codes, both built from the dialogue analysis.
+    """
+
+    def __init__(self, prep_agent=None, dialogue_agent=None, note_agent=None, coder_agent=None):
+        self.prep_agent = prep_agent or get_agent("preparation")
+        self.dialogue_agent = dialogue_agent or get_agent("dialogue")
+        self.note_agent = note_agent or get_agent("note_generator")
+        self.coder_agent = coder_agent or get_agent("coder")
+
+    async def arun(self, patient_info: str, conversation_text: str, use_cache: bool = True) -> dict:
+        timings = {}
+        start = time.perf_counter()
+
+        summary, analysis = await asyncio.gather(
+            _atimed(timings, "summary", self.prep_agent.arun(patient_info, use_cache)),
+            _atimed(timings, "analysis", self.dialogue_agent.arun(conversation_text, use_cache)),
+        )
+        timings["stage_1"] = time.perf_counter() - start
+
+        stage_2_start = time.perf_counter()
+        soap_note, codes = await asyncio.gather(
+            _atimed(timings, "soap_note", self.note_agent.arun(analysis, use_cache)),
+            _atimed(timings, "codes", self.coder_agent.arun(analysis, use_cache)),
+        )
+        timings["stage_2"] = time.perf_counter() - stage_2_start
+        timings["total"] = time.perf_counter() - start
+
+        return _visit_result(summary, analysis, soap_note, codes, timings)
+
+    def run(self, patient_info: str, conversation_text: str, use_cache: bool = True) -> dict:
+        timings = {}
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            summary = _submit(pool, timings, "summary", self.prep_agent.run, patient_info, use_cache)
+            analysis = _submit(pool, timings, "analysis", self.dialogue_agent.run, conversation_text, use_cache)
+            summary, analysis = summary.result(), analysis.result()
+            timings["stage_1"] = time.perf_counter() - start
+
+            stage_2_start = time.perf_counter()
+            soap_note = _submit(pool, timings, "soap_note", self.note_agent.run, analysis, use_cache)
+            codes = _submit(pool, timings, "codes", self.coder_agent.run, analysis, use_cache)
+            soap_note, codes = soap_note.result(), codes.result()
+            timings["stage_2"] = time.perf_counter() - stage_2_start
+
+        timings["total"] = time.perf_counter() - start
+        return _visit_result(summary, analysis, soap_note, codes, timings)
+
+
+def _submit(pool, *args):
+    # Worker threads start with an empty context; run in a copy of the caller's so the
+    # scheduler priority, client id and metrics call capture carry over
+    return pool.submit(contextvars.copy_context().run, _timed, *args)
+
+
+def _timed(timings: dict, name: str, func, *args):
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        timings[name] = time.perf_counter() - start
+
+
+async def _atimed(timings: dict, name: str, awaitable):
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[name] = time.perf_counter() - start
+
+
+def _visit_result(summary, analysis, soap_note, codes, timings) -> dict:
+    return {
+        "summary": summary,
+        "analysis": analysis,
+        "soap_note": soap_note,
+        "codes": codes,
+        "timings": {name: round(seconds, 4) for name, seconds in timings.items()},
+    }
@@ -0,0 +1,353 @@
+# backend/providers.py
+"""Multi-provider chat model with health tracking, hedged requests and circuit breaking.
+
+With several backends in LLM_PROVIDERS (e.g. "groq,gemini"), get_llm returns a
+ProviderPool wrapping one client per provider, in preference order. A call goes to
+the first available provider. If it has not answered within that provider's hedge
+deadline (the p95 of its recent latencies, clamped to PROVIDER_HEDGE_MIN..MAX), the
+call is also sent to the next provider and the first answer wins; an error fails
+over to the next provider at once. Streams are hedged up to their first chunk; the
+losing streams are closed. Losing async calls are cancelled, which closes their
+connections; a blocking sync call cannot be interrupted, so a loser already in flight
+finishes on its daemon thread and its answer is discarded.
+
+After PROVIDER_CIRCUIT_FAILURES consecutive failures a provider's circuit opens and
+it is skipped for PROVIDER_CIRCUIT_COOLDOWN seconds; then a single probe call is let
+through and closes the circuit again if it succeeds.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from metrics import provider_calls, provider_circuit_opens, provider_hedges
+
+HEDGE_PERCENTILE = float(os.getenv("PROVIDER_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN = float(os.getenv("PROVIDER_HEDGE_MIN", "0.5"))
+# Also the deadline until enough latencies are known; 0 disables hedging (failover only)
+HEDGE_MAX = float(os.getenv("PROVIDER_HEDGE_MAX", "10"))
+CIRCUIT_FAILURES = int(os.getenv("PROVIDER_CIRCUIT_FAILURES", "5"))
+CIRCUIT_COOLDOWN = float(os.getenv("PROVIDER_CIRCUIT_COOLDOWN", "30"))
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+
+
+class ProviderHealth:
+    """Recent latencies and circuit state of one provider"""
+
+    def __init__(self, name: str, failures: int = CIRCUIT_FAILURES, cooldown: float = CIRCUIT_COOLDOWN,
+                 hedge_min: float = HEDGE_MIN, hedge_max: float = HEDGE_MAX, percentile: float = HEDGE_PERCENTILE):
+        self.name = name
+        self.failure_threshold = failures
+        self.cooldown = cooldown
+        self.hedge_min = hedge_min
+        self.hedge_max = hedge_max
+        self.percentile = percentile
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probing = False
+        # invoke latency and stream time to first chunk are tracked separately
+        self._latencies = {"invoke": deque(maxlen=LATENCY_WINDOW), "stream": deque(maxlen=LATENCY_WINDOW)}
+        self._lock = threading.Lock()
+
+    def claim(self) -> bool:
+        """Whether a call may go to this provider now; after the cooldown only one probe may.
+
+        Checking and claiming the probe happen under one lock, so concurrent callers
+        cannot both probe a half-open provider.
+        """
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def succeeded(self, kind: str, seconds: float):
+        with self._lock:
+            self._latencies[kind].append(seconds)
+            self.consecutive_failures = 0
+            self.state, self.opened_at, self._probing = "closed", None, False
+
+    def failed(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probing = False
+            if self.state == "half_open" or (self.state == "closed"
+                                             and self.consecutive_failures >= self.failure_threshold):
+                self.state, self.opened_at = "open", time.monotonic()
+                provider_circuit_opens.inc(provider=self.name)
+
+    def abandoned(self):
+        """A call was cancelled before it finished; it says nothing about health"""
+        with self._lock:
+            self._probing = False
+
+    def deadline(self, kind: str):
+        """Seconds to wait before hedging to the next provider; None when hedging is off"""
+        if self.hedge_max <= 0:
+            return None
+        with self._lock:
+            latencies = sorted(self._latencies[kind])
+        if len(latencies) < MIN_SAMPLES:
+            return self.hedge_max
+        p = latencies[min(len(latencies) - 1, int(self.percentile * len(latencies)))]
+        return min(self.hedge_max, max(self.hedge_min, p))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "samples": {kind: len(latencies) for kind, latencies in self._latencies.items()},
+            }
+
+
+def _in_thread(func) -> Future:
+    future = Future()
+
+    def run():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(func())
+            except BaseException as e:
+                future.set_exception(e)
+
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), daemon=True).start()
+    return future
+
+
+class ProviderPool(BaseChatModel):
+    """Chat model over several providers' clients; model_name is the primary's"""
+
+    model_name: str = "provider-pool"
+
+    _clients: list = PrivateAttr(default_factory=list)
+    _health: dict = PrivateAttr(default_factory=dict)
+
+    @classmethod
+    def create(cls, clients: list, **health_options) -> "ProviderPool":
+        """clients: (provider name, chat model) pairs in preference order"""
+        primary = clients[0][1]
+        pool = cls(model_name=getattr(primary, "model_name", None) or getattr(primary, "model", None) or clients[0][0])
+        pool._clients = list(clients)
+        pool._health = {name: ProviderHealth(name, **health_options) for name, _ in clients}
+        return pool
+
+    @property
+    def _llm_type(self) -> str:
+        return "provider-pool"
+
+    @property
+    def clients(self) -> list:
+        return [client for _, client in self._clients]
+
+    def health(self, name: str) -> ProviderHealth:
+        return self._health[name]
+
+    def stats(self) -> dict:
+        stats = {}
+        for name, client in self._clients:
+            health = self._health[name]
+            stats[name] = {**health.stats(), "model": getattr(client, "model_name", None) or getattr(client, "model", None),
+                           "invoke_deadline": health.deadline("invoke"), "stream_deadline": health.deadline("stream")}
+        return stats
+
+    def _candidates(self):
+        """Providers that may take a call, in preference order.
+
+        Half-open probes are claimed only when the race reaches that provider. With
+        every circuit open the call still goes to all of them in order rather than
+        failing without trying.
+        """
+        claimed = False
+        for name, client in self._clients:
+            if self._health[name].claim():
+                claimed = True
+                yield name, client
+        if not claimed:
+            yield from self._clients
+
+    # -- racing ------------------------------------------------------------------------
+
+    def _record(self, name: str, kind: str, started: float):
+        health = self._health[name]
+
+        def done(future):
+            if future.cancelled():
+                health.abandoned()
+                provider_calls.inc(provider=name, outcome="abandoned")
+            elif future.exception() is not None:
+                health.failed()
+                provider_calls.inc(provider=name, outcome="error")
+            else:
+                health.succeeded(kind, time.monotonic() - started)
+                provider_calls.inc(provider=name, outcome="ok")
+        return done
+
+    def _hedge_timeout(self, kind: str, name: str, started: float):
+        """Seconds until the next provider should be tried; None when hedging is off"""
+        deadline = self._health[name].deadline(kind)
+        return None if deadline is None else max(0.0, deadline - (time.monotonic() - started))
+
+    def _race(self, func, kind: str, discard=None):
+        """func(client) on the first provider, hedged or failed over to the next ones.
+
+        discard(result) releases the result of a call that lost, e.g. closes its stream.
+        """
+        candidates, launched, pending, error = self._candidates(), [], set(), None
+        last = None  # (name, started) of the latest launch; None once no provider is left
+
+        def launch():
+            nonlocal last
+            entry = next(candidates, None)
+            if entry is None:
+                last = None
+                return
+            name, client = entry
+            if launched:
+                provider_hedges.inc(provider=name)
+            started = time.monotonic()
+            future = _in_thread(lambda: func(client))
+            future.add_done_callback(self._record(name, kind, started))
+            launched.append(future)
+            pending.add(future)
+            last = name, started
+
+        launch()
+        winner = None
+        try:
+            while pending:
+                timeout = self._hedge_timeout(kind, *last) if last else None
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        winner = future
+                        return future.result()
+                    error = future.exception()
+                if last:
+                    launch()
+            raise error
+        finally:
+            for future in launched:
+                if future is not winner:
+                    future.cancel()
+                    if discard is not None:
+                        future.add_done_callback(lambda f: f.cancelled() or f.exception() or discard(f.result()))
+
+    async def _arace(self, afunc, kind: str, discard=None):
+        candidates, launched, pending, error = self._candidates(), [], set(), None
+        last = None
+
+        def launch():
+            nonlocal last
+            entry = next(candidates, None)
+            if entry is None:
+                last = None
+                return
+            name, client = entry
+            if launched:
+                provider_hedges.inc(provider=name)
+            started = time.monotonic()
+            task = asyncio.ensure_future(afunc(client))
+            task.add_done_callback(self._record(name, kind, started))
+            launched.append(task)
+            pending.add(task)
+            last = name, started
+
+        launch()
+        winner = None
+        try:
+            while pending:
+                timeout = self._hedge_timeout(kind, *last) if last else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        return task.result()
+                    error = task.exception()
+                if last:
+                    launch()
+            raise error
+        finally:
+            for task in launched:
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif discard is not None and not task.cancelled() and task.exception() is None:
+                    await discard(task.result())
+
+    # -- LangChain interface -----------------------------------------------------------
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        message = self._race(lambda client: client.invoke(messages, stop=stop, **kwargs), "invoke")
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        message = await self._arace(lambda client: client.ainvoke(messages, stop=stop, **kwargs), "invoke")
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any):
+        def first_chunk(client):
+            chunks = iter(client.stream(messages, stop=stop, **kwargs))
+            return next(chunks, None), chunks
+
+        chunk, chunks = self._race(first_chunk, "stream", discard=lambda result: result[1].close())
+        try:
+            if chunk is not None:
+                yield _generation_chunk(chunk)
+            for chunk in chunks:
+                yield _generation_chunk(chunk)
+        finally:
+            chunks.close()
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any):
+        async def first_chunk(client):
+            chunks = client.astream(messages, stop=stop, **kwargs).__aiter__()
+            try:
+                return await chunks.__anext__(), chunks
+            except StopAsyncIteration:
+                return None, None
+            except asyncio.CancelledError:
+                await chunks.aclose()  # lost the race: close the provider's stream
+                raise
+
+        async def discard(result):
+            if result[1] is not None:
+                await result[1].aclose()
+
+        chunk, chunks = await self._arace(first_chunk, "stream", discard)
+        if chunk is None:
+            return
+        try:
+            yield _generation_chunk(chunk)
+            async for chunk in chunks:
+                yield _generation_chunk(chunk)
+        finally:
+            await chunks.aclose()
+
+
+def _generation_chunk(message) -> ChatGenerationChunk:
+    if not isinstance(message, AIMessageChunk):
+        message = AIMessageChunk(content=message.content)
+    return ChatGenerationChunk(message=message)
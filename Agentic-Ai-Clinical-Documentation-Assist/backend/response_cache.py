@@ -0,0 +1,186 @@
+# backend/response_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_input(value) -> str:
+    """Canonical form of an agent input: collapsed whitespace, sorted dict keys"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return " ".join(str(value).split())
+
+
+def make_cache_key(agent: str, template: str, model_name: str, inputs: dict) -> str:
+    """Content address for one agent call; inputs include the specialty where relevant"""
+    payload = json.dumps(
+        {
+            "agent": agent,
+            "template": template,
+            "model": model_name,
+            "inputs": {name: normalize_input(value) for name, value in sorted(inputs.items())},
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU store"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """On-disk store shared across processes; evicts least recently used rows"""
+
+    def __init__(self, path: str = "response_cache.sqlite3", max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires_at REAL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS response_cache_last_access ON response_cache (last_access)"
+        )
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at < now:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key)
+            )
+            return value
+
+    def set(self, key: str, value: str, expires_at):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at, last_access)"
+                " VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, time.time()),
+            )
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                " SELECT key FROM response_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class ResponseCache:
+    """Agent output cache with TTL and hit/miss accounting"""
+
+    def __init__(self, backend, ttl: float = 3600):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: str):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        self.backend.set(key, value, expires_at)
+
+    def clear(self):
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Process-wide cache configured from the environment; None when disabled"""
+    global _cache
+    if _cache is not None:
+        return _cache
+
+    backend_name = os.getenv("RESPONSE_CACHE_BACKEND", "memory").lower()
+    if backend_name in ("off", "none", ""):
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            max_entries = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+            if backend_name == "sqlite":
+                backend = SQLiteCacheBackend(
+                    os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3"), max_entries
+                )
+            elif backend_name == "memory":
+                backend = MemoryCacheBackend(max_entries)
+            else:
+                raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {backend_name}")
+            _cache = ResponseCache(backend, ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")))
+    return _cache
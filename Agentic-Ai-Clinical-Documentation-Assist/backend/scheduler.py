@@ -0,0 +1,376 @@
+# backend/scheduler.py
+"""Central scheduler for upstream LLM calls.
+
+Every agent call acquires a slot here before going upstream. Slots are granted when:
+  * fewer than max_concurrency calls are in flight,
+  * the requests-per-minute and tokens-per-minute token buckets allow it, and
+  * no provider-requested pause (429 / retry-after) is in effect.
+
+Waiting calls are served by priority lane (interactive before batch) and, within a
+lane, round-robin across client ids so one heavy client cannot starve the others.
+The scheduler works for both threads and asyncio tasks.
+"""
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+INTERACTIVE = 0
+BATCH = 1
+
+_priority = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+_client_id = contextvars.ContextVar("llm_client_id", default="default")
+_captured_retries = contextvars.ContextVar("llm_captured_retries", default=None)
+
+_RETRYABLE_STATUS = {429, 503, 529}
+
+
+@contextmanager
+def request_context(priority: int = None, client_id: str = None):
+    """Set the priority lane and/or client id for LLM calls made inside the block"""
+    tokens = []
+    if priority is not None:
+        tokens.append((_priority, _priority.set(priority)))
+    if client_id is not None:
+        tokens.append((_client_id, _client_id.set(client_id)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+@contextmanager
+def capture_retries():
+    """List of the errors the scheduler backed off on for calls made inside the block"""
+    retries = []
+    token = _captured_retries.set(retries)
+    try:
+        yield retries
+    finally:
+        _captured_retries.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def current_client_id() -> str:
+    return _client_id.get()
+
+
+class TokenBucket:
+    """Refills continuously up to capacity; a rate of 0 disables the limit"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def consume(self, amount: float, now: float):
+        if self.rate:
+            self._refill(now)
+            # May go negative when actual usage exceeds the estimate; later calls wait it off
+            self.level -= amount
+
+
+class _Waiter:
+    def __init__(self, tokens: int, notify):
+        self.tokens = tokens
+        self.notify = notify
+        self.granted = False
+
+
+def retry_after_seconds(error):
+    """Delay requested by the provider, from a Retry-After header if the error carries one"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    return None
+
+
+def is_retryable(error) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status in _RETRYABLE_STATUS or "RateLimit" in type(error).__name__
+
+
+def _add_time(timings, name: str, start: float) -> float:
+    now = time.perf_counter()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + now - start
+    return now
+
+
+class RequestScheduler:
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_concurrency: int = 32, max_retries: int = 4, backoff_base: float = 1.0,
+                 backoff_max: float = 60.0):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._lanes = {INTERACTIVE: OrderedDict(), BATCH: OrderedDict()}
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.retries = 0
+
+    # -- queueing ---------------------------------------------------------------
+
+    def _enqueue(self, waiter: _Waiter, priority: int, client_id: str):
+        lane = self._lanes[BATCH if priority >= BATCH else INTERACTIVE]
+        lane.setdefault(client_id, deque()).append(waiter)
+        self._dispatch()
+
+    def _next_waiter(self):
+        for priority in (INTERACTIVE, BATCH):
+            lane = self._lanes[priority]
+            if lane:
+                client_id = next(iter(lane))
+                return lane, client_id, lane[client_id][0]
+        return None
+
+    def _dispatch(self):
+        """Grant slots to waiting calls while limits allow; caller holds the lock"""
+        while self._in_flight < self.max_concurrency:
+            entry = self._next_waiter()
+            if entry is None:
+                return
+            lane, client_id, waiter = entry
+            now = time.monotonic()
+            delay = max(
+                self._paused_until - now,
+                self._requests.wait_time(1, now),
+                self._tokens.wait_time(waiter.tokens, now),
+            )
+            if delay > 0:
+                self._schedule_dispatch(delay)
+                return
+
+            queue = lane.pop(client_id)
+            queue.popleft()
+            if queue:
+                lane[client_id] = queue  # re-append: round-robin across clients
+            self._requests.consume(1, now)
+            self._tokens.consume(waiter.tokens, now)
+            self._in_flight += 1
+            self.granted += 1
+            waiter.granted = True
+            waiter.notify()
+
+    def _schedule_dispatch(self, delay: float):
+        if self._timer is not None and self._timer.is_alive():
+            return
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _remove(self, waiter: _Waiter, priority: int, client_id: str):
+        lane = self._lanes[BATCH if priority >= BATCH else INTERACTIVE]
+        queue = lane.get(client_id)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del lane[client_id]
+
+    # -- slots ----------------------------------------------------------------------
+
+    def release(self, tokens_estimated: int = 0, tokens_used: int = None):
+        with self._lock:
+            self._in_flight -= 1
+            if tokens_used is not None:
+                self._tokens.consume(tokens_used - tokens_estimated, time.monotonic())
+            self._dispatch()
+
+    def pause(self, seconds: float):
+        """Hold all new grants for seconds, e.g. after the provider returns 429"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self, tokens: int, priority: int = None, client_id: str = None):
+        priority = current_priority() if priority is None else priority
+        client_id = current_client_id() if client_id is None else client_id
+        event = threading.Event()
+        waiter = _Waiter(tokens, event.set)
+        with self._lock:
+            self._enqueue(waiter, priority, client_id)
+        event.wait()
+
+    async def aacquire(self, tokens: int, priority: int = None, client_id: str = None):
+        priority = current_priority() if priority is None else priority
+        client_id = current_client_id() if client_id is None else client_id
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = _Waiter(tokens, notify)
+        with self._lock:
+            self._enqueue(waiter, priority, client_id)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    self._in_flight -= 1
+                    self._dispatch()
+                else:
+                    self._remove(waiter, priority, client_id)
+            raise
+
+    # -- calls with backoff -------------------------------------------------------
+
+    def backoff_delay(self, error, attempt: int) -> float:
+        delay = retry_after_seconds(error)
+        if delay is None:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+        return delay
+
+    def _retrying(self, error, attempt: int):
+        self.retries += 1
+        retries = _captured_retries.get()
+        if retries is not None:
+            retries.append(error)
+        self.pause(self.backoff_delay(error, attempt))
+
+    def call(self, func, tokens: int, usage=None, timings: dict = None):
+        """Run func() under a slot, backing off and retrying on rate-limit errors.
+
+        If given, timings accumulates seconds spent in "queue" and "upstream".
+        """
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            self.acquire(tokens)
+            start = _add_time(timings, "queue", start)
+            used = None
+            try:
+                result = func()
+                used = usage(result) if usage else None
+                return result
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                self._retrying(e, attempt)
+            finally:
+                # Also on cancellation (timeouts, disconnects, lost hedges), which is not an Exception
+                _add_time(timings, "upstream", start)
+                self.release(tokens, used)
+
+    async def acall(self, func, tokens: int, usage=None, timings: dict = None):
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            await self.aacquire(tokens)
+            start = _add_time(timings, "queue", start)
+            used = None
+            try:
+                result = await func()
+                used = usage(result) if usage else None
+                return result
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                self._retrying(e, attempt)
+            finally:
+                _add_time(timings, "upstream", start)
+                self.release(tokens, used)
+
+    def stream(self, func, tokens: int, timings: dict = None):
+        """Iterate func() under a slot; retries are only possible before the first chunk"""
+        for attempt in range(self.max_retries + 1):
+            started = False
+            start = time.perf_counter()
+            self.acquire(tokens)
+            start = _add_time(timings, "queue", start)
+            try:
+                for chunk in func():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or attempt == self.max_retries or not is_retryable(e):
+                    raise
+                self._retrying(e, attempt)
+            finally:
+                _add_time(timings, "upstream", start)
+                self.release()
+
+    async def astream(self, func, tokens: int, timings: dict = None):
+        for attempt in range(self.max_retries + 1):
+            started = False
+            start = time.perf_counter()
+            await self.aacquire(tokens)
+            start = _add_time(timings, "queue", start)
+            try:
+                async for chunk in func():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or attempt == self.max_retries or not is_retryable(e):
+                    raise
+                self._retrying(e, attempt)
+            finally:
+                _add_time(timings, "upstream", start)
+                self.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "queued_interactive": sum(len(q) for q in self._lanes[INTERACTIVE].values()),
+                "queued_batch": sum(len(q) for q in self._lanes[BATCH].values()),
+                "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 3),
+                "granted": self.granted,
+                "retries": self.retries,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """Process-wide scheduler configured from the environment"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RequestScheduler(
+                    requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+                    tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+                    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "32")),
+                    max_retries=int(os.getenv("LLM_RATE_LIMIT_RETRIES", "4")),
+                )
+    return _scheduler
@@ -0,0 +1,84 @@
+# backend/schemas.py
+"""Typed agent outputs returned by the structured-output modes."""
+from typing import List, Optional
+
+from pydantic import BaseModel, Field, field_validator
+
+from text_utils import dedupe_items, is_placeholder
+
+
+class PatientInformation(BaseModel):
+    name: Optional[str] = None
+    age: Optional[str] = None
+    gender: Optional[str] = None
+    date_of_visit: Optional[str] = None
+
+    @field_validator("age", mode="before")
+    @classmethod
+    def _age_text(cls, value):
+        # Models often answer "age": 52 rather than "52"
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        return value
+
+
+class PreVisitSummary(BaseModel):
+    patient_information: PatientInformation = Field(default_factory=PatientInformation)
+    key_metrics_trend: List[str] = []
+    issues_needing_follow_up: List[str] = []
+    medication_adherence: List[str] = []
+    screenings_due: List[str] = []
+
+
+class DialogueAnalysis(BaseModel):
+    patient_information: PatientInformation = Field(default_factory=PatientInformation)
+    missing_elements: List[str] = []
+    clinical_alerts: List[str] = []
+    symptoms: List[str] = []
+    medications: List[str] = []
+    allergies: List[str] = []
+    conditions: List[str] = []
+
+    @classmethod
+    def merge(cls, analyses: list) -> "DialogueAnalysis":
+        """Combine chunk analyses: union of each list, first known value per patient field"""
+        patient = {}
+        for analysis in analyses:
+            for field, value in analysis.patient_information.model_dump().items():
+                if value and not is_placeholder(value) and field not in patient:
+                    patient[field] = value
+        lists = {
+            field: [item for item in dedupe_items(item for a in analyses for item in getattr(a, field))
+                    if not is_placeholder(item)]
+            for field in cls.model_fields if field != "patient_information"
+        }
+        return cls(patient_information=PatientInformation(**patient), **lists)
+
+
+class SoapNote(BaseModel):
+    patient_information: PatientInformation = Field(default_factory=PatientInformation)
+    subjective: List[str] = []
+    objective: List[str] = []
+    assessment: List[str] = []
+    plan: List[str] = []
+
+
+class BillingCode(BaseModel):
+    code: str
+    description: str
+    rationale: Optional[str] = None
+
+
+class EMLevel(BaseModel):
+    level: str
+    justification: Optional[str] = None
+
+
+class BillingCodes(BaseModel):
+    patient_information: PatientInformation = Field(default_factory=PatientInformation)
+    icd11_codes: List[BillingCode] = []
+    cpt_codes: List[BillingCode] = []
+    em_level: Optional[EMLevel] = None
+    # Set by the service, not the model: systems whose codes were withheld because no
+    # code table is loaded to verify them against
+    unverified_systems: List[str] = Field(default=[], json_schema_extra={"set_by_service": True})
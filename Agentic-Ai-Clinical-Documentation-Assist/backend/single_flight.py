@@ -0,0 +1,200 @@
+# backend/single_flight.py
+"""Single-flight deduplication of identical concurrent agent calls.
+
+Callers that arrive while a call with the same key is still in flight wait for it
+and receive its result (or its error) instead of going upstream themselves. For
+streams, followers first get a replay of the chunks produced so far, then the live
+ones. Each method returns (result, leader), where leader is True for the caller
+that actually made the call.
+"""
+import asyncio
+import contextvars
+import threading
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Broadcast:
+    """Chunks of one stream, replayed to any number of thread subscribers"""
+
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def close(self, error=None):
+        with self._cond:
+            self.finished, self.error = True, error
+            self._cond.notify_all()
+
+    def subscribe(self):
+        position = 0
+        while True:
+            with self._cond:
+                while position >= len(self.chunks) and not self.finished:
+                    self._cond.wait()
+                pending, finished = self.chunks[position:], self.finished
+            position += len(pending)
+            yield from pending
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class _AsyncBroadcast:
+    """Event-loop variant of _Broadcast; cancels the producer when every subscriber has left"""
+
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.producer = None
+        self._changed = asyncio.Event()
+        self._subscribers = 0
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def publish(self, chunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def close(self, error=None):
+        self.finished, self.error = True, error
+        self._notify()
+
+    def subscribe(self):
+        # Counted from now, not from the first iteration, so a subscriber that has not
+        # started reading yet keeps the producer alive when the others leave
+        self._subscribers += 1
+        return self._chunks()
+
+    async def _chunks(self):
+        position = 0
+        try:
+            while True:
+                pending, finished, changed = self.chunks[position:], self.finished, self._changed
+                position += len(pending)
+                for chunk in pending:
+                    yield chunk
+                if finished:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                if position >= len(self.chunks):
+                    await changed.wait()
+        finally:
+            self._subscribers -= 1
+            if not self._subscribers and not self.finished and self.producer is not None:
+                self.producer.cancel()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self._streams = {}
+        self._astreams = {}
+
+    def do(self, key: str, func):
+        """Run func() once for all concurrent callers with the same key"""
+        with self._lock:
+            flight = self._calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._calls[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, False
+
+        try:
+            flight.result = func()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            flight.done.set()
+        return flight.result, True
+
+    async def ado(self, key: str, func):
+        """Await func() once per event loop for all concurrent callers with the same key.
+
+        The shared task is shielded, so one caller being cancelled does not fail the others.
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        task = self._tasks.get(flight_key)
+        leader = task is None
+        if leader:
+            task = self._tasks[flight_key] = loop.create_task(func())
+            task.add_done_callback(lambda t: self._finish_task(flight_key, t))
+        return await asyncio.shield(task), leader
+
+    def _finish_task(self, flight_key, task):
+        self._tasks.pop(flight_key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here so an orphaned failure is not logged as unhandled
+
+    def stream(self, key: str, func):
+        """(chunk iterator, leader); func() is iterated once, on a producer thread"""
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._streams[key] = _Broadcast()
+        if leader:
+            def produce():
+                error = None
+                try:
+                    for chunk in func():
+                        broadcast.publish(chunk)
+                except BaseException as e:
+                    error = e
+                with self._lock:
+                    self._streams.pop(key, None)
+                broadcast.close(error)
+
+            # Carry the caller's scheduler priority and client id onto the producer thread
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(produce,), daemon=True).start()
+        return broadcast.subscribe(), leader
+
+    def astream(self, key: str, func):
+        """(async chunk iterator, leader); func() is iterated once, in a task on the caller's loop"""
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        broadcast = self._astreams.get(flight_key)
+        leader = broadcast is None
+        if leader:
+            broadcast = self._astreams[flight_key] = _AsyncBroadcast()
+
+            async def produce():
+                error = None
+                try:
+                    async for chunk in func():
+                        broadcast.publish(chunk)
+                except BaseException as e:
+                    error = e
+                self._astreams.pop(flight_key, None)
+                broadcast.close(error)
+
+            broadcast.producer = loop.create_task(produce())
+        return broadcast.subscribe(), leader
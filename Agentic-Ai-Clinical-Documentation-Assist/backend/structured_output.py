@@ -0,0 +1,121 @@
+# backend/structured_output.py
+"""JSON structured-output prompts and a validating parser with bounded repair.
+
+Output is validated in one pass with pydantic; only when that fails is the model
+asked to repair its own output, at most MAX_REPAIRS times.
+"""
+import json
+import re
+import typing
+
+from pydantic import BaseModel, ValidationError
+
+from agent_runtime import invoke_chain, ainvoke_chain
+
+if typing.TYPE_CHECKING:
+    from langchain_core.prompts import PromptTemplate
+
+MAX_REPAIRS = 1
+
+_FENCE_PATTERN = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+_STRUCTURED_SUFFIX = """
+
+Return ONLY a valid JSON object, with no markdown and no explanations, in exactly this shape
+(use null for unknown values and [] for empty lists):
+
+{schema}
+"""
+
+_REPAIR_TEMPLATE = """
+The following output should have been a JSON object but failed validation.
+
+Output:
+{output}
+
+Validation errors:
+{errors}
+
+Return ONLY the corrected JSON object, with no markdown and no explanations, in exactly this shape:
+
+{schema}
+"""
+
+
+class StructuredOutputError(ValueError):
+    """Model output could not be validated, even after repair attempts"""
+
+    def __init__(self, message: str, output: str):
+        super().__init__(message)
+        self.output = output
+
+
+def schema_skeleton(model_cls) -> str:
+    """Compact example-shaped schema; far fewer prompt tokens than a full JSON Schema"""
+    return json.dumps(_skeleton(model_cls), indent=1)
+
+
+def _skeleton(annotation):
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        options = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        return _skeleton(options[0])
+    if origin in (list, typing.List):
+        return [_skeleton(typing.get_args(annotation)[0])]
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return {name: _skeleton(field.annotation) for name, field in annotation.model_fields.items()
+                if not (field.json_schema_extra or {}).get("set_by_service")}
+    return "string"
+
+
+def structured_prompt(instructions: str, model_cls) -> "PromptTemplate":
+    """Prompt that asks for model_cls as JSON after the given task instructions"""
+    from langchain_core.prompts import PromptTemplate
+
+    template = PromptTemplate.from_template(instructions + _STRUCTURED_SUFFIX)
+    return template.partial(schema=schema_skeleton(model_cls))
+
+
+def repair_prompt(model_cls) -> "PromptTemplate":
+    from langchain_core.prompts import PromptTemplate
+
+    return PromptTemplate.from_template(_REPAIR_TEMPLATE).partial(schema=schema_skeleton(model_cls))
+
+
+def parse_structured(text: str, model_cls):
+    """Validate model output against model_cls, tolerating code fences and surrounding prose"""
+    candidate = _FENCE_PATTERN.sub("", text.strip())
+    start, end = candidate.find("{"), candidate.rfind("}")
+    if start == -1 or end < start:
+        raise StructuredOutputError("no JSON object found in output", text)
+    try:
+        return model_cls.model_validate_json(candidate[start:end + 1])
+    except ValidationError as e:
+        raise StructuredOutputError(str(e), text) from e
+
+
+def invoke_structured(chain, repair_chain, inputs: dict, model_cls, agent: str,
+                      use_cache: bool = True, max_repairs: int = MAX_REPAIRS, **options):
+    """options (middleware, hedge) are passed on to invoke_chain"""
+    text = invoke_chain(chain, inputs, agent, use_cache, **options)
+    for attempt in range(max_repairs + 1):
+        try:
+            return parse_structured(text, model_cls)
+        except StructuredOutputError as e:
+            if attempt == max_repairs:
+                raise
+            text = invoke_chain(repair_chain, {"output": text, "errors": str(e)}, agent + "_repair", use_cache,
+                                **options)
+
+
+async def ainvoke_structured(chain, repair_chain, inputs: dict, model_cls, agent: str,
+                             use_cache: bool = True, max_repairs: int = MAX_REPAIRS, **options):
+    text = await ainvoke_chain(chain, inputs, agent, use_cache, **options)
+    for attempt in range(max_repairs + 1):
+        try:
+            return parse_structured(text, model_cls)
+        except StructuredOutputError as e:
+            if attempt == max_repairs:
+                raise
+            text = await ainvoke_chain(repair_chain, {"output": text, "errors": str(e)}, agent + "_repair",
+                                       use_cache, **options)
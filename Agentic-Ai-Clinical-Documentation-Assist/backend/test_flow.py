@@ -3,6 +3,7 @@ from agents.preparation_agent import PreparationAgent
 from agents.dialogue_agent import DialogueAgent
 from agents.note_generator_agent import NoteGeneratorAgent
 from agents.coder_agent import CoderAgent
+from fhir_compact import compact_patient
 
 def test_flow():
     # Load sample patient data
@@ -12,7 +13,7 @@ def test_flow():
 
     # Step 1: Generate pre-visit summary
     prep_agent = PreparationAgent()
-    summary = prep_agent.run(json.dumps(patient_data, indent=2))
+    summary = prep_agent.run(compact_patient(patient_data))
     print("📝 Pre-Visit Summary:\n", summary)
 
     # Step 2: Analyze conversation
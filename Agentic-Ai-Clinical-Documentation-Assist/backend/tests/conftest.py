@@ -0,0 +1,12 @@
+# backend/tests/conftest.py
+"""Every test runs offline against the fake LLM backend, with nothing written to disk."""
+import os
+
+os.environ.update(
+    LLM_BACKEND="fake",
+    FAKE_LLM_LATENCY_MS="0",
+    FAKE_LLM_LATENCY_JITTER_MS="0",
+    RESPONSE_CACHE_BACKEND="off",
+    JOB_WORKERS="0",
+)
+os.environ.pop("ENCOUNTER_DB_PATH", None)
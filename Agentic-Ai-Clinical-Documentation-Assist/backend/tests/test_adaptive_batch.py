@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+
+from adaptive_batch import AdaptiveBatchSize, arun_batch, run_batch
+from scheduler import RequestScheduler, capture_retries
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+def test_slow_item_does_not_hold_up_the_rest():
+    # Item 0 only finishes once item 3 has started: impossible with waves of two
+    async def main():
+        item_3 = asyncio.Event()
+
+        async def work(i):
+            if i == 0:
+                await item_3.wait()
+            if i == 3:
+                item_3.set()
+            return i
+
+        return await asyncio.wait_for(arun_batch(work, list(range(6)), AdaptiveBatchSize(2, 2, 2)), 2)
+
+    assert asyncio.run(main()) == list(range(6))
+
+
+def test_sync_batch_keeps_order_and_returns_errors():
+    item_3 = threading.Event()
+
+    def work(i):
+        if i == 0:
+            assert item_3.wait(2)
+        if i == 3:
+            item_3.set()
+        if i == 4:
+            raise ValueError("bad item")
+        return i * 10
+
+    results = run_batch(work, list(range(6)), AdaptiveBatchSize(2, 2, 2))
+    assert results[:4] == [0, 10, 20, 30] and results[5] == 50
+    assert isinstance(results[4], ValueError)
+
+
+def test_own_retries_halve_the_size():
+    scheduler = RequestScheduler(max_concurrency=8, backoff_base=0.001, backoff_max=0.001)
+    failed = set()
+
+    def work(i):
+        def call():
+            if i == 2 and i not in failed:
+                failed.add(i)
+                raise RateLimited()
+            time.sleep(0.02)
+            return i
+        return scheduler.call(call, tokens=1)
+
+    sizing = AdaptiveBatchSize(8, maximum=8)
+    assert run_batch(work, list(range(4)), sizing) == [0, 1, 2, 3]
+    # Items that finish after the retried one make a last window of their own, which may grow the size
+    assert sizing.windows[0]["rate_limited"] and sizing.windows[0]["size"] == 4
+
+
+def test_other_traffic_retries_do_not_shrink_the_batch():
+    scheduler = RequestScheduler(max_concurrency=8, backoff_base=0.001, backoff_max=0.001)
+
+    def other_traffic():
+        try:
+            scheduler.call(lambda: (_ for _ in ()).throw(RateLimited()), tokens=1)
+        except RateLimited:
+            pass
+
+    threads = []
+
+    def work(i):
+        # Retries made outside this item's calls are not its rate-limit feedback
+        threads.append(threading.Thread(target=other_traffic))
+        threads[-1].start()
+        threads[-1].join()
+        time.sleep(0.02)
+        return i
+
+    sizing = AdaptiveBatchSize(4, maximum=8)
+    run_batch(work, list(range(4)), sizing)
+    assert scheduler.retries > 0
+    assert not sizing.windows[0]["rate_limited"] and sizing.size == 5
+
+
+def test_capture_retries_sees_only_its_own_calls():
+    scheduler = RequestScheduler(max_concurrency=1, backoff_base=0.001, backoff_max=0.001)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RateLimited()
+        return "ok"
+
+    with capture_retries() as retries:
+        assert scheduler.call(flaky, tokens=1) == "ok"
+    assert [type(error) for error in retries] == [RateLimited]
+
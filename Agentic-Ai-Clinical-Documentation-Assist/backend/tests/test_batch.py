@@ -0,0 +1,55 @@
+import asyncio
+import json
+import subprocess
+import sys
+
+from batch import BatchRunner
+
+
+def _run(runner, records):
+    async def collect():
+        return [result async for result in runner.run(enumerate(records))]
+    return {result["id"]: result for result in asyncio.run(collect())}
+
+
+def test_conversation_file_rejected_without_base_dir():
+    results = _run(BatchRunner(concurrency=1), [{"conversation_file": "/etc/hostname"}])
+    assert results[0]["status"] == "error"
+    assert "conversation_text" in results[0]["error"]["message"]
+
+
+def test_conversation_file_confined_to_base_dir(tmp_path):
+    (tmp_path / "visit.txt").write_text("Doctor: How are you?\nPatient: Chest pain since Monday.")
+    runner = BatchRunner(concurrency=2, base_dir=str(tmp_path))
+    results = _run(runner, [
+        {"conversation_file": "visit.txt"},
+        {"conversation_file": "../../etc/hostname"},
+        {"conversation_file": "/etc/hostname"},
+    ])
+    assert results[0]["status"] == "ok"
+    assert set(results[0]["result"]) == {"analysis", "soap_note", "codes"}
+    assert results[1]["status"] == "error"
+    assert results[2]["status"] == "error"
+
+
+def test_report_every_must_be_positive(tmp_path):
+    records = tmp_path / "records.ndjson"
+    records.write_text(json.dumps({"conversation_text": "hello"}) + "\n")
+    completed = subprocess.run([sys.executable, "batch.py", str(records), "--report-every", "0"],
+                               capture_output=True, text=True)
+    assert completed.returncode == 2
+    assert "--report-every" in completed.stderr
+
+
+def test_api_rejects_out_of_range_concurrency():
+    from fastapi.testclient import TestClient
+
+    from batch import MAX_CONCURRENCY
+    from main import app
+
+    client = TestClient(app)
+    body = json.dumps({"id": "a", "conversation_text": "Doctor: How are you?\nPatient: Tired."})
+    for concurrency in (0, -1, MAX_CONCURRENCY + 1):
+        assert client.post(f"/batch?concurrency={concurrency}", content=body).status_code == 422
+    lines = client.post("/batch?concurrency=2", content=body).text.splitlines()
+    assert json.loads(lines[0])["status"] == "ok" and "stats" in json.loads(lines[-1])
@@ -0,0 +1,67 @@
+import asyncio
+
+from agents.preparation_agent import PreparationAgent
+from cascade import CascadeRouter, empty_sections, rejection_reason, ungrounded_numbers
+
+TEMPLATE = """Respond in this format:
+
+**Findings:**
+**Vitals:**
+- <vital signs>
+
+**Plan:**
+- <next steps>
+"""
+SOURCE = TEMPLATE + "BP 142/90, HR 88. Metformin 500 mg twice daily."
+
+
+def test_accepts_complete_grounded_answer():
+    answer = "**Findings:**\n**Vitals:**\n- BP 142/90, HR 88\n\n**Plan:**\n1. Continue metformin 500 mg"
+    assert rejection_reason(answer, TEMPLATE, SOURCE) is None
+
+
+def test_rejects_missing_section():
+    assert rejection_reason("**Findings:**\n**Vitals:**\n- BP 142/90", TEMPLATE, SOURCE) == "missing_section"
+
+
+def test_rejects_empty_section_but_not_umbrella_heading():
+    answer = "**Findings:**\n**Vitals:**\n\n**Plan:**\n- Recheck BP"
+    assert empty_sections(answer, TEMPLATE) == {"vitals"}
+    assert rejection_reason(answer, TEMPLATE, SOURCE) == "empty_section"
+
+
+def test_rejects_refusal():
+    answer = "**Findings:**\n**Vitals:**\n- I'm sorry, I cannot help\n**Plan:**\n- None"
+    assert rejection_reason(answer, TEMPLATE, SOURCE) == "refusal"
+
+
+def test_rejects_invented_numbers():
+    answer = "**Findings:**\n**Vitals:**\n- BP 142/90, HR 88\n**Plan:**\n- Metformin 1000 mg"
+    assert ungrounded_numbers(answer, SOURCE) == {"1000"}
+    assert rejection_reason(answer, TEMPLATE, SOURCE) == "ungrounded_number"
+    assert not ungrounded_numbers("Metformin 500.0 mg, HR 088", SOURCE)
+
+
+def test_cascade_is_opt_in():
+    assert not CascadeRouter.from_env().starts_small("preparation", 10)
+
+
+def test_stream_bypasses_cascade():
+    agent = PreparationAgent(cascade=CascadeRouter("small-model", ["preparation"]))
+    text = "Patient: Jane Doe, 54F. BP 142/90. Metformin 500 mg."
+    chunks = list(agent.stream(text, use_cache=False))
+    assert len(chunks) > 1
+
+    async def collect():
+        return [chunk async for chunk in agent.astream(text, use_cache=False)]
+
+    assert len(asyncio.run(collect())) > 1
+
+
+def test_disabled_cascade_never_builds_small_model():
+    import llm_setup
+
+    agent = PreparationAgent(cascade=CascadeRouter("small-model-unused", []))
+    agent.run("Patient: Jane Doe, 54F.", use_cache=False, raise_errors=True)
+    agent.run_structured("Patient: Jane Doe, 54F.", use_cache=False)
+    assert "small-model-unused" not in llm_setup._llm_registry
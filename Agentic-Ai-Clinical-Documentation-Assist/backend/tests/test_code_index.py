@@ -0,0 +1,101 @@
+import pytest
+
+from code_index import CodeIndex, extract_codes, malformed_codes
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = CodeIndex(str(tmp_path / "codes.sqlite3"))
+    index.load("icd11", [("5A11", "Type 2 diabetes mellitus"), ("BA00", "Essential hypertension")])
+    index.load("cpt", [("99213", "Office visit, established patient")])
+    return index
+
+
+OUTPUT = """**ICD-11 Codes:**
+• 5A11: Type 2 diabetes mellitus - HbA1c 7.2 in 2023
+1. ZZ98: Fake numbered
+• ZZ97 (Fake paren)
+- **BA00** – Essential hypertension
+- Code: ZZ96 - labelled
+Supports 5A11 and also ZZ95 inline
+No other diagnoses apply.
+
+**CPT Codes:**
+2) 99213: Office visit
+• 99999: Unknown visit
+- 99213: Office visit, see also 12345
+
+**E/M Level:**
+• Level: 3 - moderate complexity ZZ94"""
+
+
+def test_filter_markdown_fails_closed(index):
+    kept = index.filter_markdown(OUTPUT)
+    for fake in ("ZZ98", "ZZ97", "ZZ96", "ZZ95", "99999", "12345"):
+        assert fake not in kept
+    assert "• 5A11: Type 2 diabetes mellitus - HbA1c 7.2 in 2023" in kept
+    assert "- **BA00** – Essential hypertension" in kept
+    assert "2) 99213: Office visit" in kept
+    assert "No other diagnoses apply." in kept
+    # Outside the code sections nothing is validated
+    assert "moderate complexity ZZ94" in kept
+
+
+def test_filter_stream_matches_filter_markdown(index):
+    chunks = [OUTPUT[i:i + 7] for i in range(0, len(OUTPUT), 7)]
+    assert "".join(index.filter_stream(chunks)) == index.filter_markdown(OUTPUT)
+
+
+def test_malformed_codes_without_index():
+    markdown = "**ICD-11 Codes:**\n1. e11x9: bad\n• 5A11 (ok)\n**CPT Codes:**\n- 9921: short"
+    assert malformed_codes(markdown) == ["e11x9", "9921"]
+
+
+def test_extract_codes():
+    markdown = "**ICD-11 Codes:**\n1. 5a11: Type 2 diabetes\n**CPT Codes:**\n• **99213** - Office visit"
+    assert extract_codes(markdown) == [("icd11", "5A11", "Type 2 diabetes"), ("cpt", "99213", "Office visit")]
+
+
+def test_filter_codes_structured(index):
+    from schemas import BillingCodes
+
+    codes = BillingCodes.model_validate({
+        "icd11_codes": [{"code": "5A11", "description": "T2DM", "rationale": "x"},
+                        {"code": "ZZ98", "description": "fake", "rationale": "x"}],
+        "cpt_codes": [{"code": "99213", "description": "visit", "rationale": "x"}],
+        "em_level": {"level": "3", "justification": "x"},
+    })
+    filtered = index.filter_codes(codes)
+    assert [c.code for c in filtered.icd11_codes] == ["5A11"]
+    assert [c.code for c in filtered.cpt_codes] == ["99213"]
+    assert filtered.unverified_systems == []
+
+
+def test_unloaded_system_is_withheld_and_marked(tmp_path):
+    index = CodeIndex(str(tmp_path / "icd11_only.sqlite3"))
+    index.load("icd11", [("5A11", "Type 2 diabetes mellitus")])
+    kept = index.filter_markdown("**ICD-11 Codes:**\n- 5A11: T2DM\n\n**CPT Codes:**\n- 99213: Office visit")
+    assert "- 5A11: T2DM" in kept
+    assert "99213" not in kept
+    assert "Not verified: no CPT code table is loaded" in kept
+    assert index.unverified_systems() == ["cpt"]
+
+
+def test_coder_without_index_fails_closed(monkeypatch):
+    import agents.coder_agent as coder_agent
+    from schemas import BillingCodes
+
+    monkeypatch.setattr(coder_agent, "get_code_index", lambda: None)
+    coder = coder_agent.CoderAgent()
+    kept = coder.postprocess("**ICD-11 Codes:**\n- 5A11: T2DM\n**CPT Codes:**\n- 99213: Office visit\n")
+    assert "5A11" not in kept and "99213" not in kept
+    assert "no ICD-11 code table is loaded" in kept and "no CPT code table is loaded" in kept
+    chunks = ["**ICD-11 Codes:**\n- 5A", "11: T2DM\n**CPT Codes:**\n- 99213: Office visit\n"]
+    assert "".join(coder.filter_stream(chunks)) == kept
+
+    codes = coder.postprocess_structured(BillingCodes.model_validate({
+        "icd11_codes": [{"code": "5A11", "description": "T2DM", "rationale": "x"}],
+        "cpt_codes": [{"code": "99213", "description": "visit", "rationale": "x"}],
+    }))
+    assert codes.icd11_codes == [] and codes.cpt_codes == []
+    assert codes.unverified_systems == ["icd11", "cpt"]
@@ -0,0 +1,39 @@
+from agents.dialogue_agent import DialogueAgent
+from metrics import capture_calls
+from scheduler import BATCH, current_client_id, current_priority, request_context
+
+CONVERSATION = "\n".join(
+    f"Doctor: How has the chest pain been on day {i}?\nPatient: It comes on when I climb stairs, about {i} times."
+    for i in range(12)
+)
+
+
+def _agent():
+    agent = DialogueAgent(chunk_tokens=60, overlap_tokens=0)
+    assert len(agent.split(CONVERSATION)) > 2
+    return agent
+
+
+def test_chunk_calls_keep_the_callers_priority_and_client():
+    agent, seen = _agent(), []
+    original = agent.generate
+
+    def generate(inputs, use_cache=True):
+        seen.append((current_priority(), current_client_id()))
+        return original(inputs, use_cache)
+
+    agent.generate = generate
+    with request_context(priority=BATCH, client_id="backfill"):
+        agent.run(CONVERSATION, use_cache=False, raise_errors=True)
+    assert len(seen) == len(agent.split(CONVERSATION))
+    assert set(seen) == {(BATCH, "backfill")}
+
+
+def test_chunk_calls_are_captured():
+    agent = _agent()
+    with capture_calls() as calls:
+        agent.run(CONVERSATION, use_cache=False, raise_errors=True)
+    assert len(calls) == len(agent.split(CONVERSATION))
+    with capture_calls() as calls:
+        agent.run_structured(CONVERSATION, use_cache=False)
+    assert len(calls) >= len(agent.split(CONVERSATION))
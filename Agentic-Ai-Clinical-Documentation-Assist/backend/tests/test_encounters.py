@@ -0,0 +1,94 @@
+import pytest
+
+from agents import get_agent
+from encounters import get_encounter_store, record_encounter
+from fhir_compact import visit_date
+
+CODES = "**ICD-11 Codes:**\n- 5A11: Type 2 diabetes mellitus\n\n**CPT Codes:**\n- 99213: Office visit"
+BUNDLE = {
+    "resourceType": "Bundle",
+    "entry": [
+        {"resource": {"resourceType": "Patient", "id": "p1", "name": [{"given": ["Ana"], "family": "Silva"}]}},
+        {"resource": {"resourceType": "Encounter", "period": {"start": "2024-06-03T09:30:00Z"}}},
+    ],
+}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setenv("ENCOUNTER_DB_PATH", str(tmp_path / "encounters.sqlite3"))
+    return get_encounter_store()
+
+
+def test_store_is_off_without_a_path():
+    assert get_encounter_store() is None
+    assert record_encounter("codes", "Type 2 diabetes", {"codes": CODES}) is None
+
+
+def test_records_codes_and_filters(store):
+    encounter_id = record_encounter("codes", "Type 2 diabetes", {"codes": CODES}, patient_id="p1",
+                                    encounter_date="2024-06-01")
+    encounter = store.get(encounter_id)
+    assert encounter["encounter_date"] == "2024-06-01"
+    assert {code["code"] for code in encounter["code_list"]} == {"5A11", "99213"}
+    assert [e["id"] for e in store.find(patient_id="p1", code="5A11")] == [encounter_id]
+    assert store.find(date_from="2024-06-02") == []
+    assert [e["id"] for e in store.search("diabetes")] == [encounter_id]
+
+
+def test_error_output_is_not_recorded(store):
+    coder = get_agent("coder")
+    error = f"{coder.error_prefix}: provider unavailable"
+    assert coder.failed(error) and not coder.failed(CODES)
+    assert record_encounter("codes", "Type 2 diabetes", {"codes": error}, failed={"codes"}) is None
+    assert store.counts() == {}
+
+    encounter_id = record_encounter("visit", "Type 2 diabetes", {"summary": "Stable.", "codes": error},
+                                    failed={"codes"})
+    encounter = store.get(encounter_id)
+    assert encounter["summary"] == "Stable."
+    assert encounter["codes"] is None and encounter["code_list"] == []
+
+
+def test_encounter_date_from_the_bundle(store):
+    assert visit_date(BUNDLE) == "2024-06-03"
+    encounter = store.get(record_encounter("summary", "text", {"summary": "Stable."}, BUNDLE))
+    assert (encounter["patient_id"], encounter["encounter_date"]) == ("p1", "2024-06-03")
+    encounter = store.get(record_encounter("summary", "text", {"summary": "Stable."}, BUNDLE,
+                                           encounter_date="2024-05-30"))
+    assert encounter["encounter_date"] == "2024-05-30"
+
+
+def test_job_records_payload_date_and_skips_failed_codes(store):
+    from jobs import JobHandlers
+
+    handlers = JobHandlers()
+    payload = {"patient_info": BUNDLE, "encounter_date": "2024-06-05"}
+    handlers.record("summary", payload, {"summary": "Stable."}, [], 0.1)
+    handlers.record("codes", payload, {"codes": f"{handlers.coder_agent.error_prefix}: timeout"}, [], 0.1)
+    assert store.counts() == {"summary": 1}
+    assert store.find()[0]["encounter_date"] == "2024-06-05"
+
+
+def test_api_records_off_the_event_loop(monkeypatch):
+    import asyncio
+
+    from fastapi.testclient import TestClient
+
+    import main
+
+    threads = []
+
+    def record(*args, **fields):
+        try:
+            asyncio.get_running_loop()
+            threads.append("event loop")
+        except RuntimeError:
+            threads.append("worker thread")
+        return "id"
+
+    monkeypatch.setattr(main, "record_encounter", record)
+    client = TestClient(main.app)
+    assert client.post("/generate-summary", json={"patient_info": BUNDLE}).json()["encounter_id"] == "id"
+    client.post("/generate-codes/stream", json={"patient_info": BUNDLE})
+    assert threads == ["worker thread", "worker thread"]
@@ -0,0 +1,92 @@
+import json
+
+from fhir_compact import compact_patient, patient_identity
+
+
+def _bundle(*resources):
+    return {"resourceType": "Bundle", "entry": [{"resource": resource} for resource in resources]}
+
+
+def _status(code):
+    return {"coding": [{"code": code}]}
+
+
+PATIENT = {"resourceType": "Patient", "id": "p1", "name": [{"given": ["Ann"], "family": "Lee"}], "gender": "female"}
+
+
+def test_sample_patient():
+    with open("sample_data/sample_patient.json") as f:
+        text = compact_patient(json.load(f))
+    assert text.splitlines()[0] == "Patient: John Doe, male, born 1980-05-15"
+    assert "- HbA1c: 7.2 (2023-01-10; up from 6.8 6 months ago)" in text
+    assert "- Metformin 500mg (active, adherence partial)" in text
+    assert "example" not in text
+
+
+def test_unrecognised_data_kept_as_json():
+    text = compact_patient({"structured_data": "55yo M chest pain, troponin pending"})
+    assert json.loads(text) == {"structured_data": "55yo M chest pain, troponin pending"}
+    assert compact_patient("55yo M chest pain") == "55yo M chest pain"
+
+
+def test_other_fields_kept_next_to_recognised_ones():
+    text = compact_patient({"name": "Ann Lee", "chief_complaint": "chest pain", "id": "p1"})
+    assert "- chief_complaint: chest pain" in text
+    assert "p1" not in text
+
+
+def test_refuted_and_entered_in_error_entries_skipped():
+    text = compact_patient(_bundle(
+        PATIENT,
+        {"resourceType": "Condition", "code": {"text": "Myocardial infarction"},
+         "clinicalStatus": _status("active"), "verificationStatus": _status("refuted")},
+        {"resourceType": "Condition", "code": {"text": "Angina"}, "verificationStatus": _status("provisional")},
+        {"resourceType": "Condition", "code": {"text": "Asthma"}, "verificationStatus": _status("entered-in-error")},
+        {"resourceType": "Observation", "status": "entered-in-error", "code": {"text": "Troponin"},
+         "valueQuantity": {"value": 9, "unit": "ng/mL"}},
+        {"resourceType": "MedicationRequest", "status": "entered-in-error",
+         "medicationCodeableConcept": {"text": "Warfarin"}},
+        {"resourceType": "AllergyIntolerance", "code": {"text": "Latex"}, "verificationStatus": _status("refuted")},
+    ))
+    assert "Myocardial infarction" not in text
+    assert "Asthma" not in text
+    assert "Troponin" not in text
+    assert "Warfarin" not in text
+    assert "Latex" not in text
+    assert "- Angina (provisional)" in text
+
+
+def test_dosage_and_allergy_details_kept():
+    text = compact_patient(_bundle(
+        PATIENT,
+        {"resourceType": "MedicationRequest", "status": "active", "medicationCodeableConcept": {"text": "Metformin"},
+         "dosageInstruction": [{"doseAndRate": [{"doseQuantity": {"value": 500, "unit": "mg"}}],
+                                "timing": {"repeat": {"frequency": 2, "period": 1, "periodUnit": "d"}},
+                                "route": {"text": "oral"}}]},
+        {"resourceType": "MedicationStatement", "medicationCodeableConcept": {"text": "Lisinopril"},
+         "dosage": [{"text": "10 mg once daily"}]},
+        {"resourceType": "AllergyIntolerance", "code": {"text": "Penicillin"}, "criticality": "high",
+         "reaction": [{"manifestation": [{"text": "Anaphylaxis"}], "severity": "severe"}]},
+    ))
+    assert "- Metformin (500 mg 2x per 1 d oral, active)" in text
+    assert "- Lisinopril (10 mg once daily)" in text
+    assert "- Penicillin (Anaphylaxis (severe), criticality high)" in text
+
+
+def test_patient_identity():
+    assert patient_identity(_bundle(PATIENT)) == ("p1", "Ann Lee")
+    assert patient_identity({"id": "p2", "name": {"given": ["A"], "family": "B"}}) == ("p2", "A B")
+
+
+def test_plain_string_entries():
+    text = compact_patient({"name": "Jane", "conditions": ["Type 2 diabetes"], "observations": ["BP 140/90"],
+                            "medications": ["Metformin 500mg", {"medication": "Lisinopril", "dosage": "10mg daily"}],
+                            "allergies": ["Penicillin"]})
+    assert text.splitlines() == ["Patient: Jane", "Conditions:", "- Type 2 diabetes", "Observations:",
+                                 "- BP 140/90", "Medications:", "- Metformin 500mg", "- Lisinopril (10mg daily)",
+                                 "Allergies:", "- Penicillin"]
+
+
+def test_single_human_name_and_single_entries():
+    text = compact_patient({"name": {"given": ["A"], "family": "B"}, "conditions": "Asthma"})
+    assert text.splitlines() == ["Patient: A B", "Conditions:", "- Asthma"]
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+from jobs import JobStore, JobWorkerPool, payload_error
+
+
+class StubHandlers:
+    def __init__(self):
+        self.calls = 0
+
+    async def run(self, kind, payload):
+        self.calls += 1
+        return {"summary": "Stable."}
+
+    def record(self, *args):
+        pass
+
+
+def _run_one(store, job_id, handlers=None):
+    pool = JobWorkerPool(store)
+    pool.handlers = handlers or StubHandlers()
+    job = store.claim(pool.worker_id)
+    assert job["id"] == job_id
+    asyncio.run(pool._execute(job))
+    return pool.handlers.calls
+
+
+def test_payload_error():
+    assert payload_error("summary", {"patient_info": {}}) is None
+    assert payload_error("visit", {"patient_info": {}}) == "visit payload needs 'conversation_text' (str)"
+    assert payload_error("batch", {"records": {}}) == "batch payload needs 'records' (list)"
+    assert payload_error("batch", {"records": [{"patient_info": {}}, "text"]}) == "batch record 1 must be an object"
+    assert "concurrency" in payload_error("batch", {"records": [], "concurrency": 0})
+    assert "unknown job kind" in payload_error("report", {})
+
+
+def test_malformed_payload_fails_without_retries(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    job_id = store.submit("summary", {"conversation_text": "no patient"}, max_attempts=3)
+    assert _run_one(store, job_id) == 0
+    job = store.get(job_id)
+    assert (job["status"], job["attempts"]) == ("failed", 1)
+    assert job["error"].startswith("InvalidPayload")
+
+
+def test_well_formed_job_completes(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    job_id = store.submit("summary", {"patient_info": {"name": "Ana"}})
+    assert _run_one(store, job_id) == 1
+    assert store.get(job_id)["result"] == {"summary": "Stable."}
+
+
+def test_recording_error_does_not_fail_a_succeeded_job(tmp_path):
+    class FailingRecord(StubHandlers):
+        def record(self, *args):
+            raise RuntimeError("encounter store unavailable")
+
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    job_id = store.submit("summary", {"patient_info": {"name": "Ana"}}, max_attempts=3)
+    assert _run_one(store, job_id, FailingRecord()) == 1
+    job = store.get(job_id)
+    assert (job["status"], job["error"], job["result"]) == ("succeeded", None, {"summary": "Stable."})
+
+
+def test_lost_lease_on_an_expired_job(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    job_id = store.submit("summary", {"patient_info": {}})
+    pool = JobWorkerPool(store)
+
+    class SlowHandlers(StubHandlers):
+        async def run(self, kind, payload):
+            await asyncio.sleep(10)
+
+    pool.handlers = SlowHandlers()
+    job = store.claim(pool.worker_id)
+    # The job is purged while it runs: renew fails and get returns None
+    monkeypatch.setattr("jobs.CHECK_INTERVAL", 0.01)
+    monkeypatch.setattr(store, "renew", lambda *args: False)
+    monkeypatch.setattr(store, "get", lambda job_id: None)
+    asyncio.run(pool._execute(job))
+
+
+def test_importing_the_api_opens_no_job_database(tmp_path):
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", "import main"], cwd=tmp_path, check=True,
+                   env={**os.environ, "PYTHONPATH": backend})
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from live_analysis import LiveAnalysisSession, LiveSessionStore
+
+TURNS = ["Doctor: What brings you in?", "Patient: Chest tightness when climbing stairs.",
+         "Doctor: How long has this been going on?", "Patient: About two weeks."]
+
+
+class RecordingAgent:
+    """Stands in for DialogueAgent.update/aupdate and records what each update sends"""
+
+    clinician_specialty = "cardiology"
+
+    def __init__(self):
+        self.calls = []
+
+    def update(self, current_analysis, new_turns, context_turns="", use_cache=True):
+        self.calls.append((current_analysis, new_turns, context_turns))
+        return f"**Symptoms:**\n• after {len(self.calls)} updates"
+
+    async def aupdate(self, *args, **kwargs):
+        return self.update(*args, **kwargs)
+
+
+def test_update_sends_only_new_turns_with_context():
+    agent = RecordingAgent()
+    session = LiveAnalysisSession(agent=agent, context_turns=1)
+    assert session.append(TURNS[:2]) == 2
+    assert session.update() == "**Symptoms:**\n• after 1 updates"
+    session.append("\n".join(TURNS[2:]))
+    session.update()
+    assert session.update() == "**Symptoms:**\n• after 2 updates"  # nothing pending: no call
+    assert agent.calls == [
+        ("", "\n".join(TURNS[:2]), ""),
+        ("**Symptoms:**\n• after 1 updates", "\n".join(TURNS[2:]), TURNS[1]),
+    ]
+    status = session.status()
+    assert (status["turns_total"], status["turns_processed"], status["updates"]) == (4, 4, 2)
+
+
+def test_aupdate_serializes_concurrent_updates():
+    agent = RecordingAgent()
+    session = LiveAnalysisSession(agent=agent)
+    session.append(TURNS)
+
+    async def main():
+        return await asyncio.gather(session.aupdate(), session.aupdate())
+
+    first, second = asyncio.run(main())
+    assert first == second and len(agent.calls) == 1
+
+
+def test_store_caps_sessions_and_evicts_the_least_recently_active():
+    store = LiveSessionStore(max_sessions=2)
+    first, second = store.create(), store.create()
+    time.sleep(0.01)
+    first.append(TURNS[:1])
+    third = store.create()
+    assert len(store) == 2
+    assert store.get(first.session_id) is first and store.get(third.session_id) is third
+    with pytest.raises(KeyError):
+        store.get(second.session_id)
+
+
+def test_store_expires_idle_sessions():
+    store = LiveSessionStore(ttl=0.01)
+    session = store.create()
+    time.sleep(0.02)
+    with pytest.raises(KeyError):
+        store.get(session.session_id)
+
+
+def test_live_session_endpoints(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "live_sessions", LiveSessionStore())
+    client = TestClient(main.app)
+    session = client.post("/live/sessions", json={"specialty": "cardiology"}).json()
+    assert (session["specialty"], session["turns_total"]) == ("cardiology", 0)
+    path = f"/live/sessions/{session['session_id']}"
+
+    queued = client.post(f"{path}/turns", json={"turns": TURNS[:2], "analyze": False}).json()
+    assert (queued["turns_total"], queued["turns_processed"], queued["analysis"]) == (2, 0, "")
+    updated = client.post(f"{path}/turns", json={"text": "\n".join(TURNS[2:])}).json()
+    assert (updated["turns_total"], updated["turns_processed"], updated["updates"]) == (4, 4, 1)
+    assert updated["analysis"]
+    assert client.get(path).json() == updated
+
+    assert client.delete(path).json() == {"deleted": session["session_id"]}
+    assert client.get(path).status_code == 404
+    assert client.delete(path).status_code == 404
+    assert client.post(f"{path}/turns", json={"turns": TURNS}).status_code == 404
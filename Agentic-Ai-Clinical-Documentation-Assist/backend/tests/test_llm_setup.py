@@ -0,0 +1,19 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+
+import llm_setup
+
+
+def _client():
+    return SimpleNamespace(http_client=httpx.Client(), http_async_client=httpx.AsyncClient())
+
+
+def test_aclose_llms_closes_sync_and_async_pools(monkeypatch):
+    single, first, second = _client(), _client(), _client()
+    monkeypatch.setattr(llm_setup, "_llm_registry", {"large": single, "small": SimpleNamespace(clients=[first, second])})
+    asyncio.run(llm_setup.aclose_llms())
+    for client in (single, first, second):
+        assert client.http_client.is_closed and client.http_async_client.is_closed
+    assert llm_setup._llm_registry == {}
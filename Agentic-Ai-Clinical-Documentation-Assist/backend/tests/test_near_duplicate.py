@@ -0,0 +1,101 @@
+import asyncio
+import threading
+
+import pytest
+
+import agent_runtime
+import response_cache
+from agents import get_agent
+from metrics import capture_calls
+from near_duplicate import NearDuplicateIndex, fingerprint, parse_thresholds, similarity
+from response_cache import MemoryCacheBackend, ResponseCache
+
+RECORD = """Patient: Ana Silva, female, born 1971-04-02
+Conditions: Type 2 diabetes mellitus; Essential hypertension
+Medications:
+- metformin 500 mg twice daily
+- lisinopril 10 mg daily
+Denies chest pain. HbA1c 7.2 in 2023."""
+
+
+def test_parse_thresholds():
+    assert parse_thresholds(" preparation=0.95, dialogue=0.9,") == {"preparation": 0.95, "dialogue": 0.9}
+
+
+def test_trivial_edits_are_near_matches():
+    signature, guard = fingerprint(RECORD)
+    edited = RECORD.replace("\n", "\n  ").replace("twice daily", "twice  daily,")
+    reordered = RECORD.replace("- metformin 500 mg twice daily\n- lisinopril 10 mg daily",
+                               "- lisinopril 10 mg daily\n- metformin 500 mg twice daily")
+    for text in (edited, reordered):
+        other, other_guard = fingerprint(text)
+        assert other_guard == guard
+        assert similarity(signature, other) >= 0.9
+
+
+@pytest.mark.parametrize("changed", [
+    RECORD.replace("7.2", "8.1"),
+    RECORD.replace("Denies chest pain", "Reports chest pain"),
+    RECORD.replace("Ana Silva", "Eva Silva"),
+])
+def test_guard_rejects_clinical_and_identity_changes(changed):
+    index = NearDuplicateIndex({"preparation": 0.5})
+    index.add("scope", RECORD, "summary for Ana")
+    assert index.find("scope", RECORD, 0.5) == ("summary for Ana", 1.0)
+    assert index.find("scope", changed, 0.5) is None
+    assert index.find("other scope", RECORD, 0.5) is None
+
+
+def test_index_evicts_and_expires():
+    index = NearDuplicateIndex({}, max_entries=1, ttl=0)
+    index.add("scope", RECORD, "first")
+    index.add("scope", "Patient: Ben Cole. Asthma.", "second")
+    assert index.stats()["entries"] == 1
+    assert index.find("scope", RECORD, 0.5) is None
+
+    index = NearDuplicateIndex({}, ttl=-1)  # already expired when added
+    index.add("scope", RECORD, "stale")
+    assert index.find("scope", RECORD, 0.5) is None
+    assert index.stats()["entries"] == 0
+
+
+@pytest.fixture
+def near_index(monkeypatch):
+    index = NearDuplicateIndex({"preparation": 0.8})
+    monkeypatch.setattr(response_cache, "_cache", ResponseCache(MemoryCacheBackend()))
+    monkeypatch.setattr(agent_runtime, "get_near_duplicate_index", lambda: index)
+    return index
+
+
+def test_agent_reuses_a_near_duplicate_but_not_for_another_patient(near_index):
+    agent = get_agent("preparation")
+    with capture_calls() as calls:
+        first = agent.run(RECORD, raise_errors=True)
+        assert agent.run(RECORD.replace("twice daily", "twice daily."), raise_errors=True) == first
+        agent.run(RECORD.replace("Ana Silva", "Eva Silva"), raise_errors=True)
+    assert [call.cache for call in calls] == ["miss", "near", "miss"]
+    assert near_index.stats()["near_hits"] == 1
+
+
+def test_async_calls_fingerprint_off_the_event_loop(near_index, monkeypatch):
+    threads = []
+    find, add = near_index.find, near_index.add
+
+    def on_thread(func):
+        def wrapper(*args):
+            threads.append(threading.current_thread() is threading.main_thread())
+            return func(*args)
+        return wrapper
+
+    monkeypatch.setattr(near_index, "find", on_thread(find))
+    monkeypatch.setattr(near_index, "add", on_thread(add))
+    agent = get_agent("preparation")
+
+    async def main():
+        await agent.arun(RECORD, raise_errors=True)
+        return "".join([chunk async for chunk in agent.astream(RECORD.replace("twice daily", "twice daily."))])
+
+    with capture_calls() as calls:
+        asyncio.run(main())
+    assert [call.cache for call in calls] == ["miss", "near"]
+    assert threads and not any(threads)
@@ -0,0 +1,113 @@
+import asyncio
+import copy
+
+from fastapi.testclient import TestClient
+
+from agents import get_agent
+from fhir_compact import compact_patient
+from metrics import capture_calls
+from note_revision import NOTE_SECTIONS, affected_sections, note_sections, splice_sections
+
+PATIENT = {
+    "resourceType": "Patient",
+    "name": [{"given": ["Ana"], "family": "Silva"}],
+    "gender": "female",
+    "conditions": [{"code": {"text": "Type 2 diabetes mellitus"}}],
+    "observations": [{"code": {"text": "HbA1c"}, "valueQuantity": {"value": 7.2, "unit": "%"}}],
+    "medications": [{"medication": "metformin 500 mg"}],
+}
+WITH_NEW_LAB = copy.deepcopy(PATIENT)
+WITH_NEW_LAB["observations"].append({"code": {"text": "Blood pressure"}, "valueString": "150/95"})
+
+NOTE = """**Patient Information:**
+- Name: Ana Silva
+
+**Subjective:**
+• Reports fatigue
+
+**Objective:**
+• HbA1c 7.2 %
+
+**Assessment:**
+• Type 2 diabetes, suboptimal control
+
+**Plan:**
+• Continue metformin"""
+
+
+def test_affected_sections():
+    before = compact_patient(PATIENT)
+    assert affected_sections(before, before) == []
+    assert affected_sections(before, compact_patient(WITH_NEW_LAB)) == ["Objective", "Assessment"]
+    assert affected_sections(before, before.replace("metformin 500 mg", "metformin 1000 mg")) == ["Subjective", "Plan"]
+    # Whitespace, case and item order are not changes
+    assert affected_sections("Labs:\n- HbA1c 7.2\n- LDL 3.1", "Labs:\n-   LDL  3.1\n- hba1c 7.2") == []
+    # A block the triggers do not recognise may feed any section
+    assert affected_sections("Remarks: x", "Remarks: y") == list(NOTE_SECTIONS)
+
+
+def test_splice_replaces_only_the_given_sections():
+    regenerated = "**Objective:**\n• HbA1c 7.2 %, BP 150/95\n\n**Assessment:**\n• Uncontrolled hypertension"
+    spliced = splice_sections(NOTE, regenerated, ["Objective", "Assessment"])
+    before, after = note_sections(NOTE), note_sections(spliced)
+    assert after["objective"].strip() == "**Objective:**\n• HbA1c 7.2 %, BP 150/95"
+    assert after["assessment"].strip() == "**Assessment:**\n• Uncontrolled hypertension"
+    for title in ("patient information", "subjective", "plan"):
+        assert after[title] == before[title]
+    assert splice_sections(NOTE, regenerated, ["Objective", "Plan"]) is None
+
+
+def _revise(previous_note, previous, current):
+    agent = get_agent("note_generator")
+    with capture_calls() as calls:
+        result = agent.revise(previous_note, compact_patient(previous), compact_patient(current))
+    return result, calls
+
+
+def test_revise_regenerates_only_affected_sections():
+    agent = get_agent("note_generator")
+    note = agent.run(compact_patient(PATIENT), raise_errors=True)
+    result, calls = _revise(note, PATIENT, WITH_NEW_LAB)
+    assert (result["mode"], result["regenerated"]) == ("sections", ["Objective", "Assessment"])
+    assert [call.agent for call in calls] == ["note_revision"]
+    before, after = note_sections(note), note_sections(result["soap_note"])
+    assert before.keys() == after.keys()
+    for title in before:
+        if title in ("objective", "assessment"):
+            assert after[title] != before[title]
+        else:
+            assert after[title] == before[title]  # byte-identical
+
+    assert asyncio.run(agent.arevise(note, compact_patient(PATIENT), compact_patient(WITH_NEW_LAB))) == result
+
+
+def test_revise_unchanged_and_full():
+    note = get_agent("note_generator").run(compact_patient(PATIENT), raise_errors=True)
+    result, calls = _revise(note, PATIENT, PATIENT)
+    assert result == {"soap_note": note, "regenerated": [], "mode": "unchanged"}
+    assert calls == []
+
+    # A previous note without every section cannot be spliced, so it is regenerated whole
+    result, calls = _revise("**Plan:**\n• Continue metformin", PATIENT, WITH_NEW_LAB)
+    assert (result["mode"], result["regenerated"]) == ("full", list(NOTE_SECTIONS))
+    assert [call.agent for call in calls] == ["note_generator"]
+
+
+def test_revise_endpoint(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "_record", _no_record)
+    client = TestClient(main.app)
+    note = get_agent("note_generator").run(compact_patient(PATIENT), raise_errors=True)
+    body = {"patient_info": WITH_NEW_LAB, "previous_patient_info": PATIENT, "previous_note": note}
+    result = client.post("/generate-note/revise", json=body).json()
+    assert (result["mode"], result["regenerated"]) == ("sections", ["Objective", "Assessment"])
+    assert note_sections(result["soap_note"])["plan"] == note_sections(note)["plan"]
+    assert result["encounter_id"] == "recorded"
+
+    unchanged = client.post("/generate-note/revise", json=dict(body, patient_info=PATIENT)).json()
+    assert unchanged == {"soap_note": note, "regenerated": [], "mode": "unchanged"}
+
+
+async def _no_record(*args, **kwargs):
+    return "recorded"
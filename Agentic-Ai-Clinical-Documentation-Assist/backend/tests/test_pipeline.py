@@ -0,0 +1,8 @@
+from metrics import capture_calls
+from pipeline import VisitPipeline
+
+
+def test_sync_pipeline_calls_are_captured():
+    with capture_calls() as calls:
+        VisitPipeline().run("Patient: Ana, 52. Type 2 diabetes.", "Doctor: Any chest pain?\nPatient: No.", False)
+    assert sorted(call.agent for call in calls) == ["coder", "dialogue", "note_generator", "preparation"]
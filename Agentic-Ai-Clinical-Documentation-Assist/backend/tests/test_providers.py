@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from fake_llm import FakeChatModel
+from llm_setup import DEFAULT_MODEL, gemini_model
+from providers import ProviderHealth, ProviderPool
+
+
+def _pool(primary_latency=0, primary_errors=0.0, secondary_latency=0, **health_options):
+    primary = FakeChatModel(model_name="primary-model", latency_ms=primary_latency, error_rate=primary_errors)
+    secondary = FakeChatModel(model_name="secondary-model", latency_ms=secondary_latency)
+    return ProviderPool.create([("primary", primary), ("secondary", secondary)], **health_options)
+
+
+def _timed(func):
+    started = time.monotonic()
+    result = func()
+    return result, time.monotonic() - started
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_primary_answers_without_hedging():
+    pool = _pool(hedge_max=1)
+    assert pool.invoke("hello").content
+    assert pool.stats()["primary"]["samples"]["invoke"] == 1
+    assert pool.stats()["secondary"]["samples"]["invoke"] == 0
+
+
+@pytest.mark.parametrize("mode", ["invoke", "ainvoke", "stream", "astream"])
+def test_slow_primary_is_hedged(mode):
+    pool = _pool(primary_latency=2000, secondary_latency=20, hedge_min=0.05, hedge_max=0.2)
+    calls = {
+        "invoke": lambda: pool.invoke("hello"),
+        "ainvoke": lambda: asyncio.run(pool.ainvoke("hello")),
+        "stream": lambda: list(pool.stream("hello")),
+        "astream": lambda: asyncio.run(_collect(pool.astream("hello"))),
+    }
+    result, seconds = _timed(calls[mode])
+    assert result
+    assert seconds < 1.0
+
+
+def test_hedging_off_waits_for_primary():
+    pool = _pool(primary_latency=300, secondary_latency=0, hedge_max=0)
+    _, seconds = _timed(lambda: pool.invoke("hello"))
+    assert seconds >= 0.3
+    assert pool.stats()["secondary"]["samples"]["invoke"] == 0
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_failing_primary_fails_over_and_opens_circuit(asynchronous):
+    pool = _pool(primary_errors=1.0, failures=2, cooldown=60)
+    for _ in range(3):
+        assert (asyncio.run(pool.ainvoke("hello")) if asynchronous else pool.invoke("hello")).content
+    assert pool.health("primary").state == "open"
+    # The third call skipped the open primary
+    assert pool.health("primary").consecutive_failures == 2
+
+
+def test_half_open_probe_closes_circuit():
+    pool = _pool(primary_errors=1.0, failures=1, cooldown=0.1)
+    pool.invoke("hello")
+    assert pool.health("primary").state == "open"
+    pool.clients[0].error_rate = 0.0
+    time.sleep(0.15)
+    pool.invoke("hello")
+    assert pool.health("primary").state == "closed"
+
+
+def test_failed_probe_reopens_circuit():
+    pool = _pool(primary_errors=1.0, failures=1, cooldown=0.1)
+    pool.invoke("hello")
+    time.sleep(0.15)
+    pool.invoke("hello")
+    assert pool.health("primary").state == "open"
+
+
+def test_only_one_half_open_probe():
+    health = ProviderHealth("primary", failures=1, cooldown=0.05)
+    health.failed()
+    time.sleep(0.1)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(health.claim())) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 1
+    assert health.state == "half_open"
+
+
+def test_unused_half_open_provider_keeps_its_probe():
+    pool = _pool(failures=1, cooldown=0.05)
+    pool.health("secondary").failed()
+    time.sleep(0.1)
+    pool.invoke("hello")  # answered by the primary; the secondary is never reached
+    assert pool.health("secondary").claim()
+
+
+def test_all_providers_failing_raises():
+    pool = ProviderPool.create([("a", FakeChatModel(error_rate=1.0)), ("b", FakeChatModel(error_rate=1.0))])
+    with pytest.raises(Exception):
+        pool.invoke("hello")
+    # With every circuit open both providers are still tried
+    for name in ("a", "b"):
+        pool.health(name).state, pool.health(name).opened_at = "open", time.monotonic()
+    with pytest.raises(Exception):
+        pool.invoke("hello")
+    assert pool.health("a").consecutive_failures == 2
+
+
+def test_deadline_follows_latency_percentile():
+    health = ProviderHealth("primary", hedge_min=0.1, hedge_max=5)
+    assert health.deadline("invoke") == 5  # too few samples yet
+    for i in range(100):
+        health.succeeded("invoke", i / 100)
+    assert health.deadline("invoke") == pytest.approx(0.95)
+    assert health.deadline("stream") == 5
+
+
+def test_losing_stream_is_closed():
+    closed = []
+
+    class TrackedModel(FakeChatModel):
+        def _stream(self, *args, **kwargs):
+            try:
+                yield from super()._stream(*args, **kwargs)
+            finally:
+                closed.append(self.model_name)
+
+    primary = TrackedModel(model_name="slow", latency_ms=300)
+    secondary = TrackedModel(model_name="fast", latency_ms=0)
+    pool = ProviderPool.create([("primary", primary), ("secondary", secondary)], hedge_min=0.05, hedge_max=0.05)
+    assert list(pool.stream("hello"))
+    deadline = time.monotonic() + 2
+    while "slow" not in closed and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert sorted(closed) == ["fast", "slow"]
+
+
+def test_gemini_model_by_tier():
+    assert gemini_model(DEFAULT_MODEL) == "gemini-1.5-pro"
+    assert gemini_model("llama3-8b-8192") == "gemini-1.5-flash"
+    assert gemini_model("gemini-2.0-flash") == "gemini-2.0-flash"
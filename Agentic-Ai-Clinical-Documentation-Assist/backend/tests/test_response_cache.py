@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import pytest
+
+import response_cache
+from agents import get_agent
+from metrics import capture_calls
+from response_cache import MemoryCacheBackend, ResponseCache, SQLiteCacheBackend, make_cache_key
+
+
+def test_cache_key_ignores_whitespace_and_key_order():
+    key = make_cache_key("coder", "template", "model", {"text": "Type 2  diabetes\n", "extra": {"a": 1, "b": 2}})
+    assert key == make_cache_key("coder", "template", "model", {"extra": {"b": 2, "a": 1}, "text": "Type 2 diabetes"})
+    assert key != make_cache_key("coder", "template", "other-model", {"text": "Type 2 diabetes", "extra": {"a": 1, "b": 2}})
+    assert key != make_cache_key("coder", "template", "model", {"text": "Type 1 diabetes", "extra": {"a": 1, "b": 2}})
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryCacheBackend(max_entries=2)
+    return SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"), max_entries=2)
+
+
+def test_backend_evicts_least_recently_used(backend):
+    backend.set("a", "1", None)
+    backend.set("b", "2", None)
+    time.sleep(0.01)
+    assert backend.get("a") == "1"
+    time.sleep(0.01)
+    backend.set("c", "3", None)
+    assert (backend.get("a"), backend.get("b"), backend.get("c")) == ("1", None, "3")
+    assert len(backend) == 2
+
+
+def test_backend_expires_entries(backend):
+    backend.set("old", "1", time.time() - 1)
+    backend.set("new", "2", time.time() + 60)
+    assert (backend.get("old"), backend.get("new")) == (None, "2")
+
+
+def test_sqlite_backend_persists(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    SQLiteCacheBackend(path).set("key", "value", None)
+    assert SQLiteCacheBackend(path).get("key") == "value"
+
+
+def test_agent_calls_hit_bypass_and_coalesce(monkeypatch):
+    cache = ResponseCache(MemoryCacheBackend())
+    monkeypatch.setattr(response_cache, "_cache", cache)
+    agent = get_agent("preparation")
+    with capture_calls() as calls:
+        first = agent.run("Patient: Ana, 52. Type 2 diabetes.", raise_errors=True)
+        second = agent.run("Patient:  Ana, 52.\nType 2 diabetes.", raise_errors=True)
+        agent.run("Patient: Ana, 52. Type 2 diabetes.", use_cache=False, raise_errors=True)
+    assert first == second
+    assert [call.cache for call in calls] == ["miss", "hit", "bypass"]
+    assert cache.stats()["hits"] == 1
+
+    async def concurrent():
+        return await asyncio.gather(*(agent.arun("Patient: Ben, 61. Asthma.", use_cache=False, raise_errors=True)
+                                      for _ in range(3)))
+
+    with capture_calls() as calls:
+        assert len(set(asyncio.run(concurrent()))) == 1
+    assert sorted(call.cache for call in calls) == ["bypass", "coalesced", "coalesced"]
+
+
+def test_cache_stats_and_clear_endpoints(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    client = TestClient(main.app)
+    assert client.get("/cache/stats").json() == {"backend": None}
+    cache = ResponseCache(MemoryCacheBackend(), ttl=60)
+    monkeypatch.setattr(response_cache, "_cache", cache)
+    cache.set("key", "value")
+    cache.get("key"), cache.get("missing")
+    assert client.get("/cache/stats").json() == {"backend": "MemoryCacheBackend", "entries": 1, "hits": 1,
+                                                 "misses": 1, "hit_rate": 0.5}
+    assert client.post("/cache/clear").json() == {"cleared": True}
+    assert cache.stats()["entries"] == cache.hits == 0
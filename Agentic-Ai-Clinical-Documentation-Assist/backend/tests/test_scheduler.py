@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from scheduler import BATCH, INTERACTIVE, RequestScheduler, request_context
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+def test_call_releases_slot_after_success_and_error():
+    scheduler = RequestScheduler(max_concurrency=1)
+    assert scheduler.call(lambda: "ok", tokens=10) == "ok"
+    with pytest.raises(ValueError):
+        scheduler.call(lambda: (_ for _ in ()).throw(ValueError("bad")), tokens=10)
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_call_retries_rate_limit_errors():
+    scheduler = RequestScheduler(max_concurrency=1, backoff_base=0.01, backoff_max=0.01)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RateLimited()
+        return "ok"
+
+    assert scheduler.call(flaky, tokens=1) == "ok"
+    assert len(attempts) == 3
+    assert scheduler.retries == 2
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_acall_releases_slot_when_cancelled_by_timeout():
+    scheduler = RequestScheduler(max_concurrency=2)
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(scheduler.acall(lambda: asyncio.sleep(10), tokens=1), timeout=0.05)
+        assert scheduler.stats()["in_flight"] == 0
+        # Would hang forever if the two timed-out calls kept their slots
+        return await asyncio.wait_for(scheduler.acall(lambda: asyncio.sleep(0, "ok"), tokens=1), timeout=1)
+
+    assert asyncio.run(run()) == "ok"
+
+
+def test_acall_releases_slot_when_task_cancelled():
+    scheduler = RequestScheduler(max_concurrency=1)
+
+    async def run():
+        task = asyncio.ensure_future(scheduler.acall(lambda: asyncio.sleep(10), tokens=1))
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()["in_flight"] == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert scheduler.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_queue():
+    scheduler = RequestScheduler(max_concurrency=1)
+
+    async def run():
+        holder = asyncio.ensure_future(scheduler.acall(lambda: asyncio.sleep(0.1, "first"), tokens=1))
+        await asyncio.sleep(0.01)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(scheduler.acall(lambda: asyncio.sleep(0, "never"), tokens=1), timeout=0.02)
+        assert await holder == "first"
+        assert scheduler.stats()["queued_interactive"] == 0
+        assert scheduler.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_interactive_lane_served_before_batch():
+    scheduler = RequestScheduler(max_concurrency=1)
+    scheduler.acquire(1)
+    order = []
+
+    def waiter(priority, name):
+        scheduler.acquire(1, priority=priority)
+        order.append(name)
+        scheduler.release()
+
+    batch = threading.Thread(target=waiter, args=(BATCH, "batch"))
+    batch.start()
+    time.sleep(0.02)
+    interactive = threading.Thread(target=waiter, args=(INTERACTIVE, "interactive"))
+    interactive.start()
+    time.sleep(0.02)
+    scheduler.release()
+    batch.join(1)
+    interactive.join(1)
+    assert order == ["interactive", "batch"]
+
+
+def test_stream_releases_slot_when_closed_early():
+    scheduler = RequestScheduler(max_concurrency=1)
+    with request_context(priority=INTERACTIVE):
+        chunks = scheduler.stream(lambda: iter("abc"), tokens=1)
+        assert next(chunks) == "a"
+        chunks.close()
+    assert scheduler.stats()["in_flight"] == 0
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_do_runs_once_for_concurrent_callers():
+    flight, release, calls, results = SingleFlight(), threading.Event(), [], []
+
+    def slow():
+        calls.append(1)
+        assert release.wait(2)
+        return "answer"
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", slow))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)  # every caller is waiting on the first one by now
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert sorted(results) == [("answer", False)] * 3 + [("answer", True)]
+    assert flight._calls == {}
+
+
+def test_do_shares_the_error_and_forgets_the_key():
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do("key", lambda: (_ for _ in ()).throw(ValueError("upstream")))
+    assert flight.do("key", lambda: "fresh") == ("fresh", True)
+
+
+def test_ado_survives_a_cancelled_caller():
+    flight, calls = SingleFlight(), []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        first = asyncio.ensure_future(flight.ado("key", slow))
+        second = asyncio.ensure_future(flight.ado("key", slow))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == ("answer", False)
+    assert len(calls) == 1
+
+
+def test_stream_replays_chunks_to_a_late_follower():
+    flight, first_chunk, release = SingleFlight(), threading.Event(), threading.Event()
+
+    def chunks():
+        yield "a"
+        first_chunk.set()
+        assert release.wait(2)
+        yield from "bc"
+
+    leader_chunks, leader = flight.stream("key", chunks)
+    assert first_chunk.wait(2)
+    follower_chunks, follower_leads = flight.stream("key", chunks)
+    release.set()
+    assert (leader, follower_leads) == (True, False)
+    assert list(leader_chunks) == list(follower_chunks) == ["a", "b", "c"]
+
+
+def test_astream_cancels_the_producer_when_every_subscriber_leaves():
+    flight, cancelled = SingleFlight(), []
+
+    async def chunks():
+        try:
+            for chunk in "abc":
+                yield chunk
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def main():
+        leader_chunks, _ = flight.astream("key", chunks)
+        follower_chunks, leader = flight.astream("key", chunks)
+        assert not leader
+        taken = [await leader_chunks.__anext__() for _ in range(2)]
+        await leader_chunks.aclose()
+        taken += [await follower_chunks.__anext__() for _ in range(3)]
+        await follower_chunks.aclose()
+        await asyncio.sleep(0.01)
+        return taken
+
+    assert asyncio.run(main()) == ["a", "b", "a", "b", "c"]
+    assert cancelled == [1]
+
+
+@pytest.mark.parametrize("leader_leaves_early", [False, True])
+def test_astream_serves_a_follower_that_has_not_started_reading(leader_leaves_early):
+    flight, calls = SingleFlight(), []
+
+    async def chunks():
+        calls.append(1)
+        for chunk in "abc":
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def main():
+        leader_chunks, _ = flight.astream("key", chunks)
+        follower_chunks, leader = flight.astream("key", chunks)
+        assert not leader
+        if leader_leaves_early:
+            assert await leader_chunks.__anext__() == "a"
+            await leader_chunks.aclose()
+        else:
+            assert [chunk async for chunk in leader_chunks] == ["a", "b", "c"]
+        await asyncio.sleep(0.05)  # the producer has finished before the follower reads
+        return [chunk async for chunk in follower_chunks]
+
+    assert asyncio.run(main()) == ["a", "b", "c"]
+    assert calls == [1]
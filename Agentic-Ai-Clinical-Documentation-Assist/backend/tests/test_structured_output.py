@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.prompts import PromptTemplate
+
+from schemas import BillingCodes, PreVisitSummary
+from structured_output import (StructuredOutputError, ainvoke_structured, invoke_structured, parse_structured,
+                               repair_prompt, schema_skeleton)
+
+VALID = '{"patient_information": {"name": "Ana Silva", "age": 52}, "key_metrics_trend": ["HbA1c 7.2"]}'
+
+
+def test_parse_tolerates_fences_prose_and_a_numeric_age():
+    summary = parse_structured(f"Here you go:\n```json\n{VALID}\n```", PreVisitSummary)
+    assert summary.patient_information.age == "52"
+    assert summary.key_metrics_trend == ["HbA1c 7.2"]
+    assert parse_structured('{"patient_information": {"age": 52.5}}', PreVisitSummary).patient_information.age == "52.5"
+
+
+@pytest.mark.parametrize("text", ["no json here", '{"key_metrics_trend": "not a list"}',
+                                  '{"patient_information": {"age": true}}'])
+def test_parse_rejects_invalid_output(text):
+    with pytest.raises(StructuredOutputError) as error:
+        parse_structured(text, PreVisitSummary)
+    assert error.value.output == text
+
+
+def test_skeleton_leaves_out_fields_set_by_the_service():
+    assert "unverified_systems" not in schema_skeleton(BillingCodes)
+    assert '"age": "string"' in schema_skeleton(PreVisitSummary)
+
+
+def _chains(*responses):
+    llm = FakeListChatModel(responses=list(responses))
+    return PromptTemplate.from_template("{text}") | llm, repair_prompt(PreVisitSummary) | llm
+
+
+def test_invalid_output_is_repaired_once():
+    chain, repair_chain = _chains("not json", VALID)
+    result = invoke_structured(chain, repair_chain, {"text": "x"}, PreVisitSummary, "preparation", middleware=())
+    assert result.patient_information.name == "Ana Silva"
+
+    chain, repair_chain = _chains("not json", VALID)
+    result = asyncio.run(ainvoke_structured(chain, repair_chain, {"text": "x"}, PreVisitSummary, "preparation",
+                                            middleware=()))
+    assert result.patient_information.age == "52"
+
+
+def test_failed_repair_raises_with_the_last_output():
+    chain, repair_chain = _chains("not json", "still not json", VALID)
+    with pytest.raises(StructuredOutputError) as error:
+        invoke_structured(chain, repair_chain, {"text": "x"}, PreVisitSummary, "preparation", middleware=())
+    assert error.value.output == "still not json"
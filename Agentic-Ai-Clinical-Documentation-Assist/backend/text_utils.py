@@ -0,0 +1,154 @@
+# backend/text_utils.py
+"""Token estimates, transcript chunking and markdown section handling for agent I/O."""
+import re
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+# A speaker label at the start of a line or after sentence punctuation: "Doctor: ..."
+_TURN_PATTERN = re.compile(r"(?:^|(?<=[.?!]\s)|(?<=\n))\s*([A-Z][A-Za-z]*(?: [A-Z][A-Za-z]*)?):\s", re.M)
+_HEADING_PATTERN = re.compile(r"^\s*(?:#+\s*)?\*\*(?P<title>[^*]+?):?\*\*:?\s*(?P<rest>.*)$")
+_BULLET_PATTERN = re.compile(r"^\s*(?:[•\-*]|\d+[.)])\s+(?P<item>.+)$")
+_PLACEHOLDERS = {"not provided", "none", "none reported", "n/a", "not available", "not mentioned"}
+_LABELLED_SECTIONS = ("Patient Information",)
+
+
+def count_tokens(text: str) -> int:
+    """Approximate LLM token count (word pieces and punctuation)"""
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def split_turns(transcript: str) -> list:
+    """Split a transcript into speaker turns, keeping the speaker label on each turn"""
+    starts = [match.start(1) for match in _TURN_PATTERN.finditer(transcript)]
+    if not starts:
+        return [line.strip() for line in transcript.splitlines() if line.strip()]
+    turns = []
+    if transcript[:starts[0]].strip():
+        turns.append(transcript[:starts[0]].strip())
+    for start, end in zip(starts, starts[1:] + [len(transcript)]):
+        turn = transcript[start:end].strip()
+        if turn:
+            turns.append(turn)
+    return turns
+
+
+def chunk_turns(turns: list, max_tokens: int, overlap_tokens: int = 0) -> list:
+    """Group turns into windows of at most max_tokens, repeating trailing turns as overlap.
+
+    A single turn longer than max_tokens becomes its own window.
+    """
+    chunks = []
+    current, current_tokens = [], 0
+    for turn in turns:
+        tokens = count_tokens(turn)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(current)
+            overlap, overlap_size = [], 0
+            for previous in reversed(current):
+                size = count_tokens(previous)
+                if overlap_size + size > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += size
+            current, current_tokens = overlap, overlap_size
+        current.append(turn)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return ["\n".join(chunk) for chunk in chunks]
+
+
+def parse_sections(markdown: str) -> dict:
+    """Map each **Heading:** in agent output to its bullet items, in document order"""
+    sections = {}
+    current = None
+    for line in markdown.splitlines():
+        heading = _HEADING_PATTERN.match(line)
+        if heading:
+            current = heading.group("title").strip()
+            sections.setdefault(current, [])
+            rest = heading.group("rest").strip()
+            if rest:
+                sections[current].append(rest)
+            continue
+        if current is None or not line.strip():
+            continue
+        bullet = _BULLET_PATTERN.match(line)
+        sections[current].append((bullet.group("item") if bullet else line).strip())
+    return sections
+
+
+def section_blocks(markdown: str) -> list:
+    """(title, text) per **Heading:** block in document order; leading text has title None.
+
+    "\n".join of the texts gives back the markdown unchanged.
+    """
+    blocks, title, lines = [], None, []
+    for line in markdown.split("\n"):
+        heading = _HEADING_PATTERN.match(line)
+        if heading:
+            if lines or title is not None:
+                blocks.append((title, "\n".join(lines)))
+            title, lines = heading.group("title").strip(), []
+        lines.append(line)
+    blocks.append((title, "\n".join(lines)))
+    return blocks
+
+
+def is_placeholder(item: str) -> bool:
+    value = item.split(":", 1)[-1] if ":" in item else item
+    return value.strip().strip(".").lower() in _PLACEHOLDERS
+
+
+def _item_key(item: str) -> str:
+    return re.sub(r"[^\w]+", " ", item.lower()).strip()
+
+
+def merge_sections(parsed: list) -> dict:
+    """Union of several parse_sections results with duplicate and placeholder items removed"""
+    merged = {}
+    for sections in parsed:
+        for title, items in sections.items():
+            merged.setdefault(title, [])
+            for item in items:
+                merged[title].append(item)
+
+    for title, items in merged.items():
+        if title in _LABELLED_SECTIONS:
+            merged[title] = _merge_labelled(items)
+            continue
+        unique = dedupe_items(items)
+        real = [item for item in unique if not is_placeholder(item)]
+        merged[title] = real if real else unique[:1]
+    return merged
+
+
+def dedupe_items(items) -> list:
+    """Drop items that differ only in case, punctuation or spacing, keeping the first"""
+    seen, unique = set(), []
+    for item in items:
+        key = _item_key(item)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(item)
+    return unique
+
+
+def _merge_labelled(items: list) -> list:
+    # "Name: ..." style fields: keep one value per label, preferring a real value
+    values = {}
+    for item in items:
+        label, _, value = item.partition(":")
+        label = label.strip()
+        if label not in values or (is_placeholder(values[label]) and not is_placeholder(item)):
+            values[label] = item
+    return list(values.values())
+
+
+def render_sections(sections: dict) -> str:
+    """Inverse of parse_sections, in the bullet style the agent templates ask for"""
+    blocks = []
+    for title, items in sections.items():
+        marker = "-" if title in _LABELLED_SECTIONS else "•"
+        lines = [f"**{title}:**"] + [f"{marker} {item}" for item in items]
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)